@@ -0,0 +1,72 @@
+import argparse, os, sys, pathlib, tempfile, time, statistics, logging
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+import file_combine, master_append
+
+
+def syntheticLines(count, start=0):
+    return [[f"Agent {(start + i) % 250}", "10/12/2026", "08:00:00", "07:30:00", "00:30:00",
+             (start + i) % 97, (start + i) % 61, "01:02:03", (start + i) % 7, (start + i) % 11]
+            for i in range(count)]
+
+
+def createMaster(output_file):
+    report = file_combine.Report("Synthetic", "Agent")
+    report.period = "10/12/2026 00:00:00 - 10/12/2026 23:59:59"
+    report.content.extend(file_combine.AgentReport(*line[:1], *line[2:]) for line in syntheticLines(1))
+    file_combine.mergeData(output_file, [report], appendOnly=True)
+
+
+def timeAppend(output_file, batch, repeat):
+    timings = []
+    for _ in range(repeat):
+        lines = syntheticLines(batch)
+        start = time.perf_counter()
+        master_append.appendRows(output_file, "Agent", lines)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), max(timings)
+
+
+def timeFullMerge(output_file, batch):
+    report = file_combine.Report("Synthetic", "Agent")
+    report.period = "10/12/2026 00:00:00 - 10/12/2026 23:59:59"
+    report.content.extend(file_combine.AgentReport(*line[:1], *line[2:]) for line in syntheticLines(batch))
+    start = time.perf_counter()
+    file_combine.mergeData(output_file, [report])
+    return time.perf_counter() - start
+
+
+def run(argv=None):
+    parser = argparse.ArgumentParser(description="Append cost of Master.xlsx as the history grows")
+    parser.add_argument('--sizes', dest='sizes', type=int, nargs='+', default=[10000, 100000, 1000000],
+                        help='Master sizes in rows to measure at')
+    parser.add_argument('--batch', dest='batch', type=int, default=500, help='Rows appended per simulated run')
+    parser.add_argument('--repeat', dest='repeat', type=int, default=5, help='Simulated runs per master size')
+    parser.add_argument('--full_merge_limit', dest='full_merge_limit', type=int, default=100000,
+                        help='Also time the openpyxl load/save merge up to this master size')
+    known_args, _ = parser.parse_known_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as directory:
+        output_file = pathlib.Path(directory, "Master.xlsx")
+        createMaster(output_file)
+        rows = 1
+        print(f"{'rows':>10} {'append median s':>16} {'append max s':>13} {'master MB':>10} {'full merge s':>13}")
+        for size in sorted(known_args.sizes):
+            while rows < size:
+                chunk = min(50000, size - rows)
+                master_append.appendRows(output_file, "Agent", syntheticLines(chunk, rows))
+                rows += chunk
+            median, worst = timeAppend(output_file, known_args.batch, known_args.repeat)
+            rows += known_args.batch * known_args.repeat
+            fullMerge = "-"
+            if size <= known_args.full_merge_limit:
+                copy = pathlib.Path(directory, "Copy.xlsx")
+                copy.write_bytes(output_file.read_bytes())
+                fullMerge = f"{timeFullMerge(copy, known_args.batch):.3f}"
+                os.remove(copy)
+            print(f"{size:>10} {median:>16.4f} {worst:>13.4f} {output_file.stat().st_size / 2**20:>10.1f} {fullMerge:>13}")
+
+
+if __name__ == '__main__':
+    run()
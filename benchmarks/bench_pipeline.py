@@ -0,0 +1,113 @@
+import argparse, json, sys, pathlib, platform, subprocess, tempfile, time, logging
+import concurrent.futures, multiprocessing
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+import file_combine
+import synthetic_exports
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def peakRss():
+    # Peak resident set size of this process in MB, None where the resource module is not available
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (2**20 if sys.platform == "darwin" else 2**10), 1)
+
+
+def runCase(case, options):
+    '''
+    Time ingestion, merge and archive of one (files, master rows) case. Runs in a fresh process so the peak RSS
+    belongs to this case only.
+    '''
+    logging.basicConfig(level=logging.CRITICAL)
+    with tempfile.TemporaryDirectory() as directory:
+        base = pathlib.Path(directory)
+        for name in ("agent", "volume", "agent_archive", "volume_archive"):
+            (base / name).mkdir()
+        synthetic_exports.generateExports(base / "agent", "Agent", case["files"], options["agent_rows"])
+        synthetic_exports.generateExports(base / "volume", "Volume", case["files"], options["volume_rows"])
+        master = base / "Master.xlsx"
+        if case["master_rows"] > 0:
+            synthetic_exports.writeMaster(master, case["master_rows"], case["master_rows"] // 4)
+        if options["append_only"] and master.exists():
+            file_combine.master_append.prepareMaster(master)
+        masterBytes = master.stat().st_size if master.exists() else 0
+        stages = {}
+
+        start = time.perf_counter()
+        reports = []
+        for reportType, name in (("Agent", "agent"), ("Volume", "volume")):
+            _, typeReports = file_combine.getAllFileData(base / name, reportType, streaming=options["streaming"],
+                                                         workers=options["workers"])
+            reports.extend(typeReports)
+        stages["ingest"] = {"seconds": round(time.perf_counter() - start, 4), "peak_rss_mb": peakRss(),
+                            "rows": sum(len(report.content) for report in reports)}
+
+        start = time.perf_counter()
+        results = file_combine.mergeAllData(master, reports, appendOnly=options["append_only"])
+        stages["merge"] = {"seconds": round(time.perf_counter() - start, 4), "peak_rss_mb": peakRss(),
+                           "rows": sum(success for success, _ in results.values()),
+                           "master_bytes_before": masterBytes, "master_bytes_after": master.stat().st_size}
+
+        start = time.perf_counter()
+        file_combine.removeInputFile(base / "agent", archive_directory=base / "agent_archive", archive=True)
+        file_combine.removeInputFile(base / "volume", archive_directory=base / "volume_archive", archive=True)
+        stages["archive"] = {"seconds": round(time.perf_counter() - start, 4), "peak_rss_mb": peakRss(),
+                             "files": case["files"] * 2}
+    return dict(case, stages=stages)
+
+
+def gitRevision():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                              cwd=pathlib.Path(__file__).resolve().parent).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run(argv=None):
+    parser = argparse.ArgumentParser(description="Time ingestion, mergeData and removeInputFile on synthetic exports")
+    parser.add_argument('--files', dest='files', type=int, nargs='+', default=[1, 10, 50],
+                        help='Daily exports per report type')
+    parser.add_argument('--master_rows', dest='master_rows', type=int, nargs='+', default=[0, 10000, 100000],
+                        help='Agent rows of history in the master, Volume gets a quarter of it')
+    parser.add_argument('--agent_rows', dest='agent_rows', type=int, default=50, help='Agents per export')
+    parser.add_argument('--volume_rows', dest='volume_rows', type=int, default=20, help='Topics per export')
+    parser.add_argument('--streaming', dest='streaming', action='store_true', help='Run ingestion with --streaming')
+    parser.add_argument('--workers', dest='workers', type=int, default=1, help='Run ingestion with --workers')
+    parser.add_argument('--append_only', dest='append_only', action='store_true', help='Merge with --append_only')
+    parser.add_argument('--label', dest='label', default=None, help='Free text stored with the results')
+    parser.add_argument('--output', dest='output', default=None, help='JSON results file, printed when omitted')
+    known_args, _ = parser.parse_known_args(argv)
+
+    options = {"agent_rows": known_args.agent_rows, "volume_rows": known_args.volume_rows,
+               "streaming": known_args.streaming, "workers": known_args.workers,
+               "append_only": known_args.append_only}
+    results = []
+    for files in known_args.files:
+        for masterRows in known_args.master_rows:
+            case = {"files": files, "master_rows": masterRows}
+            with concurrent.futures.ProcessPoolExecutor(max_workers=1,
+                                                        mp_context=multiprocessing.get_context("spawn")) as pool:
+                result = pool.submit(runCase, case, options).result()
+            print(f"files={files} master_rows={masterRows} " +
+                  " ".join(f"{stage}={values['seconds']}s" for stage, values in result["stages"].items()),
+                  file=sys.stderr)
+            results.append(result)
+
+    report = {"label": known_args.label, "revision": gitRevision(), "python": platform.python_version(),
+              "platform": platform.platform(), "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "options": options, "results": results}
+    if known_args.output:
+        pathlib.Path(known_args.output).write_text(json.dumps(report, indent=2))
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,58 @@
+import argparse, sys, pathlib, time, tracemalloc
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+import file_combine
+from report_batch import ReportBatch
+
+
+def syntheticRows(count):
+    for i in range(count):
+        yield (f"Agent {i % 250}", "08:00:00", "07:30:00", "00:30:00", str(i % 97), str(i % 61), "01:02:03",
+               str(i % 7), str(i % 11))
+
+
+def objectContent(count):
+    # The row handling before ReportBatch: a content dict, an AgentReport and a getLineEntry list per row
+    report = file_combine.Report("Synthetic", "Agent")
+    content = []
+    for row in syntheticRows(count):
+        data = {"agent": row[0], "loggedIn": row[1], "signedOn": row[2], "breakTime": row[3],
+                "incomingCalls": row[4], "answeredIncoming": row[5], "talkTime": row[6],
+                "abondonedIncomingCalls": row[7], "outgoingCalls": row[8]}
+        content.append(report.buildReport(data))
+    return content, [data.getLineEntry("10/12/2026") for data in content]
+
+
+def batchContent(count):
+    batch = ReportBatch(file_combine.AgentReport)
+    batch.extendValues(syntheticRows(count))
+    lines, _ = batch.lines("10/12/2026")
+    return batch, lines
+
+
+def measure(function, count):
+    start = time.perf_counter()
+    function(count)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    content, lines = function(count)
+    _, peak = tracemalloc.get_traced_memory()
+    del lines
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, current
+
+
+def run(argv=None):
+    parser = argparse.ArgumentParser(description="Row objects versus columnar ReportBatch content")
+    parser.add_argument('--rows', dest='rows', type=int, default=500000, help='Synthetic Agent rows')
+    known_args, _ = parser.parse_known_args(argv)
+
+    print(f"{'content':>8} {'parse+lines s':>14} {'peak MB':>9} {'content MB':>11}")
+    for name, function in (("objects", objectContent), ("columnar", batchContent)):
+        elapsed, peak, current = measure(function, known_args.rows)
+        print(f"{name:>8} {elapsed:>14.3f} {peak / 2**20:>9.1f} {current / 2**20:>11.1f}")
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,72 @@
+import argparse, os, sys, pathlib, subprocess, tempfile, time, statistics
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+# Modules a scheduled run finding nothing to do must not import
+HEAVY_MODULES = ("openpyxl", "win32com", "concurrent.futures.process", "logging.handlers", "xml.sax.saxutils")
+
+
+def timeCommand(command, repeat, cwd, env):
+    # The first start writes the bytecode caches and is not timed
+    subprocess.run(command, cwd=cwd, env=env, check=True, stdout=subprocess.DEVNULL)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=cwd, env=env, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000, max(timings) * 1000
+
+
+def heavyImports(module):
+    '''
+    :returns The HEAVY_MODULES loaded by importing module in a fresh interpreter
+    '''
+    code = (f"import sys; sys.path.insert(0, {str(ROOT)!r}); import {module}; "
+            f"print(' '.join(name for name in {HEAVY_MODULES!r} if name in sys.modules))")
+    return subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True).stdout.split()
+
+
+def run(argv=None):
+    parser = argparse.ArgumentParser(description="Start-up cost of the file_combine, fetch_merge and email_reader "
+                                                 "entry points, and of a file_combine run finding no input files")
+    parser.add_argument('--repeat', dest='repeat', type=int, default=10, help='Interpreter starts per case')
+    parser.add_argument('--budget_ms', dest='budget_ms', type=float, default=None,
+                        help='Exit with status 1 when a case takes longer than the bare interpreter plus this budget')
+    known_args, _ = parser.parse_known_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        base = pathlib.Path(directory)
+        for name in ("agent", "volume", "agent_archive", "volume_archive"):
+            (base / name).mkdir()
+        cases = [("python", [sys.executable, "-c", "pass"])]
+        for module in ("file_combine", "fetch_merge", "email_reader"):
+            cases.append((f"import {module}", [sys.executable, "-c", f"import {module}"]))
+        cases.append(("file_combine, no input", [sys.executable, str(ROOT / "file_combine.py"),
+                                                 f"--agent_input_directory={base / 'agent'}",
+                                                 f"--volume_input_directory={base / 'volume'}",
+                                                 f"--agent_archive_directory={base / 'agent_archive'}",
+                                                 f"--volume_archive_directory={base / 'volume_archive'}",
+                                                 f"--master_output_file={base / 'Master.xlsx'}"]))
+        # The entry points are run from the repository, file_combine.log goes to the temp directory
+        environment = dict(os.environ, PYTHONPATH=str(ROOT))
+        print(f"{'case':<24} {'median ms':>10} {'max ms':>8} {'over python ms':>15}")
+        baseline = None
+        failed = False
+        for name, command in cases:
+            median, worst = timeCommand(command, known_args.repeat, base, environment)
+            baseline = median if baseline is None else baseline
+            print(f"{name:<24} {median:>10.1f} {worst:>8.1f} {median - baseline:>15.1f}")
+            if known_args.budget_ms is not None and median - baseline > known_args.budget_ms:
+                failed = True
+
+    for module in ("file_combine", "fetch_merge", "email_reader"):
+        loaded = heavyImports(module)
+        if loaded:
+            print(f"import {module} loads {', '.join(loaded)}")
+            failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,116 @@
+import argparse, sys, pathlib, random, tempfile
+from datetime import date, timedelta
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+import openpyxl
+import file_combine
+from columnar_store import ColumnarStore, rebuildMaster
+
+
+def duration(seconds):
+    return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+def metadataRows(reportType, day):
+    period = day.strftime("%m/%d/%Y")
+    return [["Type", f"{reportType} Report"],
+            ["Created", f"{(day + timedelta(days=1)).strftime('%m/%d/%Y')} 06:00:00"],
+            ["Period", f"{period} 00:00:00 - {period} 23:59:59"],
+            ["Weekly", "No"],
+            ["Daily", "Yes"],
+            ["Resolution", "Day"],
+            ["Cycle", "1"],
+            [None],
+            [header for index, header in enumerate(file_combine._entryClasses[reportType].getHeaders()) if index != 1]]
+
+
+def agentRow(rng, index):
+    incoming = rng.randint(0, 120)
+    answered = rng.randint(0, incoming)
+    return [f"Agent {index:04d}", duration(rng.randint(6, 9) * 3600), duration(rng.randint(5, 8) * 3600),
+            duration(rng.randint(0, 5400)), incoming, answered, duration(answered * rng.randint(60, 400)),
+            incoming - answered, rng.randint(0, 30)]
+
+
+def volumeRow(rng, index):
+    incoming = rng.randint(0, 2000)
+    lost = rng.randint(0, incoming // 10)
+    return [f"Topic {index:03d}", incoming, lost, rng.randint(0, lost), duration(rng.randint(60, 600)),
+            duration(rng.randint(600, 3600)), duration(rng.randint(5, 120)), duration(rng.randint(120, 900)),
+            f"{rng.randint(60, 100)}%", rng.randint(0, 50)]
+
+
+def writeExport(path, reportType, day, rows, rng):
+    '''
+    Write an export shaped like the "Table" sheet getAllFileData reads: the metadata rows, one row per agent or
+    topic and, for Agent exports, the "Log." legend footer.
+    '''
+    xlsx = openpyxl.Workbook(write_only=True)
+    sheet = xlsx.create_sheet("Table")
+    for row in metadataRows(reportType, day):
+        sheet.append(row)
+    for index in range(rows):
+        sheet.append(agentRow(rng, index) if reportType == "Agent" else volumeRow(rng, index))
+    if reportType == "Agent":
+        sheet.append(["Log. = Logged in, Sign. = Signed on"])
+    xlsx.save(path)
+
+
+def generateExports(directory, reportType, fileCount, rows, firstDay=date(2026, 1, 1), seed=0):
+    '''
+    :returns The paths of fileCount daily exports of the report type written to directory
+    '''
+    rng = random.Random(f"{seed}-{reportType}")
+    prefix = "AgentDaily" if reportType == "Agent" else "Traffic Data Daily"
+    paths = []
+    for offset in range(fileCount):
+        day = firstDay + timedelta(days=offset)
+        path = pathlib.Path(directory, f"{prefix}_{day.strftime('%Y%m%d')}.xlsx")
+        writeExport(path, reportType, day, rows, rng)
+        paths.append(path)
+    return paths
+
+
+def writeMaster(output_file, agentRows, volumeRows, seed=0):
+    '''
+    Write a master holding agentRows/volumeRows rows of synthetic history, built through a columnar store.
+    '''
+    rng = random.Random(f"{seed}-master")
+    with tempfile.TemporaryDirectory() as storeDirectory:
+        store = ColumnarStore(storeDirectory)
+        for reportType, total, rowFunction, perDay in (("Agent", agentRows, agentRow, 50),
+                                                       ("Volume", volumeRows, volumeRow, 20)):
+            lines = []
+            for index in range(total):
+                day = date(2020, 1, 1) + timedelta(days=index // perDay)
+                row = rowFunction(rng, index % perDay)
+                if reportType == "Volume":
+                    row[8] = float(row[8].rstrip("%"))
+                lines.append(row[:1] + [day.strftime("%m/%d/%Y")] + row[1:])
+            if lines:
+                store.appendLines(reportType, file_combine.getStoreSchema(reportType), lines)
+        rebuildMaster(storeDirectory, output_file)
+
+
+def run(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic Agent/Volume daily exports")
+    parser.add_argument('--output_directory', dest='output_directory', required=True,
+                        help='Directory receiving agent/ and volume/ input directories')
+    parser.add_argument('--files', dest='files', type=int, default=5, help='Daily exports per report type')
+    parser.add_argument('--agent_rows', dest='agent_rows', type=int, default=50, help='Agents per export')
+    parser.add_argument('--volume_rows', dest='volume_rows', type=int, default=20, help='Topics per export')
+    parser.add_argument('--master_rows', dest='master_rows', type=int, default=0,
+                        help='Also write a Master.xlsx with this many Agent rows of history')
+    known_args, _ = parser.parse_known_args(argv)
+
+    for reportType, rows in (("Agent", known_args.agent_rows), ("Volume", known_args.volume_rows)):
+        directory = pathlib.Path(known_args.output_directory, reportType.lower())
+        directory.mkdir(parents=True, exist_ok=True)
+        generateExports(directory, reportType, known_args.files, rows)
+    if known_args.master_rows > 0:
+        writeMaster(pathlib.Path(known_args.output_directory, "Master.xlsx"), known_args.master_rows,
+                    known_args.master_rows // 4)
+
+
+if __name__ == '__main__':
+    run()
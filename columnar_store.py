@@ -0,0 +1,194 @@
+import argparse, csv, gzip, json, os, pathlib, sys, logging, warnings
+from datetime import datetime, timedelta
+from report_batch import parseDuration
+from master_commit import saveWorkbook, replaceFile, tempPath
+
+
+class ColumnarStore(object):
+    '''
+    Sidecar copy of the merged rows as gzip compressed CSV, partitioned by report type and extract date:
+
+        <store>/<Agent|Volume>/schema.json
+        <store>/<Agent|Volume>/<YYYY-MM-DD>.csv.gz
+
+    schema.json holds the headers of AgentReport/VolumeReport.getHeaders, the type of every column and the master
+    sheet and table names, so readers and rebuildMaster need nothing else. Appending a day only touches that day's
+    partition, new rows are added as an extra gzip member behind the existing ones.
+    '''
+    def __init__(self, inStoreDirectory):
+        self.storeDirectory = pathlib.Path(inStoreDirectory)
+
+    def partitionPath(self, reportType, extractDate):
+        try:
+            partition = datetime.strptime(str(extractDate), "%m/%d/%Y").strftime("%Y-%m-%d")
+        except ValueError:
+            partition = "".join(c if c.isalnum() else "-" for c in str(extractDate))
+        return self.storeDirectory / reportType / f"{partition}.csv.gz"
+
+    def writeSchema(self, reportType, schema):
+        schemaPath = self.storeDirectory / reportType / "schema.json"
+        if schemaPath.exists(): return
+        schemaPath.parent.mkdir(parents=True, exist_ok=True)
+        schemaPath.write_text(json.dumps(schema, indent=2))
+
+    def readSchema(self, reportType):
+        return json.loads((self.storeDirectory / reportType / "schema.json").read_text())
+
+    def reportTypes(self):
+        if not self.storeDirectory.is_dir(): return []
+        return sorted(path.name for path in self.storeDirectory.iterdir() if (path / "schema.json").exists())
+
+    def appendLines(self, reportType, schema, lines, replace=False):
+        '''
+        :arg reportType - "Agent" or "Volume"
+        :arg schema - {"headers", "kinds", "sheet", "table"} written to schema.json for a new report type
+        :arg lines - Rows as returned by getLineEntry, the second column is the extract date
+        :arg replace - Lines replace the rows of the same (extract date, agent/topic), as the master does with an
+        upsert, see replacePartition
+
+        :returns A count of the lines written
+        '''
+        self.writeSchema(reportType, schema)
+        partitions = {}
+        for line in lines:
+            partitions.setdefault(line[1], []).append(line)
+        for extractDate, partitionLines in partitions.items():
+            partitionPath = self.partitionPath(reportType, extractDate)
+            if replace:
+                self.replacePartition(partitionPath, schema, partitionLines)
+                continue
+            newPartition = not partitionPath.exists()
+            with gzip.open(partitionPath, "at", newline="", encoding="utf-8") as fh:
+                writer = csv.writer(fh)
+                if newPartition:
+                    writer.writerow(schema["headers"])
+                writer.writerows([_formatDuration(value) if isinstance(value, timedelta) else value for value in line]
+                                 for line in partitionLines)
+            logging.info(f"{len(partitionLines)} rows written to {reportType}/{partitionPath.name}")
+        return len(lines)
+
+    def replacePartition(self, partitionPath, schema, lines):
+        '''
+        Rewrite a day partition with the lines replacing the rows of their agent/topic and the others appended, a
+        later line of the same key wins as in file_combine.upsertLines. The partition is renamed into place.
+        '''
+        rows = {}
+        if partitionPath.exists():
+            with gzip.open(partitionPath, "rt", newline="", encoding="utf-8") as fh:
+                reader = csv.reader(fh)
+                next(reader, None)
+                for row in reader:
+                    rows.setdefault((row[1], row[0]), []).append(row)
+        for line in lines:
+            rows[(str(line[1]), str(line[0]))] = [[_formatDuration(value) if isinstance(value, timedelta) else value
+                                                   for value in line]]
+        temp = tempPath(partitionPath)
+        try:
+            with gzip.open(temp, "wt", newline="", encoding="utf-8") as fh:
+                writer = csv.writer(fh)
+                writer.writerow(schema["headers"])
+                for keyRows in rows.values():
+                    writer.writerows(keyRows)
+            replaceFile(temp, partitionPath)
+        except BaseException:
+            temp.unlink(missing_ok=True)
+            raise
+        logging.info(f"{len(lines)} rows replaced or added in {partitionPath.parent.name}/{partitionPath.name}")
+
+    def readLines(self, reportType):
+        '''
+        :returns Generator of typed rows of the report type in extract date order
+        '''
+        converters = {"int": int, "float": float, "seconds": _toSeconds, "duration": _toDuration}
+        kinds = self.readSchema(reportType)["kinds"]
+        for partitionPath in sorted((self.storeDirectory / reportType).glob("*.csv.gz")):
+            with gzip.open(partitionPath, "rt", newline="", encoding="utf-8") as fh:
+                reader = csv.reader(fh)
+                next(reader, None)
+                for row in reader:
+                    yield [None if value == "" else converters.get(kind, str)(value) for kind, value in zip(kinds, row)]
+
+
+def _formatDuration(value):
+    seconds = int(value.total_seconds())
+    return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+def _toSeconds(value):
+    # Durations that did not parse were stored as exported
+    return int(value) if value.isdigit() else value
+
+
+def _toDuration(value):
+    seconds = parseDuration(value)
+    return value if seconds is None else timedelta(seconds=seconds)
+
+
+def rebuildMaster(store_directory, output_file):
+    '''
+    :arg store_directory - Columnar store written by file_combine --store_directory
+    :arg output_file - Location of the Master.xlsx to (re)create
+
+    Write every report type of the store to its daily sheet and results table in a new master workbook.
+
+    :returns {reportType: rows written}
+    '''
+    import openpyxl
+    from openpyxl.utils import get_column_letter
+    from openpyxl.worksheet.filters import AutoFilter
+    from openpyxl.worksheet.table import Table, TableColumn, TableStyleInfo
+
+    store = ColumnarStore(store_directory)
+    xlsx = openpyxl.Workbook(write_only=True)
+    results = {}
+    for reportType in store.reportTypes():
+        schema = store.readSchema(reportType)
+        sheet = xlsx.create_sheet(schema["sheet"])
+        sheet.append(schema["headers"])
+        rows = 0
+        for line in store.readLines(reportType):
+            sheet.append(line)
+            rows += 1
+        ref = f"A1:{get_column_letter(len(schema['headers']))}{rows + 1}"
+        table = Table(displayName=schema["table"], ref=ref, autoFilter=AutoFilter(ref=ref),
+                      tableColumns=[TableColumn(id=index, name=header)
+                                    for index, header in enumerate(schema["headers"], start=1)])
+        table.tableStyleInfo = TableStyleInfo(name="TableStyleMedium2", showFirstColumn=False,
+                                              showLastColumn=False, showRowStripes=True, showColumnStripes=False)
+        with warnings.catch_warnings():
+            # Columns are given above, openpyxl warns about write-only tables regardless
+            warnings.simplefilter("ignore")
+            sheet.add_table(table)
+        results[reportType] = rows
+        logging.info(f"{rows} {reportType} rows rebuilt from {store_directory}")
+    saveWorkbook(xlsx, output_file)
+    return results
+
+
+def run(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--store_directory',
+        dest='store_directory',
+        required=True,
+        help='Columnar store written by file_combine --store_directory')
+    parser.add_argument(
+        '--master_output_file',
+        dest='master_output_file',
+        required=True,
+        help='Output file name and location of the rebuilt master')
+    known_args, _ = parser.parse_known_args(argv)
+
+    logging.basicConfig(filename='columnar_store.log', filemode='w', level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s',
+                        datefmt='%d-%b-%y %H:%M:%S')
+
+    if os.path.isdir(known_args.store_directory) == False:
+        logging.error(f"Invalid directory for argument --store_directory")
+        sys.exit()
+    rebuildMaster(known_args.store_directory, known_args.master_output_file)
+
+
+if __name__ == '__main__':
+  run()
+  print("Done")
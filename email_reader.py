@@ -1,45 +1,215 @@
-import os, argparse, sys, pathlib,logging, shutil, zipfile
+import os, argparse, sys, pathlib,logging, zipfile, json, tempfile, time, collections
+import concurrent.futures
 from io import BytesIO
 from datetime import datetime, timedelta
-from win32com.client.gencache import EnsureDispatch as Dispatch
+from master_commit import writeBytes
+
+PR_ATTACH_DATA_BIN = "http://schemas.microsoft.com/mapi/proptag/0x37010102"
+
+
+def attachmentBytes(attachment):
+    '''
+    :returns The content of an Outlook attachment, read through the MAPI property where possible and through a
+    temporary file otherwise (the property is not available for every attachment size and store)
+    '''
+    try:
+        return bytes(attachment.PropertyAccessor.GetProperty(PR_ATTACH_DATA_BIN))
+    except Exception:
+        logging.debug(f"{attachment.FileName} - Attachment data not available in memory", exc_info=True)
+    with tempfile.TemporaryDirectory() as directory:
+        filePath = os.path.join(directory, attachment.FileName)
+        attachment.SaveAsFile(filePath)
+        with open(filePath, "rb") as fh:
+            return fh.read()
+
+
+def sentOn(message):
+    # pywin32 hands SentOn out as an aware datetime holding the local time, compare it as a naive local time
+    return datetime(*message.SentOn.timetuple()[:6])
+
+
+def outlookNamespace():
+    '''
+    :returns The MAPI namespace of Outlook
+
+    win32com.client.Dispatch binds through the makepy wrappers already in the gencache and late-binds otherwise.
+    Unlike gencache.EnsureDispatch it never (re)generates the Outlook type library wrappers on a scheduled run.
+    '''
+    from win32com.client import Dispatch
+    return Dispatch("Outlook.Application").GetNamespace("MAPI")
+
+
+def emptyWindow(window):
+    # A window ending before it starts, e.g. a --to day already behind the high-water mark
+    return window is not None and window[0] >= window[1]
+
+
+def messageWindow(dateFrom=None, dateTo=None, highWaterMark=None):
+    '''
+    :arg dateFrom, dateTo - First and last day (YYYY-MM-DD) of a backfill, both included
+    :arg highWaterMark - SentOn of the newest message handled by an earlier run
+
+    :returns (startDate, endDate, after) for Message.window. Without dateFrom the window continues after the
+    high-water mark, without dateTo it runs until now, so a scheduled run resumes where the last one stopped. None
+    for the daily lookup of getLookupDate when neither a date nor a high-water mark is given.
+    '''
+    if dateFrom is None and dateTo is None and highWaterMark is None: return None
+    endDate = datetime.strptime(dateTo, "%Y-%m-%d") + timedelta(days=1) if dateTo else datetime.now()
+    if dateFrom is not None:
+        return datetime.strptime(dateFrom, "%Y-%m-%d"), endDate, None
+    if highWaterMark is None:
+        raise ValueError("No high-water mark recorded yet, a start date is required")
+    return highWaterMark, endDate, highWaterMark
+
+
+class HighWaterMark(object):
+    '''
+    SentOn of the newest report message handled per Outlook folder, kept in a JSON state file so the next run can
+    continue after it.
+    '''
+    def __init__(self, inStateFile):
+        self.stateFile = pathlib.Path(inStateFile)
+        try:
+            self.state = json.loads(self.stateFile.read_text()) if self.stateFile.exists() else {}
+        except (OSError, ValueError) as e:
+            logging.warning(f"{self.stateFile} - Unable to read high-water mark - {e}")
+            self.state = {}
+
+    def get(self, folder):
+        value = self.state.get("folders", {}).get(folder)
+        return datetime.fromisoformat(value) if value else None
+
+    def set(self, folder, sent):
+        if sent is None: return
+        current = self.get(folder)
+        if current is not None and current >= sent: return
+        self.state.setdefault("folders", {})[folder] = sent.isoformat()
+        try:
+            writeBytes(self.stateFile, json.dumps(self.state, indent=2).encode("utf-8"))
+        except OSError as e:
+            logging.warning(f"{self.stateFile} - Unable to write high-water mark - {e}")
+        else:
+            logging.info(f"High-water mark of {folder} moved to {sent.isoformat()}")
+
+
+def zipMembers(data, suffix=".xlsx"):
+    '''
+    :returns Generator of (member name, bytes) for the members of zip bytes ending in suffix
+    '''
+    with zipfile.ZipFile(BytesIO(data)) as zf:
+        for name in zf.namelist():
+            if name.endswith(suffix):
+                yield name, zf.read(name)
+
+
+class FolderIndex(object):
+    '''
+    Outlook folder paths ("Mailbox/Inbox/Call Center Reports") mapped to their EntryID and StoreID. The folder tree is
+    walked once and the index is kept in a JSON cache file, later runs open the folder straight from its EntryID with
+    GetFolderFromID and only walk the tree again when the folder is unknown or was moved.
+    '''
+    def __init__(self, inNamespace=None, inCacheFile=None):
+        self.namespace = inNamespace
+        self.cacheFile = pathlib.Path(inCacheFile) if inCacheFile else None
+        self.folders = self.load()
+        self.liveFolders = {}
+
+    def load(self):
+        if self.cacheFile is None or not self.cacheFile.exists(): return {}
+        try:
+            return json.loads(self.cacheFile.read_text()).get("folders", {})
+        except (OSError, ValueError) as e:
+            logging.warning(f"{self.cacheFile} - Unable to read folder index - {e}")
+            return {}
+
+    def save(self):
+        if self.cacheFile is None: return
+        try:
+            writeBytes(self.cacheFile, json.dumps({"folders": self.folders}, indent=2).encode("utf-8"))
+        except OSError as e:
+            logging.warning(f"{self.cacheFile} - Unable to write folder index - {e}")
+
+    def build(self, rootFolders):
+        '''
+        :arg rootFolders - Folders collection of the MAPI namespace
+
+        Walk every folder at any depth, each folder is followed by its subfolders as Outlook lists them.
+        '''
+        self.folders = {}
+        self.liveFolders = {}
+        self.walk(rootFolders, "")
+        logging.info(f"Indexed {len(self.folders)} Outlook folders")
+        self.save()
+
+    def walk(self, folders, parent):
+        for index in range(1, folders.Count + 1):
+            folder = folders[index]
+            path = f"{parent}/{folder.Name}" if parent else folder.Name
+            self.folders[path] = [folder.EntryID, folder.StoreID]
+            self.liveFolders[path] = folder
+            try:
+                self.walk(folder.Folders, path)
+            except Exception:
+                logging.debug(f"{path} - Unable to list sub folders", exc_info=True)
+
+    def find(self, folder):
+        '''
+        :arg folder - Folder name matched at any depth, or the trailing part of its path
+
+        :returns The path of the first matching folder, or None
+        '''
+        if folder in self.folders:
+            return folder
+        for path in self.folders:
+            if path.endswith(f"/{folder}"):
+                return path
+        return None
+
+    def open(self, rootFolders, folder):
+        '''
+        :returns The Outlook folder, or None when it does not exist
+        '''
+        for attempt in range(2):
+            path = self.find(folder)
+            if path in self.liveFolders:
+                return self.liveFolders[path]
+            if path is not None and self.namespace is not None:
+                entryID, storeID = self.folders[path]
+                try:
+                    return self.namespace.GetFolderFromID(entryID, storeID)
+                except Exception:
+                    logging.warning(f"{path} - Cached folder not found, rebuilding folder index")
+            if attempt == 0:
+                self.build(rootFolders)
+        return None
+
 
 class Oli():
-    def __init__(self, outlook_object, folder):
+    def __init__(self, outlook_object, folder, namespace=None, folderCache=None):
         self._obj = outlook_object
         self.folder = folder
+        self.folderIndex = FolderIndex(namespace, folderCache)
 
     def items(self):
-        for item_index in range(1,self._obj.Count+1):
-            folder = self._obj[item_index]
-            logging.info(f"Folder Name: {folder.Name}")
-            if folder.Name == self.folder:
-                return folder.Items
-            else:
-                for subfolder in [folder.Folders[i] for i in range(1, folder.Folders.Count + 1) ]:
-                    logging.info(f"Sub Folder Name: {subfolder.Name}")
-                    if subfolder.Name == self.folder:
-                        return subfolder.Items
-                    else:
-                        try:
-                            for subsubfolder in [subfolder.Folders[i] for i in range(1, subfolder.Folders.Count + 1) ]:
-                                logging.info(f"Sub-Sub Folder Name: {subsubfolder.Name}")
-                                if subsubfolder.Name == self.folder:
-                                    return subsubfolder.Items
-                        except:
-                            continue
+        folder = self.folderIndex.open(self._obj, self.folder)
+        if folder is None:
+            logging.error(f"Outlook folder {self.folder} not found")
+            return None
+        logging.info(f"Folder Name: {folder.Name}")
+        return folder.Items
 
 
 class Message(Oli):
-    def __init__(self, outlook_object, folder, agent_out, volume_out):
-        Oli.__init__(self,outlook_object, folder)
+    def __init__(self, outlook_object, folder, agent_out, volume_out, namespace=None, folderCache=None):
+        Oli.__init__(self,outlook_object, folder, namespace, folderCache)
         self.agentSubject = "AgentDaily"
         self.volumeSubject = "Traffic Data Daily"
-        self.agentDirectory = pathlib.Path(agent_out)
-        self.volumeDirectory = pathlib.Path(volume_out)
+        self.agentDirectory = pathlib.Path(agent_out) if agent_out else None
+        self.volumeDirectory = pathlib.Path(volume_out) if volume_out else None
         self.messages = Oli.items(self)
-
-    def lastMessage(self):
-        return self.messages.GetFirst() #GetLast()
+        self.window = None
+        self.lastSentOn = None
+        self.failedAttachments = []
 
     def getLookupDate(self, dt=datetime.today().date()):
         if dt.weekday() == 0: # Check on Mondays for Friday Emails
@@ -49,44 +219,171 @@ class Message(Oli):
         logging.info(f"Date to find: {findDate.strftime('%Y-%m-%d')}")
         return findDate.strftime("%Y-%m-%d")
 
+    def restrictFilters(self, startDate, endDate):
+        '''
+        :arg startDate, endDate - datetime window of SentOn, the end is excluded
+
+        :returns Filters for Items.Restrict, the date window in Jet syntax (local time) and the report subjects in
+        DASL syntax, as Jet has no substring match
+        '''
+        dateFormat = "%m/%d/%Y %I:%M %p"
+        dateFilter = f"[SentOn] >= '{startDate.strftime(dateFormat)}' AND [SentOn] < '{endDate.strftime(dateFormat)}'"
+        subjects = [subject.replace("'", "''") for subject in (self.agentSubject, self.volumeSubject)]
+        subjectFilter = "@SQL=" + " OR ".join(f'"urn:schemas:httpmail:subject" LIKE \'%{subject}%\'' for subject in subjects)
+        return dateFilter, subjectFilter
+
+    def messagesBetween(self, startDate, endDate, after=None):
+        '''
+        :arg startDate, endDate - SentOn window, the end is excluded
+        :arg after - Optional high-water mark, only messages sent after it are returned
+
+        The folder is restricted to the window and walked from the newest message down, stopping at the first one
+        sent before the window, so a backfill of many days is a single pass.
+
+        :returns The messages of the window in SentOn order
+        '''
+        messages = self.messages
+        try:
+            for restriction in self.restrictFilters(startDate, endDate):
+                messages = messages.Restrict(restriction)
+        except Exception:
+            logging.warning("Unable to restrict messages, scanning the whole folder", exc_info=True)
+            messages = self.messages
+        try:
+            messages.Sort("[SentOn]", True)
+            ordered = True
+        except Exception:
+            logging.warning("Unable to sort messages, scanning the whole folder", exc_info=True)
+            ordered = False
+        selected = []
+        for message in messages:
+            sent = sentOn(message)
+            if sent >= endDate: continue
+            if sent < startDate or (after is not None and sent <= after):
+                if ordered: break
+                continue
+            selected.append((sent, message))
+        selected.sort(key=lambda item: item[0])
+        logging.info(f"{len(selected)} messages sent between {startDate} and {endDate}")
+        return [message for _, message in selected]
+
     def messageByDate(self):
         findDate = self.getLookupDate()
-        for message in self.messages:
-            if message.SentOn.strftime("%Y-%m-%d") == findDate:
-                yield message
+        startDate = datetime.strptime(findDate, "%Y-%m-%d")
+        for message in self.messagesBetween(startDate, startDate + timedelta(days=1)):
+            yield message
 
+    def selectedMessages(self):
+        '''
+        :returns Generator of the messages of the window, or of the daily lookup date without a window. The newest
+        SentOn handed out is kept in lastSentOn.
+        '''
+        messages = self.messageByDate() if self.window is None else self.messagesBetween(*self.window)
+        for message in messages:
+            sent = sentOn(message)
+            if self.lastSentOn is None or sent > self.lastSentOn:
+                self.lastSentOn = sent
+            yield message
 
-    def saveAttachmentToFolder(self, attachment, location):
-        filePath = os.path.join(location, attachment.FileName)
-        try:
-            attachment.SaveAsFile(filePath)
-            logging.info(f"{attachment.FileName} saved to {location}")
-        except Exception as e:
-            logging.warning(f"{attachment.FileName} - Unable to save file - \n{e}")
-        else:
-            with zipfile.ZipFile(filePath) as zf:
-                for file in zf.namelist():
-                    if file.endswith(".xlsx"):
-                        zf.extract(file, location)
+    def extractAttachment(self, fileName, data, location):
+        '''
+        :arg fileName - Name of the zip attachment
+        :arg data - Bytes of the attachment
+        :arg location - Input directory receiving the .xlsx members
+
+        Runs on the extraction pool, touches no COM object. Every member is written through a temp file and renamed
+        into place, a merge scanning the directory meanwhile never loads a partly written file.
+
+        :returns A count of the files and bytes written
+        '''
+        files, written = 0, 0
+        for name, content in zipMembers(data):
+            writeBytes(pathlib.Path(location, pathlib.PurePath(name).name), content)
+            files += 1
+            written += len(content)
+        logging.info(f"{fileName} extracted to {location} - {files} files")
+        return files, written
+
+    def reportAttachments(self):
+        '''
+        :returns Generator of (reportType, input directory, attachment) for the zip attachments of the report messages
+        '''
+        for msg in self.selectedMessages():
+            for attachment in msg.Attachments:
+                if '.zip' in attachment.FileName:
+                    if self.agentSubject.lower() in msg.Subject.lower():
+                        yield "Agent", self.agentDirectory, attachment
+                    elif self.volumeSubject.lower() in msg.Subject.lower():
+                        yield "Volume", self.volumeDirectory, attachment
+
+    def fetchReports(self):
+        '''
+        :returns Generator of (reportType, file name, bytes) for every .xlsx file in the report attachments, read
+        and unzipped in memory. The names of attachments that could not be read are kept in failedAttachments.
+        '''
+        self.failedAttachments = []
+        for reportType, _, attachment in self.reportAttachments():
             try:
-                os.remove(filePath)
-                # shutil.rmtree(os.path.join(location,attachment.FileName))
+                data = attachmentBytes(attachment)
+                logging.info(f"{attachment.FileName} fetched, {len(data)} bytes")
+                members = list(zipMembers(data))
             except Exception as e:
-                logging.error("Exception occurred", exc_info=True)
+                logging.warning(f"{attachment.FileName} - Unable to read attachment - \n{e}")
+                self.failedAttachments.append(attachment.FileName)
+                continue
+            for name, content in members:
+                yield reportType, pathlib.PurePath(name).name, content
+
+    def moveMessage(self, workers=4):
+        '''
+        :arg workers - Threads extracting attachments and writing them to the input directories. Attachments are
+        fetched on the calling thread, the only one using the Outlook COM objects, while earlier ones are extracted.
+        At most twice as many attachments as workers are held in memory.
 
+        :returns {"attachments", "files", "bytes", "failed", "seconds"} of the run, the throughput is logged
+        '''
+        totals = {"attachments": 0, "files": 0, "bytes": 0, "failed": 0}
+        start = time.perf_counter()
+
+        def collect():
+            future, fileName, size = pending.popleft()
+            try:
+                files, written = future.result()
+            except Exception as e:
+                logging.error(f"{fileName} - Unable to extract attachment", exc_info=True)
+                totals["failed"] += 1
+            else:
+                totals["attachments"] += 1
+                totals["files"] += files
+                totals["bytes"] += size
 
-    def moveMessage(self):
+        pending = collections.deque()
         try:
-            for msg in self.messageByDate():
-                for attachment in msg.Attachments:
-                    if '.zip' in attachment.FileName:
-                        if self.agentSubject.lower() in msg.Subject.lower():
-                            self.saveAttachmentToFolder(attachment, self.agentDirectory)
-                        elif self.volumeSubject.lower() in msg.Subject.lower():
-                            self.saveAttachmentToFolder(attachment, self.volumeDirectory)
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+                for _, directory, attachment in self.reportAttachments():
+                    try:
+                        data = attachmentBytes(attachment)
+                    except Exception as e:
+                        logging.warning(f"{attachment.FileName} - Unable to save file - \n{e}")
+                        totals["failed"] += 1
+                        continue
+                    logging.info(f"{attachment.FileName} fetched, {len(data)} bytes")
+                    pending.append((pool.submit(self.extractAttachment, attachment.FileName, data, directory),
+                                    attachment.FileName, len(data)))
+                    del data
+                    while len(pending) >= 2 * max(1, workers):
+                        collect()
+                while pending:
+                    collect()
         except Exception as e:
             logging.error("Exception occurred", exc_info=True)
+            totals["failed"] += 1
             # print(f"{e}")
+        totals["seconds"] = time.perf_counter() - start
+        rate = totals["bytes"] / 2**20 / totals["seconds"] if totals["seconds"] > 0 else 0
+        logging.info(f"{totals['attachments']} attachments, {totals['files']} files extracted in "
+                     f"{totals['seconds']:.2f}s - {rate:.2f} MB/s with {workers} workers")
+        return totals
 
 
 def run(argv=None):
@@ -106,13 +403,37 @@ def run(argv=None):
         dest='volume_input_directory',
         required=True,
         help='Input directory for Volume Report Attachment')
+    parser.add_argument(
+        '--folder_cache',
+        dest='folder_cache',
+        default='outlook_folders.json',
+        help='Cache of Outlook folder EntryIDs so --outlook_folder is found without walking the mailbox')
+    parser.add_argument(
+        '--workers',
+        dest='workers',
+        type=int,
+        default=4,
+        help='Threads extracting attachments while the next ones are fetched from Outlook')
+    parser.add_argument(
+        '--from',
+        dest='date_from',
+        default=None,
+        help='Backfill: first day (YYYY-MM-DD) of messages to fetch, defaults to after the high-water mark')
+    parser.add_argument(
+        '--to',
+        dest='date_to',
+        default=None,
+        help='Backfill: last day (YYYY-MM-DD) of messages to fetch, defaults to now')
+    parser.add_argument(
+        '--state_file',
+        dest='state_file',
+        default='email_reader_state.json',
+        help='Keeps the SentOn of the newest message handled, the high-water mark')
     known_args, _ = parser.parse_known_args(argv)
     
     try:
         logging.basicConfig(filename='email_reader.log', filemode='w', level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s',
                             datefmt='%d-%b-%y %H:%M:%S')
-        outlook = Dispatch("Outlook.Application").GetNamespace("MAPI")
-
         # Move Reports
         if os.path.isdir(known_args.agent_input_directory) == False:
             logging.error("Invalid directory for argument --agent_input_directory")
@@ -122,13 +443,26 @@ def run(argv=None):
             sys.exit()
         else:
             print("Running ...")
-            latest_message = Message(outlook.Folders, known_args.outlook_folder,known_args.agent_input_directory,known_args.volume_input_directory)
-            latest_message.moveMessage()
+            highWaterMark = HighWaterMark(known_args.state_file)
+            window = messageWindow(known_args.date_from, known_args.date_to,
+                                   highWaterMark.get(known_args.outlook_folder))
+            if emptyWindow(window):
+                logging.info("Nothing to fetch, the high-water mark is past the end of the window")
+                return
+            # Outlook is only started once the arguments are known to be usable
+            outlook = outlookNamespace()
+            latest_message = Message(outlook.Folders, known_args.outlook_folder,known_args.agent_input_directory,known_args.volume_input_directory,
+                                     namespace=outlook, folderCache=known_args.folder_cache)
+            latest_message.window = window
+            totals = latest_message.moveMessage(workers=known_args.workers)
+            if totals["failed"] == 0:
+                highWaterMark.set(known_args.outlook_folder, latest_message.lastSentOn)
     except Exception as e:
         logging.error("Exception occurred", exc_info=True)
         sys.exit()
 
 
 if __name__ == '__main__':
-  if datetime.now().weekday() < 5:
+  # Daily runs skip weekends, a backfill runs any day
+  if datetime.now().weekday() < 5 or any(arg.startswith(("--from", "--to")) for arg in sys.argv[1:]):
     run()
\ No newline at end of file
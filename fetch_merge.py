@@ -0,0 +1,227 @@
+import os, argparse, sys, pathlib, logging
+import file_combine, run_metrics, master_commit
+from email_reader import Message, HighWaterMark, messageWindow, emptyWindow, outlookNamespace
+from ingest_ledger import IngestionLedger
+from master_index import MasterIndex
+from master_rollups import RollupStore
+from columnar_store import ColumnarStore
+from report_batch import DURATION_FORMATS
+from report_prefilter import prefilter
+
+
+def loadAttachmentReports(files, streaming=False, ledger=None):
+    '''
+    :arg files - Iterable of (reportType, file name, bytes) as returned by Message.fetchReports
+    :arg streaming - Parse the workbooks read-only, row by row
+    :arg ledger - IngestionLedger, content merged before is skipped without being parsed
+
+    Attachments are inspected before they are parsed, see report_prefilter.prefilter.
+
+    :returns reports, members - The reports loaded with content and the (reportType, file name, bytes) they came from
+    '''
+    reports, members = [], []
+    for reportType, fileName, content in files:
+        contentHash = None
+        if ledger is not None:
+            contentHash = ledger.skipContent(IngestionLedger.contentHash(content), fileName, reportType)
+            if contentHash is None: continue
+        reportType = prefilter(pathlib.PurePath(fileName), reportType, content)
+        if reportType is None: continue
+        report = file_combine.loadReport(pathlib.PurePath(fileName), reportType, streaming, content=content)
+        if report is None: continue
+        report.contentHash = contentHash
+        reports.append(report)
+        members.append((reportType, fileName, content))
+    return reports, members
+
+
+def archiveMembers(members, results, archives):
+    '''
+    :arg members - (reportType, file name, bytes) of the merged reports
+    :arg results - {reportType: (successCounter, failedCounter)} from mergeAllData
+    :arg archives - {reportType: archive directory}, report types without one are not archived
+
+    Keep a copy of the mailed workbooks of every report type that merged, as the directory based merge does.
+    '''
+    for reportType, fileName, content in members:
+        archive_directory = archives.get(reportType)
+        if archive_directory is None or results.get(reportType, (0, 0))[0] == 0: continue
+        archivePath = pathlib.Path(archive_directory, fileName)
+        if archivePath.exists():
+            logging.warning(f"{fileName} already exist in archive {archive_directory}, not archived")
+            continue
+        try:
+            master_commit.writeBytes(archivePath, content)
+        except OSError as e:
+            logging.error(f"Failed to archive file {archivePath}", exc_info=True)
+        else:
+            logging.info(f"{fileName} archived to {archive_directory}")
+
+
+def fetchAndMerge(message, output_file, archives=None, streaming=False, appendOnly=False, ledger=None, store=None,
+                  storeOnly=False, durations="text", index=None, rollups=None, queryIndex=None):
+    '''
+    :arg message - email_reader.Message selecting the report messages
+    :arg output_file - Location of Master.xlsx
+    :arg archives - {reportType: archive directory} receiving the mailed workbooks once merged
+
+    Fetch the report attachments, unzip and parse them in memory and merge every report type into the master with
+    a single load and save. Nothing is written to the input directories. The remaining arguments are those of
+    getAllFileData and performCombinedMerge.
+
+    :returns {reportType: (successCounter, failedCounter)}
+    '''
+    with run_metrics.stage("fetch") as stage:
+        files = list(message.fetchReports())
+        stage.add(files=len(files), bytes=sum(len(content) for _, _, content in files))
+    logging.info(f"{len(files)} files fetched from Outlook")
+    reports, members = loadAttachmentReports(files, streaming=streaming, ledger=ledger)
+    del files
+    logging.info(f"{len(reports)} files loaded")
+    if ledger is not None and index is None:
+        ledger.filterReports(reports)
+    if sum(len(report.content) for report in reports) == 0:
+        logging.info("No new rows to merge")
+        return {}
+    results = file_combine.mergeAllData(output_file, reports, appendOnly=appendOnly, store=store,
+                                        storeOnly=storeOnly, durations=durations, index=index, rollups=rollups,
+                                        queryIndex=queryIndex)
+    if ledger is not None:
+        ledger.record([report for report in reports if report.reportTypeOverride in results])
+    if rollups is not None and sum(success for success, _ in results.values()) > 0:
+        file_combine.saveRollups(rollups)
+    for reportType, (success, failed) in results.items():
+        logging.info(f"{str(success)} {reportType} rows merged successfully and {failed} records failed to merge")
+    with run_metrics.stage("archive"):
+        archiveMembers(members, results, archives or {})
+    return results
+
+
+def run(argv=None):
+    parser = argparse.ArgumentParser(description="Fetch the Agent/Volume report attachments from Outlook and merge "
+                                                 "them into the master without intermediate files")
+    parser.add_argument(
+        '--outlook_folder',
+        dest='outlook_folder',
+        required=True,
+        help='Custom folder on Outlook for Agent Reports')
+    parser.add_argument(
+        '--folder_cache',
+        dest='folder_cache',
+        default='outlook_folders.json',
+        help='Cache of Outlook folder EntryIDs so --outlook_folder is found without walking the mailbox')
+    parser.add_argument(
+        '--master_output_file',
+        dest='master_output_file',
+        required=True,
+        help='Output file name and location to write results to')
+    parser.add_argument(
+        '--agent_archive_directory',
+        dest='agent_archive_directory',
+        default=None,
+        help='Optional archive directory receiving the merged Agent Report workbooks')
+    parser.add_argument(
+        '--volume_archive_directory',
+        dest='volume_archive_directory',
+        default=None,
+        help='Optional archive directory receiving the merged Volume Report workbooks')
+    parser.add_argument('--streaming', dest='streaming', action='store_true',
+                        help='Parse the workbooks read-only and row by row to keep memory flat')
+    parser.add_argument('--append_only', dest='append_only', action='store_true',
+                        help='Append rows to the master in place instead of reloading and saving the whole workbook')
+    parser.add_argument('--ledger', dest='ledger', action='store_true',
+                        help='Keep an ingestion ledger next to the master and skip files and rows merged before')
+    parser.add_argument('--store_directory', dest='store_directory', default=None,
+                        help='Also write merged rows to a columnar store of gzip CSV partitions')
+    parser.add_argument('--store_only', dest='store_only', action='store_true',
+                        help='Only write merged rows to --store_directory')
+    parser.add_argument('--durations', dest='durations', choices=DURATION_FORMATS, default="text",
+                        help='Write duration columns as exported text, whole seconds or Excel time cells')
+    parser.add_argument('--upsert', dest='upsert', action='store_true',
+                        help='Replace the rows of a re-delivered day instead of appending duplicates')
+    parser.add_argument('--rollups', dest='rollups', action='store_true',
+                        help='Maintain day, week and month totals per agent and topic in '
+                             '<master>_rollups_<YYYY-MM>.xlsx')
+    parser.add_argument('--query_index', dest='query_index', action='store_true',
+                        help='Keep the date-sorted index answering "file_combine.py query" up to date with every merge')
+    parser.add_argument('--from', dest='date_from', default=None,
+                        help='Backfill: first day (YYYY-MM-DD) of messages to fetch, defaults to after the high-water mark')
+    parser.add_argument('--to', dest='date_to', default=None,
+                        help='Backfill: last day (YYYY-MM-DD) of messages to fetch, defaults to now')
+    parser.add_argument('--state_file', dest='state_file', default='email_reader_state.json',
+                        help='Keeps the SentOn of the newest message merged, the high-water mark')
+    parser.add_argument('--metrics_file', dest='metrics_file', default=None,
+                        help='Write per stage metrics to this JSON file, or Prometheus text for .prom')
+    known_args, _ = parser.parse_known_args(argv)
+
+    logging.basicConfig(filename='fetch_merge.log', filemode='w', level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s',
+                        datefmt='%d-%b-%y %H:%M:%S')
+
+    xlsxPath = pathlib.Path(known_args.master_output_file)
+    if "xlsx" not in xlsxPath.suffix:
+        logging.error(f"Invalid file format for argument --master_output_file, please ensure this argument references a valid xlsx(Excel) file")
+        sys.exit()
+    for argument, directory in (("--agent_archive_directory", known_args.agent_archive_directory),
+                                ("--volume_archive_directory", known_args.volume_archive_directory)):
+        if directory is not None and os.path.isdir(directory) == False:
+            logging.error(f"Invalid directory for argument {argument}")
+            sys.exit()
+    if known_args.store_only and known_args.store_directory is None:
+        logging.error(f"Argument --store_only requires --store_directory")
+        sys.exit()
+
+    master_commit.recoverMaster(xlsxPath)
+
+    metrics = run_metrics.enable() if known_args.metrics_file else None
+    ledger = IngestionLedger(xlsxPath.with_suffix(".ledger.db")) if known_args.ledger else None
+    index = MasterIndex(xlsxPath.with_suffix(".index.db")) if known_args.upsert else None
+    rollups = RollupStore(xlsxPath) if known_args.rollups else None
+    queryIndex = file_combine.openQueryIndex(xlsxPath) if known_args.query_index else None
+    try:
+        highWaterMark = HighWaterMark(known_args.state_file)
+        window = messageWindow(known_args.date_from, known_args.date_to, highWaterMark.get(known_args.outlook_folder))
+        if emptyWindow(window):
+            logging.info("Nothing to fetch, the high-water mark is past the end of the window")
+            return
+        outlook = outlookNamespace()
+        message = Message(outlook.Folders, known_args.outlook_folder, None, None, namespace=outlook,
+                          folderCache=known_args.folder_cache)
+        message.window = window
+        store = ColumnarStore(known_args.store_directory) if known_args.store_directory else None
+        with run_metrics.stage("run"):
+            results = fetchAndMerge(message, xlsxPath,
+                                    archives={"Agent": known_args.agent_archive_directory,
+                                              "Volume": known_args.volume_archive_directory},
+                                    streaming=known_args.streaming, appendOnly=known_args.append_only,
+                                    ledger=ledger, store=store, storeOnly=known_args.store_only,
+                                    durations=known_args.durations, index=index, rollups=rollups,
+                                    queryIndex=queryIndex)
+        if message.failedAttachments:
+            # The unread attachments are fetched again by the next run
+            logging.warning(f"High-water mark kept, {len(message.failedAttachments)} attachments could not be read")
+        elif any(success > 0 for success, _ in results.values()):
+            # A failed save merges no rows, those messages are fetched again by the next run
+            highWaterMark.set(known_args.outlook_folder, message.lastSentOn)
+    except Exception as e:
+        logging.error("Exception occurred", exc_info=True)
+    finally:
+        if ledger is not None:
+            ledger.close()
+        if index is not None:
+            index.close()
+        if rollups is not None:
+            rollups.close()
+        if queryIndex is not None:
+            queryIndex.close()
+        if metrics is not None:
+            try:
+                metrics.write(known_args.metrics_file)
+            except OSError as e:
+                logging.error(f"{known_args.metrics_file} - Unable to write metrics - {e}")
+            run_metrics.disable()
+
+
+if __name__ == '__main__':
+  run()
+  print("Done")
@@ -1,9 +1,26 @@
-import openpyxl, argparse, os, pathlib, shutil, sys, logging
-from openpyxl.worksheet.table import Table, TableStyleInfo
-from openpyxl.styles import NamedStyle
+import argparse, os, pathlib, shutil, sys, logging
+from io import BytesIO
 from datetime import datetime
+import master_append, master_commit
+from ingest_ledger import IngestionLedger
+from report_batch import ReportBatch, DURATION_FORMATS
+from report_schema import SCHEMAS
+from report_prefilter import prefilter
+from columnar_store import ColumnarStore
+from master_index import MasterIndex
+from master_partitions import PARTITIONS, PartitionManifest, partitionKey, partitionPath, tableRows
+from master_rollups import RollupStore
+from master_query import QueryIndex, writeCsv
+from watch_folders import FolderWatcher
+import run_metrics
+
+_resultSheets = {"Agent": ("Daily Agent Reports", "AgentResults", "A1:J1"),
+                 "Volume": ("Daily Volume Reports", "VolumeResults", "A1:K1")}
+
 
 class AgentReport(object):
+    columns = SCHEMAS["Agent"].columns
+
     def __init__(self, inAgent, inLoggedInTime, inSignedOnTime, inBreakTime, inIncomingCalls, inAnsweredIncoming,
                  inTalkTimeIncoming,inAbandonedIncomingCalls, inOutgoingCallsExternal):
         self.agent = inAgent
@@ -29,7 +46,11 @@ class AgentReport(object):
                 int(self.outgoingCallsExternal)
                 ]
 
-    def getHeaders(self):
+    def getKey(self):
+        return self.agent
+
+    @staticmethod
+    def getHeaders():
         return ["Agent", "Date", "Logged In Time [totTLogin / All]", "Signed On Time [totTSignon / All]",
          "Break Time [totTPause / All]", "Incoming Calls [totNNew<- / Tel]",
          "Answered Incoming [totNConv<- / Tel]", "Talk Time Incoming [totTConv<- / Tel]",
@@ -40,6 +61,8 @@ class AgentReport(object):
 
 
 class VolumeReport(object):
+    columns = SCHEMAS["Volume"].columns
+
     def __init__(self, inTopic, inTotalIncomingCalls, inLostCalls, inNoAnswer, inAverageTalkTime, inLongestTalkTime,
                  inAverageSpeedToAnswer,inLongestAnswerTime,inAnswerRate,inTotalReroutedCalls):
         self.topic = inTopic
@@ -67,7 +90,11 @@ class VolumeReport(object):
              int(self.totalReroutedCalls)
              ]
 
-    def getHeaders(self):
+    def getKey(self):
+        return self.topic
+
+    @staticmethod
+    def getHeaders():
         return ["Topic", "Date", "Total Incoming Calls [totNNew / Tel]", "Lost Calls [totNLost / Tel]",
                 "No Answer (Timeout) [totNExp / Tel]", "Average Talk Time (ATT) [avgTConvAg / Tel]",
                 "Longest Talk Time [maxTConvAg / Tel]", "Average Speed To Answer (ASA) [avgTConvWait / Tel]",
@@ -78,6 +105,20 @@ class VolumeReport(object):
         return "VolumeReport"
 
 
+_entryClasses = {"Agent": AgentReport, "Volume": VolumeReport}
+
+
+def parseAnswerRate(answerRate):
+    if "%" in answerRate:
+        answerRate = answerRate.replace("%","")
+
+    try:
+        answerRate = float(answerRate)
+    except TypeError:
+        answerRate = None
+    return answerRate
+
+
 class Report(object):
     def __init__(self, inFileName, inReportType): # ,inType, inCreated, inPeriod, inWeekly, inDaily, inResolution, inCycle
         self.fileName = inFileName
@@ -89,7 +130,9 @@ class Report(object):
         self.daily = None
         self.resolution = None
         self.cycle = None
-        self.content = []
+        self.contentHash = None
+        self.extractedDate = None
+        self.content = ReportBatch(_entryClasses[inReportType]) if inReportType in _entryClasses else []
 
     def getHeaders(self):
         if len(self.content) > 0:
@@ -98,6 +141,12 @@ class Report(object):
             return []
 
     def extractDate(self):
+        # Parsed once per period, every row of the report shares the date
+        if self.extractedDate is None or self.extractedDate[0] != self.period:
+            self.extractedDate = (self.period, self.parseExtractDate())
+        return self.extractedDate[1]
+
+    def parseExtractDate(self):
         try:
             dt= datetime.strptime(self.period[:10],"%m/%d/%Y").strftime('%m/%d/%Y')
         except:
@@ -106,36 +155,38 @@ class Report(object):
         else:
             return dt
 
-    def addReport(self, data):
+    def buildReport(self, data):
         if self.reportTypeOverride == "Agent":
-            report = AgentReport(data.get('agent',None),data.get('loggedIn',None),data.get('signedOn',None)
+            return AgentReport(data.get('agent',None),data.get('loggedIn',None),data.get('signedOn',None)
                                   ,data.get('breakTime',None),data.get('incomingCalls',None),
                                   data.get('answeredIncoming',None),data.get('talkTime',None),
                                   data.get('abondonedIncomingCalls',None),data.get('outgoingCalls',None))
-            self.content.append(report)
         elif self.reportTypeOverride == "Volume":
-            answerRate = data.get('answerRate', None)
-            if "%" in answerRate:
-                answerRate = answerRate.replace("%","")
-
-            try:
-                answerRate = float(answerRate)
-            except TypeError:
-                answerRate = None
-
-            report = VolumeReport(data.get('topic', None), data.get('totalIncomingCalls', None),
+            answerRate = parseAnswerRate(data.get('answerRate', None))
+            return VolumeReport(data.get('topic', None), data.get('totalIncomingCalls', None),
                                       data.get('lostCalls', None)
                                       , data.get('noAnswer', None), data.get('averageTalkTime', None),
                                       data.get('longestTalkTime', None), data.get('averageSpeedToAnswer', None),
                                       data.get('longestAnswerTime', None), answerRate,
                                       data.get('totalReroutedCalls', None))
+        return None
+
+    def addReport(self, data):
+        report = self.buildReport(data)
+        if report is not None:
             self.content.append(report)
 
 
-def loadWorkbook(file):
+def loadWorkbook(file, readOnly=False, content=None):
+    '''
+    :arg file - Path of the workbook, only its name is used when the content is given
+    :arg content - Bytes of the workbook, e.g. a member of a mailed zip attachment
+    '''
     if file.suffix in [".xlsx"]:
+        import openpyxl
         try:
-            xlsx = openpyxl.load_workbook(file.absolute())
+            source = BytesIO(content) if content is not None else file.absolute()
+            xlsx = openpyxl.load_workbook(source, read_only=readOnly)
         except FileNotFoundError as e:
             logging.error(f"{file.name} - {e}")
             return None
@@ -155,10 +206,116 @@ def loadWorkbook(file):
         return None
 
 
-def getAllFileData(input_directory, reportType):
+def iterReportValues(report, rows):
+    '''
+    :arg report - Report object receiving the metadata of the file
+    :arg rows - Iterable of row value tuples from the "Table" sheet
+
+    Walk the rows of a "Table" sheet, the metadata found above the header row is set on the report and the field
+    values of every data row are yielded as a tuple in the order of the AgentReport/VolumeReport constructor. The
+    columns are found by header name once per file, see ReportSchema. Rows are consumed one at a time so a read-only
+    worksheet is never held in memory as a whole.
+    '''
+    schema = SCHEMAS.get(report.reportTypeOverride)
+    if schema is None: return iter(())
+    return schema.iterValues(report, rows)
+
+
+def iterReportRows(report, rows):
+    '''
+    :arg report - Report object receiving the metadata of the file
+    :arg rows - Iterable of row value tuples from the "Table" sheet
+
+    Generator yielding an AgentReport/VolumeReport per data row, see iterReportValues.
+    '''
+    entryClass = _entryClasses.get(report.reportTypeOverride)
+    for values in iterReportValues(report, rows):
+        yield entryClass(*values)
+
+
+def loadReport(filePath, reportType, streaming=False, content=None):
+    '''
+    :arg filePath - pathlib.Path of an input .xlsx file
+    :arg reportType
+    :arg streaming - Load the file read-only and parse the "Table" sheet row by row
+    :arg content - Bytes of the file, parsed in memory without reading filePath from disk
+
+    :returns A Report loaded with content, or None if the file could not be loaded
+    '''
+    with run_metrics.stage("workbook_load", item=filePath.name) as stage:
+        xlsx = loadWorkbook(filePath, readOnly=streaming, content=content)
+        if xlsx is not None:
+            stage.add(files=1, bytes=len(content) if content is not None else filePath.stat().st_size)
+    if xlsx is None: return None
+    try:
+        sheet = xlsx["Table"]
+    except KeyError as e:
+        logging.error(f"{e} - Ensure sheet 'Table' is present in file - {filePath.name}")
+        xlsx.close()
+        return None
+    if streaming and sheet.max_column is None:
+        # Without a <dimension> element read-only rows are ragged, size them like a full load would
+        sheet.calculate_dimension(force=True)
+    report = Report(filePath.stem, reportType)
+    with run_metrics.stage("row_parsing", item=filePath.name) as stage:
+        rows = iterReportValues(report, sheet.iter_rows(values_only=True))
+        if isinstance(report.content, ReportBatch):
+            report.content.extendValues(rows)
+        else:
+            for _ in rows: pass
+        stage.add(rows=len(report.content))
+    xlsx.close()
+    return report
+
+
+class _RecordCollector(logging.Handler):
+    # Keeps the log records of a worker process so the parent can log them to file_combine.log
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.msg = record.getMessage()
+        record.args = None
+        self.records.append(record)
+
+
+def _loadReportBatch(args):
+    '''
+    Process pool entry point for loadReport. The report is sent back with its columnar content together with the
+    log records and, when the parent collects metrics, the stages recorded while parsing the file.
+    '''
+    filePath, reportType, streaming, level, collectMetrics = args
+    logger = logging.getLogger()
+    handlers, previousLevel = logger.handlers[:], logger.level
+    collector = _RecordCollector()
+    logger.handlers = [collector]
+    logger.setLevel(level)
+    metrics = run_metrics.enable() if collectMetrics else run_metrics.disable()
+    try:
+        report = loadReport(filePath, reportType, streaming)
+    finally:
+        logger.handlers = handlers
+        logger.setLevel(previousLevel)
+        run_metrics.disable()
+    return report, collector.records, metrics.stages if metrics is not None else {}
+
+
+def getAllFileData(input_directory, reportType, streaming=False, workers=1, ledger=None, files=None):
     '''
     :arg inpurt_directory
     :arg reportType
+    :arg streaming - Load files read-only and parse the "Table" sheet row by row instead of building the full
+    workbook in memory
+    :arg workers - Number of processes parsing files in parallel, reports keep the directory order of a serial load
+    :arg ledger - IngestionLedger, files merged before are skipped without being parsed
+    :arg files - Paths of the files to load as listed by listInputFiles, by default the whole directory
+
+    Every file is inspected before it is loaded, see report_prefilter: files without a "Table" sheet or that are no
+    workbook at all are skipped, an export of the other report type is loaded as that type.
 
     Load all files from the input directory provided into a list of report objects based of the above
     defined Report class
@@ -172,152 +329,311 @@ def getAllFileData(input_directory, reportType):
     print(f"File upload started from {input_directory}")
     logging.info(f"File upload started from {input_directory}")
     reports = []
-    try:
-        inputFiles = [os.path.join(input_directory, f) for f in os.listdir(input_directory) if "master" not in f.lower()]
-    except FileNotFoundError as e:
-        logging.error(f"{input_directory} - {e}")
-        return 0, reports
-    except FileExistsError as e:
-        logging.error(f"{input_directory} - {e}")
-        return 0, reports
-    xlsxCount = 0
-    for file in inputFiles:
-        filePath = pathlib.Path(file)
-        if filePath.suffix in [".xlsx"]:
-            xlsxCount += 1
-            xlsx = loadWorkbook(filePath)
-            if xlsx is None: continue
+    inputFiles = listInputFiles(input_directory) if files is None else files
+    xlsxFiles = [pathlib.Path(file) for file in inputFiles if pathlib.Path(file).suffix in [".xlsx"]]
+    contentHashes = {}
+    if ledger is not None:
+        for filePath in xlsxFiles:
             try:
-                sheet = xlsx["Table"]
-            except KeyError as e:
-                logging.error(f"{e} - Ensure sheet 'Table' is present in file - {filePath.name}")
-                continue
-            report = Report(filePath.stem, reportType)
-            for rowCount, row in enumerate(sheet.rows):
-                content = {}
-                if rowCount in range(0,9):
-                    if "type" in str(row[0].value).lower():
-                        report.reportType = str(row[1].value)
-                    elif "created" in str(row[0].value).lower():
-                        report.dateCreated = str(row[1].value)
-                    elif "period" in str(row[0].value).lower():
-                        report.period = str(row[1].value)
-                    elif "weekly" in str(row[0].value).lower():
-                        report.weekly = str(row[1].value)
-                    elif "daily" in str(row[0].value).lower():
-                        report.daily = str(row[1].value)
-                    elif "resolution" in str(row[0].value).lower():
-                        report.resolution = str(row[1].value)
-                    elif "cycle" in str(row[0].value).lower():
-                        report.cycle = str(row[1].value)
-                    else: continue
-                else:
-                    if report.reportTypeOverride == "Volume":
-                        content["topic"] = str(row[0].value)
-                        content["totalIncomingCalls"] = str(row[1].value)
-                        content["lostCalls"] = str(row[2].value)
-                        content["noAnswer"] = str(row[3].value)
-                        content["averageTalkTime"] = str(row[4].value)
-                        content["longestTalkTime"] = str(row[5].value)
-                        content["averageSpeedToAnswer"] = str(row[6].value)
-                        content["longestAnswerTime"] = str(row[7].value)
-                        try:
-                            content["answerRate"] = str(row[8].value)
-                        except IndexError:
-                            content["answerRate"] = '0'
-                        try:
-                            content["totalReroutedCalls"] = str(row[9].value)
-                        except IndexError:
-                            content["totalReroutedCalls"] = '0'
-                    elif report.reportTypeOverride == "Agent":
-                        if "log." in str(row[0].value).lower():
-                            break
-                        content["agent"] = str(row[0].value)
-                        content["loggedIn"] = str(row[1].value)
-                        content["signedOn"] = str(row[2].value)
-                        content["breakTime"] = str(row[3].value)
-                        content["incomingCalls"] = str(row[4].value)
-                        content["answeredIncoming"] = str(row[5].value)
-                        content["talkTime"] = str(row[6].value)
-                        content["abondonedIncomingCalls"] = str(row[7].value)
-                        content["outgoingCalls"] = str(row[8].value)
-                    report.addReport(content)
-            reports.append(report)
-            xlsx.close()
-
-    return xlsxCount, reports
-
-
-def mergeData(output_file, reports):
+                contentHashes[filePath] = ledger.skipFile(filePath, reportType)
+            except OSError as e:
+                logging.error(f"{filePath.name} - {e}")
+                contentHashes[filePath] = None
+    pendingFiles = [filePath for filePath in xlsxFiles if ledger is None or contentHashes[filePath] is not None]
+    fileTypes = {}
+    with run_metrics.stage("prefilter", item=input_directory) as stage:
+        for filePath in pendingFiles:
+            fileTypes[filePath] = prefilter(filePath, reportType)
+        pendingFiles = [filePath for filePath in pendingFiles if fileTypes[filePath] is not None]
+        stage.add(files=len(fileTypes), rejected=len(fileTypes) - len(pendingFiles))
+    if workers > 1 and len(pendingFiles) > 1:
+        import concurrent.futures
+
+        level = logging.getLogger().getEffectiveLevel()
+        metrics = run_metrics.current()
+        with concurrent.futures.ProcessPoolExecutor(max_workers=min(workers, len(pendingFiles))) as pool:
+            batches = pool.map(_loadReportBatch, [(filePath, fileTypes[filePath], streaming, level,
+                                                   metrics is not None) for filePath in pendingFiles])
+            for filePath, (report, records, stages) in zip(pendingFiles, batches):
+                for record in records:
+                    logging.getLogger().handle(record)
+                if metrics is not None:
+                    metrics.merge(stages)
+                if report is None: continue
+                report.contentHash = contentHashes.get(filePath)
+                reports.append(report)
+    else:
+        for filePath in pendingFiles:
+            report = loadReport(filePath, fileTypes[filePath], streaming)
+            if report is not None:
+                report.contentHash = contentHashes.get(filePath)
+                reports.append(report)
+
+    return len(xlsxFiles), reports
+
+
+def getReportLines(reports, durations="text"):
+    '''
+    :arg reports - Valid reports loaded from the getAllFileData function
+    :arg durations - "text", "seconds" or "excel", how duration columns are written, see ReportBatch.lines
+
+    :returns {reportType: (lines, failedCounter)} with the rows of every report ready to be written
+    '''
+    reportLines = {}
+    for report in reports:
+        lines, failedCounter = reportLines.setdefault(report.reportTypeOverride, ([], 0))
+        if not isinstance(report.content, ReportBatch): continue
+        with run_metrics.stage("line_conversion") as stage:
+            contentLines, errors = report.content.lines(report.extractDate(), durations)
+            stage.add(rows=len(contentLines))
+        for error in errors:
+            logging.error("Exception occurred", exc_info=error)
+        lines.extend(contentLines)
+        reportLines[report.reportTypeOverride] = (lines, failedCounter + len(errors))
+    return reportLines
+
+
+def getStoreSchema(reportType, durations="text"):
+    entryClass = _entryClasses[reportType]
+    durationKind = {"text": "text", "seconds": "seconds", "excel": "duration"}[durations]
+    kinds = [durationKind if kind == "duration" else kind for _, kind in entryClass.columns]
+    kinds.insert(1, "date")
+    return {"headers": entryClass.getHeaders(), "kinds": kinds,
+            "sheet": _resultSheets[reportType][0], "table": _resultSheets[reportType][1]}
+
+
+def appendData(filePath, reportType, lines, failedCounter):
+    '''
+    :arg
+    filePath - Location of Master.xlsx
+    reportType - Report type of the lines
+    lines - Rows to append
+    failedCounter - Rows of the report type that failed before reaching the master
+
+    Write the rows in place when the master is in append layout, see master_append.
+
+    :returns A count of all successful created and failed records, or None if the master needs a full merge
+    '''
+    try:
+        if master_append.appendRows(filePath, reportType, lines):
+            return len(lines), failedCounter
+    except PermissionError as e:
+        logging.error(f"{filePath.name} - Please close open file")
+        return 0, 0
+    logging.info(f"{filePath.name} - No append layout for {reportType}, performing full merge")
+    return None
+
+
+def lineKey(line):
+    '''
+    :returns The (extract date, agent/topic) of a line, unique per daily sheet
+    '''
+    return str(line[1]), str(line[0])
+
+
+def canAppend(index, reportType, lines):
+    '''
+    :returns True when none of the lines replaces a row of the master or another line, so they can be appended
+    '''
+    keys = [lineKey(line) for line in lines]
+    if len(set(keys)) != len(keys): return False
+    return len(index.rows(reportType, {extractDate for extractDate, _ in keys}).keys() & set(keys)) == 0
+
+
+def upsertLines(sheet, lines, rows, nextRow):
+    '''
+    :arg sheet - Daily sheet of the report type
+    :arg lines - Rows to write
+    :arg rows - {(extract date, agent/topic): row} of the dates of the lines, as returned by MasterIndex.rows
+    :arg nextRow - First empty row of the sheet
+
+    Overwrite the row of every line whose key is already on the sheet and append the others.
+
+    :returns appended, replaced, failed, written - Counters and {key: row} of the rows written
+    '''
+    appended, replaced, failed = 0, 0, 0
+    written = {}
+    for line in lines:
+        try:
+            key = lineKey(line)
+            row = rows.get(key)
+            if row is None:
+                sheet.append(line)
+                rows[key] = written[key] = nextRow
+                nextRow += 1
+                appended += 1
+            else:
+                for column, value in enumerate(line, start=1):
+                    sheet.cell(row=row, column=column).value = value
+                written[key] = row
+                replaced += 1
+        except Exception as e:
+            logging.error("Exception occurred", exc_info=True)
+            failed += 1
+    return appended, replaced, failed, written
+
+
+def getResultSheet(xlsx, reportType, headers, style):
+    '''
+    :arg xlsx - Master workbook
+    :arg reportType - "Agent" or "Volume"
+    :arg headers - Header row written when the sheet is created
+    :arg style - TableStyleInfo of a created results table
+
+    :returns The daily sheet and results table of the report type, both are created when missing
+    '''
+    from openpyxl.worksheet.table import Table
+
+    sheetName, tableName, ref = _resultSheets[reportType]
+    if sheetName not in xlsx.sheetnames:
+        xlsx.create_sheet(sheetName)
+        sheet = xlsx[sheetName]
+        table = Table(displayName=tableName, ref=ref)
+        table.tableStyleInfo = style
+        sheet.add_table(table)
+        sheet.append(headers)
+    else:
+        sheet = xlsx[sheetName]
+        table = sheet.tables[tableName]
+    return sheet, table
+
+
+def mergeAllData(output_file, reports, appendOnly=False, store=None, storeOnly=False, durations="text", index=None,
+                 rollups=None, queryIndex=None):
     '''
     :arg
     output_file - Receives argument specify location of Master.xlsx
-    report - Accept a list of valid reports loaded from the getAllFileData function
+    report - Accept a list of valid reports loaded from the getAllFileData function, Agent and Volume reports can
+    be mixed and are written to their own sheet
+    appendOnly - Append the rows in place without reloading the master, the master is converted to the append
+    layout after the first full merge
+    store - ColumnarStore receiving a copy of every row, partitioned by report type and extract date. The rows are
+    written once the master holding them was committed, a failed merge leaves the store as it was.
+    storeOnly - Only write the rows to the store and leave the master untouched
+    durations - "text" writes durations as exported, "seconds" as whole seconds and "excel" as Excel time cells
+    index - MasterIndex, a line whose (agent/topic, date) is already in the master replaces that row instead of
+    being appended. Lines that only add rows are still appended in place with appendOnly.
+    rollups - RollupStore, the day, week and month buckets of the merged lines are aggregated again
+    queryIndex - QueryIndex receiving the lines written to the master, a master changed by anything else is left
+    for QueryIndex.refresh to read again
 
-    :returns A count of all successful created and failed records in the output_file
+    The master is loaded and saved once no matter how many report types are merged.
 
+    :returns {reportType: (successCounter, failedCounter)} for every report type merged into the output_file
     '''
     logging.info(f"Merging results into {output_file}")
     filePath = pathlib.Path(output_file)
+    reportTypes = {}
+    for report in reports:
+        reportTypes.setdefault(report.reportTypeOverride, []).append(report)
+    if len(reportTypes) == 0:
+        logging.error(f"No headers data available for {filePath.name}")
+        return {}
+    reportLines = getReportLines(reports, durations)
+
+    results = {}
+    if storeOnly:
+        if store is not None:
+            lineCounts = {reportType: (len(lines), failedCounter)
+                          for reportType, (lines, failedCounter) in reportLines.items()}
+            for reportType, stored in storeLines(store, reportLines, lineCounts, durations,
+                                                 replace=index is not None).items():
+                lines, failedCounter = reportLines[reportType]
+                results[reportType] = (stored, failedCounter + len(lines) - stored)
+        updateRollups(rollups, reportLines, results)
+        return results
+
+    indexCurrent = index is not None and index.isCurrent(filePath)
+    queryCurrent = queryIndex is not None and queryIndex.isCurrent(filePath)
+    if appendOnly:
+        for reportType in list(reportTypes):
+            lines = reportLines[reportType][0]
+            if index is not None and (not indexCurrent or not canAppend(index, reportType, lines)): continue
+            with run_metrics.stage("append", item=reportType) as stage:
+                counters = appendData(filePath, reportType, *reportLines[reportType])
+                stage.add(rows=counters[0] if counters is not None else 0)
+            if counters is not None:
+                if index is not None and counters[0] > 0:
+                    lastRow = index.lastRow(reportType)
+                    index.update(reportType, {lineKey(line): lastRow + offset for offset, line in enumerate(lines, 1)})
+                    index.setLastRow(reportType, lastRow + len(lines))
+                results[reportType] = counters
+                del reportTypes[reportType]
+        if len(reportTypes) == 0:
+            if index is not None:
+                index.commit(filePath)
+            storeLines(store, reportLines, results, durations, replace=index is not None)
+            updateRollups(rollups, reportLines, results)
+            if queryCurrent:
+                updateQueryIndex(queryIndex, filePath, reportLines, results, replace=index is not None)
+            return results
+
+    import openpyxl
+    from openpyxl.styles import NamedStyle
+    from openpyxl.worksheet.table import TableStyleInfo
+
     try:
-        xlsx = openpyxl.load_workbook(filePath.absolute())
+        with run_metrics.stage("master_load") as stage:
+            xlsx = openpyxl.load_workbook(filePath.absolute())
+            stage.add(bytes=filePath.stat().st_size)
     except FileNotFoundError as e:
         logging.warning(f"{filePath.name} - Not Found")
         xlsx = openpyxl.Workbook()
         logging.info(f"Created new workbook -> {filePath.name}")
     except PermissionError as e:
         logging.error(f"{filePath.name} - Please close open file")
-        return 0,0
+        # Report types appended in place before are in the master
+        storeLines(store, reportLines, results, durations, replace=index is not None)
+        return results
     except Exception as e:
         logging.error(f"{filePath.name} FILE_ERROR",exc_info=True)
-        return 0,0
-
-    try:
-        tempReport = reports[0]
-        date_style = NamedStyle(name='american_date_style', number_format='MM/DD/YYYY')
-        style = TableStyleInfo(name="TableStyleMedium2", showFirstColumn=False,
-                               showLastColumn=False, showRowStripes=True, showColumnStripes=False)
-        if 'Daily Agent Reports' not in xlsx.sheetnames:
-            xlsx.create_sheet('Daily Agent Reports')
-            sheet = xlsx["Daily Agent Reports"]
-            table = Table(displayName="AgentResults", ref="A1:J1")
-            table.tableStyleInfo = style
-            sheet.add_table(table)
-            sheet.append(tempReport.getHeaders())
-        elif 'Daily Volume Reports' not in xlsx.sheetnames:
-            xlsx.create_sheet('Daily Volume Reports')
-            sheet = xlsx["Daily Volume Reports"]
-            table = Table(displayName="VolumeResults", ref="A1:K1")
-            table.tableStyleInfo = style
-            sheet.add_table(table)
-            sheet.append(tempReport.getHeaders())
-        else:
-            if tempReport.reportTypeOverride == "Agent":
-                sheet = xlsx["Daily Agent Reports"]
-                table = sheet.tables["AgentResults"]
-            else:
-                sheet = xlsx["Daily Volume Reports"]
-                table = sheet.tables["VolumeResults"]
+        storeLines(store, reportLines, results, durations, replace=index is not None)
+        return results
 
+    if index is not None and not indexCurrent:
+        # The master was written by something else since the index was saved, or never indexed
+        with run_metrics.stage("index_rebuild"):
+            for reportType, (sheetName, _, _) in _resultSheets.items():
+                if sheetName in xlsx.sheetnames:
+                    index.rebuild(reportType, xlsx[sheetName])
+                else:
+                    index.clear(reportType)
 
-    except IndexError:
-        logging.error(f"No headers data available for {filePath.name}")
-        return 0, 0
+    date_style = NamedStyle(name='american_date_style', number_format='MM/DD/YYYY')
+    style = TableStyleInfo(name="TableStyleMedium2", showFirstColumn=False,
+                           showLastColumn=False, showRowStripes=True, showColumnStripes=False)
+    for reportType, typeReports in reportTypes.items():
+        if reportType not in _resultSheets: continue
+        headers = _entryClasses[reportType].getHeaders()
+        sheet, table = getResultSheet(xlsx, reportType, headers, style)
 
-    successCounter = 0
-    failedCounter = 0
-    lastrow = table.ref.split(":")[-1]
-    lastrowColumn = lastrow[0]
-    lastrowIndex = int(lastrow[1:])
-    for report in reports:
-        for data in report.content:
-            try:
-                sheet.append(data.getLineEntry(report.extractDate()))
-                successCounter +=1
-            except Exception as e:
-                logging.error("Exception occurred", exc_info=True)
-                failedCounter +=1
-    table.ref = f"A1:{lastrowColumn}{lastrowIndex + successCounter}"
+        successCounter = 0
+        lines, failedCounter = reportLines[reportType]
+        lastrow = table.ref.split(":")[-1]
+        lastrowColumn = lastrow[0]
+        lastrowIndex = int(lastrow[1:])
+        with run_metrics.stage("append", item=reportType) as stage:
+            if index is None:
+                for line in lines:
+                    try:
+                        sheet.append(line)
+                        successCounter +=1
+                    except Exception as e:
+                        logging.error("Exception occurred", exc_info=True)
+                        failedCounter +=1
+                lastrowIndex += successCounter
+            else:
+                nextRow = sheet.max_row + 1
+                rows = index.rows(reportType, {extractDate for extractDate, _ in map(lineKey, lines)})
+                appended, replaced, failed, written = upsertLines(sheet, lines, rows, nextRow)
+                index.update(reportType, written)
+                index.setLastRow(reportType, nextRow + appended - 1)
+                lastrowIndex = nextRow + appended - 1
+                successCounter, failedCounter = appended + replaced, failedCounter + failed
+                logging.info(f"{appended} {reportType} rows appended and {replaced} rows replaced")
+            stage.add(rows=successCounter)
+        table.ref = f"A1:{lastrowColumn}{lastrowIndex}"
+        results[reportType] = (successCounter, failedCounter)
 
     # Format Date Cells
     # for row in sheet[2:sheet.max_row]:  # skip the header
@@ -325,63 +641,319 @@ def mergeData(output_file, reports):
     #     cell.number_format = 'dd/mm/yy'
     ##
 
-    xlsx.save(filename=filePath)
-    xlsx.close()
-    return successCounter, failedCounter
+    with run_metrics.stage("master_save") as stage:
+        master_commit.saveWorkbook(xlsx, filePath)
+        xlsx.close()
+        if appendOnly:
+            master_append.prepareMaster(filePath)
+        stage.add(bytes=filePath.stat().st_size)
+    if index is not None:
+        index.commit(filePath)
+    storeLines(store, reportLines, results, durations, replace=index is not None)
+    updateRollups(rollups, reportLines, results)
+    if queryCurrent:
+        updateQueryIndex(queryIndex, filePath, reportLines, results, replace=index is not None)
+    return results
+
+
+def storeLines(store, reportLines, results, durations="text", replace=False):
+    '''
+    :arg store - ColumnarStore or None
+    :arg reportLines - {reportType: (lines, failedCounter)} as returned by getReportLines
+    :arg results - Report types to write, {reportType: (successCounter, failedCounter)} of the master merge
+    :arg durations - "text", "seconds" or "excel", see mergeAllData
+    :arg replace - Lines replace the stored rows of their (extract date, agent/topic), as with a MasterIndex
+
+    :returns {reportType: rows written to the store}
+    '''
+    stored = {}
+    if store is None: return stored
+    for reportType in results:
+        if reportType not in _resultSheets: continue
+        if results[reportType][0] == 0: continue
+        with run_metrics.stage("store_write", item=reportType) as stage:
+            try:
+                stored[reportType] = store.appendLines(reportType, getStoreSchema(reportType, durations),
+                                                       reportLines[reportType][0], replace=replace)
+            except OSError as e:
+                logging.error(f"{store.storeDirectory} - Unable to write {reportType} rows", exc_info=True)
+                stored[reportType] = 0
+            stage.add(rows=stored[reportType])
+    return stored
+
+
+def updateRollups(rollups, reportLines, results):
+    '''
+    :arg rollups - RollupStore or None
+    :arg reportLines - {reportType: (lines, failedCounter)} as returned by getReportLines
+    :arg results - {reportType: (successCounter, failedCounter)} of the merge
+
+    Only report types with merged rows touch their buckets, a failed save leaves the rollups as they were.
+    '''
+    if rollups is None: return
+    for reportType, (success, _) in results.items():
+        if success == 0: continue
+        with run_metrics.stage("rollups", item=reportType) as stage:
+            stage.add(buckets=rollups.update(reportType, reportLines[reportType][0]))
+
+
+def updateQueryIndex(queryIndex, filePath, reportLines, results, replace=False):
+    '''
+    :arg filePath - Workbook the lines were saved to, the master or a partition
+    :arg reportLines - {reportType: (lines, failedCounter)} as returned by getReportLines
+    :arg results - {reportType: (successCounter, failedCounter)} of the merge
+    :arg replace - Lines replaced the rows of their (extract date, agent/topic), see upsertLines
+    '''
+    with run_metrics.stage("query_index") as stage:
+        for reportType, (success, _) in results.items():
+            if success == 0: continue
+            queryIndex.update(filePath, reportType, _entryClasses[reportType].getHeaders(), reportLines[reportType][0],
+                              replace=replace)
+            stage.add(rows=success)
+        queryIndex.commit(filePath)
+
+
+def openQueryIndex(output_file):
+    '''
+    :returns QueryIndex of the master and its partitions, close it once done
+    '''
+    return QueryIndex(output_file, {reportType: sheet[0] for reportType, sheet in _resultSheets.items()})
+
+
+def queryReports(output_file, reportType, dateFrom=None, dateTo=None, names=None):
+    '''
+    :arg output_file - Location of Master.xlsx
+    :arg reportType - "Agent" or "Volume"
+    :arg dateFrom, dateTo - First and last extract date (date or YYYY-MM-DD), both included, None for no limit
+    :arg names - Agents or topics to return, None for all
+
+    Answer a range query from the query index next to the master, see QueryIndex. Only a master or partition
+    changed since it was indexed is loaded, a one week query otherwise reads a few pages of the index.
+
+    :returns The headers of the daily sheet and the matching rows in extract date order
+    '''
+    queryIndex = openQueryIndex(output_file)
+    try:
+        queryIndex.refresh()
+        return queryIndex.headers(reportType), list(queryIndex.query(reportType, dateFrom, dateTo, names))
+    finally:
+        queryIndex.close()
+
+
+def mergeData(output_file, reports, appendOnly=False, durations="text", index=None):
+    '''
+    :arg
+    output_file - Receives argument specify location of Master.xlsx
+    report - Accept a list of valid reports loaded from the getAllFileData function
+    appendOnly - Append the rows in place without reloading the master
+    durations - "text", "seconds" or "excel", see mergeAllData
+    index - MasterIndex replacing rows of re-delivered days instead of appending them, see mergeAllData
+
+    :returns A count of all successful created and failed records in the output_file
+
+    '''
+    results = mergeAllData(output_file, reports, appendOnly, durations=durations, index=index)
+    return sum(success for success, _ in results.values()), sum(failed for _, failed in results.values())
+
+
+def mergePartitioned(output_file, reports, partition, upsert=False, **options):
+    '''
+    :arg output_file - Location of Master.xlsx, the partitions are written next to it
+    :arg reports - Valid reports loaded from the getAllFileData function
+    :arg partition - "month" or "year"
+    :arg upsert - Keep a MasterIndex per partition and replace the rows of re-delivered days
+    :arg options - appendOnly, store, storeOnly, durations, rollups and queryIndex as taken by mergeAllData
+
+    Merge every report into the partition workbook of its extract date. Only the partitions receiving rows are
+    loaded, so the cost of a run is bounded by the partition size however much history there is. The partitions
+    are listed in a manifest and index workbook, see PartitionManifest.
+
+    :returns {reportType: (successCounter, failedCounter)} summed over the partitions
+    '''
+    groups = {}
+    for report in reports:
+        groups.setdefault(partitionKey(report.extractDate(), partition), []).append(report)
+    manifest = PartitionManifest(output_file, partition)
+    results = {}
+    for key, partitionReports in sorted(groups.items()):
+        filePath = partitionPath(output_file, key)
+        index = MasterIndex(filePath.with_suffix(".index.db")) if upsert else None
+        try:
+            with run_metrics.stage("partition", item=key):
+                partitionResults = mergeAllData(filePath, partitionReports, index=index, **options)
+        finally:
+            if index is not None:
+                index.close()
+        for reportType, (success, failed) in partitionResults.items():
+            totalSuccess, totalFailed = results.get(reportType, (0, 0))
+            results[reportType] = (totalSuccess + success, totalFailed + failed)
+        if not options.get("storeOnly") and sum(success for success, _ in partitionResults.values()) > 0:
+            manifest.update(key, filePath, {report.extractDate() for report in partitionReports},
+                            tableRows(filePath, {reportType: sheet[1] for reportType, sheet in _resultSheets.items()}))
+    try:
+        manifest.save()
+    except OSError as e:
+        logging.error(f"{manifest.manifestFile.name} - Unable to write partition manifest - {e}")
+    return results
+
+
+def saveRollups(rollups):
+    with run_metrics.stage("rollups_save") as stage:
+        try:
+            saved = rollups.save()
+        except OSError as e:
+            logging.error(f"{rollups.rollupFile.name} - Unable to write rollups, retried by the next save - {e}")
+        else:
+            stage.add(files=saved)
+
+
+def listInputFiles(input_directory):
+    '''
+    :returns The paths of the files in the input directory, master files excluded
+    '''
+    try:
+        return [os.path.join(input_directory, f) for f in os.listdir(input_directory) if "master" not in f.lower()]
+    except OSError as e:
+        logging.error(f"{input_directory} - {e}")
+        return []
 
 
-def removeInputFile(input_directory,archive_directory=None, archive=False):
+def removeInputFile(input_directory,archive_directory=None, archive=False, files=None, compress=False):
     '''
     :arg
     inpurt_directory - specifies the input directory from where files were consumed
+    files - The consumed files, by default every file in the input_directory. Files arriving during the merge are
+    left for the next run when given.
+    compress - Archive the files to a single zip per run instead of moving them one by one
 
     This function will delete all files in the input_directory after the Master.xlsx was updated, if archive is set to False
     If archive flag is set to true an archive directory will be expected, and all input files will only be moved to
-    an archive location.
+    an archive location in one batch, see master_commit.archiveFiles.
     '''
+    with run_metrics.stage("archive", item=input_directory) as stage:
+        _removeInputFile(input_directory, archive_directory, archive, stage,
+                         listInputFiles(input_directory) if files is None else files, compress)
+
+
+def _removeInputFile(input_directory, archive_directory, archive, stage, files, compress):
     if archive:
         if os.path.isdir(archive_directory) == False:
             logging.error(f"Invalid archive directory {archive_directory}")
-            pass
-
-        for filename in os.listdir(input_directory):
-            if "master" in filename.lower(): continue
-            file_path = os.path.join(input_directory, filename)
-            try:
-                if os.path.isfile(file_path) and os.path.isdir(archive_directory):
-                    shutil.move(file_path, archive_directory)
-                    logging.info(f"{filename} archived to {archive_directory}")
-            except shutil.Error:
-                if os.path.isfile(file_path) or os.path.islink(file_path):
-                    os.unlink(file_path)
-                logging.warning(f'{file_path} already exist in archive, therfore {file_path} will be deleted and not archived', exc_info=True)
-            except Exception as e:
-                logging.error(f'Failed to archive file {file_path}', exc_info=True)
+            return
+        files = [file_path for file_path in files if os.path.isfile(file_path)]
+        stage.add(files=len(files), bytes=sum(os.path.getsize(file_path) for file_path in files))
+        try:
+            master_commit.archiveFiles(files, archive_directory, compress=compress)
+        except Exception as e:
+            logging.error(f'Failed to archive files of {input_directory}, completed by the next run', exc_info=True)
     else:
-        for filename in os.listdir(input_directory):
-            if "master" in filename.lower(): continue
-            file_path = os.path.join(input_directory, filename)
+        for file_path in files:
             try:
                 if os.path.isfile(file_path) or os.path.islink(file_path):
+                    stage.add(files=1, bytes=os.path.getsize(file_path))
                     os.unlink(file_path)
                 elif os.path.isdir(file_path):
                     shutil.rmtree(file_path)
             except Exception as e:
                 logging.error(f'Failed to delete file {file_path}', exc_info=True)
             else:
-                logging.info(f"{filename} removed from directory - {file_path}")
+                logging.info(f"{os.path.basename(file_path)} removed from directory - {file_path}")
+
 
+def performCombinedMerge(directories, ledger=None, store=None, index=None, rollups=None, queryIndex=None):
+    '''
+    :arg directories - List of file settings {type, input, output, archive, ...} as built by run, all sharing the
+    same output
+    :arg ledger - IngestionLedger skipping files and rows merged by earlier runs
+    :arg store - ColumnarStore receiving a copy of the merged rows
+    :arg index - MasterIndex, rows of re-delivered days replace those in the master. The ledger then only skips
+    identical files, a corrected export has to reach the master. With a "partition" setting every partition keeps
+    its own index when "upsert" is set instead.
+    :arg rollups - RollupStore, updated with the merged rows and written to <master>_rollups_<YYYY-MM>.xlsx
+    :arg queryIndex - QueryIndex, receives the rows written to the master and its partitions
 
-def performFileMerge(files):
-    logging.info(f"Load {files.get('type')} files")
-    inputFileCount, reports = getAllFileData(files.get("input"), files.get("type"))
-    logging.info(f"{str(len(reports))}/{str(inputFileCount)} files loaded")
-    if inputFileCount > 0:
-        success, failed = mergeData(files.get("output"),
-                                    [report for report in reports if report.reportTypeOverride == files.get("type")])
+    Load the input files of every directory and merge all report types into the master with a single load and
+    save. Each directory is archived once rows of its report type merged successfully, or when the ledger found
+    nothing new in it, as one batch after the master was committed. An "archiveFormat" setting of "zip" archives
+    the files of a run to a single zip.
+    '''
+    reports = []
+    consumed = {}
+    if ledger is not None:
+        ledger.skippedFiles.clear()
+    inputs = {}
+    loadedTypes = {}
+    for files in directories:
+        logging.info(f"Load {files.get('type')} files")
+        # Only the files listed here are archived, files arriving meanwhile wait for the next run
+        inputs[files.get("type")] = listInputFiles(files.get("input"))
+        inputFileCount, typeReports = getAllFileData(files.get("input"), files.get("type"),
+                                                     streaming=files.get("streaming", False),
+                                                     workers=files.get("workers", 1), ledger=ledger,
+                                                     files=inputs[files.get("type")])
+        logging.info(f"{str(len(typeReports))}/{str(inputFileCount)} files loaded")
+        typeReports = [report for report in typeReports if report.reportTypeOverride in _resultSheets]
+        loadedTypes[files.get("type")] = {report.reportTypeOverride for report in typeReports} | {files.get("type")}
+        if ledger is not None:
+            if index is None and not files.get("upsert", False):
+                ledger.filterReports(typeReports)
+            skippedFiles = ledger.skippedFiles.get(files.get("type"), 0)
+            consumed[files.get("type")] = inputFileCount > 0 and len(typeReports) + skippedFiles == inputFileCount \
+                                          and sum(len(report.content) for report in typeReports) == 0
+        reports.extend(typeReports)
+
+    results = {}
+    if sum(len(report.content) for report in reports) > 0:
+        if directories[0].get("partition"):
+            results = mergePartitioned(directories[0].get("output"), reports, directories[0].get("partition"),
+                                       upsert=directories[0].get("upsert", False),
+                                       appendOnly=directories[0].get("appendOnly", False), store=store,
+                                       storeOnly=directories[0].get("storeOnly", False),
+                                       durations=directories[0].get("durations", "text"), rollups=rollups,
+                                       queryIndex=queryIndex)
+        else:
+            results = mergeAllData(directories[0].get("output"), reports, appendOnly=directories[0].get("appendOnly", False),
+                                   store=store, storeOnly=directories[0].get("storeOnly", False),
+                                   durations=directories[0].get("durations", "text"), index=index, rollups=rollups,
+                                   queryIndex=queryIndex)
+        if ledger is not None:
+            ledger.record([report for report in reports if report.reportTypeOverride in results])
+        if rollups is not None and sum(success for success, _ in results.values()) > 0:
+            saveRollups(rollups)
+    for files in directories:
+        success, failed = results.get(files.get("type"), (0, 0))
         if success > 0:
-            logging.info(f"{str(success)} rows merged successfully and {failed} records failed to merge")
-            removeInputFile(files.get("input"), archive_directory=files.get("archive"),archive=True)
+            logging.info(f"{str(success)} {files.get('type')} rows merged successfully and {failed} records failed to merge")
+        if any(results.get(loadedType, (0, 0))[0] > 0 for loadedType in loadedTypes[files.get("type")]):
+            removeInputFile(files.get("input"), archive_directory=files.get("archive"),archive=True,
+                            files=inputs[files.get("type")], compress=files.get("archiveFormat") == "zip")
+        elif consumed.get(files.get("type"), False):
+            logging.info(f"No new {files.get('type')} rows, archiving input files")
+            removeInputFile(files.get("input"), archive_directory=files.get("archive"),archive=True,
+                            files=inputs[files.get("type")], compress=files.get("archiveFormat") == "zip")
+
+
+def runBatch(directories, metrics_file=None, **options):
+    '''
+    :arg directories - File settings as taken by performCombinedMerge
+    :arg metrics_file - Metrics of the batch are written to this file, a watcher overwrites it after every batch
+    :arg options - ledger, store, index, rollups and queryIndex as taken by performCombinedMerge
+    '''
+    metrics = run_metrics.enable() if metrics_file else None
+    try:
+        with run_metrics.stage("run"):
+            if not any(listInputFiles(files.get("input")) for files in directories):
+                # Most scheduled runs find nothing, leave before openpyxl is even imported
+                logging.info("No input files, nothing to merge")
+                return
+            performCombinedMerge(directories, **options)
+    finally:
+        if metrics is not None:
+            try:
+                metrics.write(metrics_file)
+            except OSError as e:
+                logging.error(f"{metrics_file} - Unable to write metrics - {e}")
+            run_metrics.disable()
 
 
 def run(argv=None):
@@ -411,11 +983,111 @@ def run(argv=None):
         dest='master_output_file',
         required=True,
         help='Output file name and location to write results to')
+    parser.add_argument(
+        '--streaming',
+        dest='streaming',
+        action='store_true',
+        help='Load input files read-only and parse them row by row to keep memory flat')
+    parser.add_argument(
+        '--append_only',
+        dest='append_only',
+        action='store_true',
+        help='Append rows to the master in place instead of reloading and saving the whole workbook')
+    parser.add_argument(
+        '--workers',
+        dest='workers',
+        type=int,
+        default=1,
+        help='Number of processes used to parse input files')
+    parser.add_argument(
+        '--ledger',
+        dest='ledger',
+        action='store_true',
+        help='Keep an ingestion ledger next to the master and skip files and rows merged before')
+    parser.add_argument(
+        '--store_directory',
+        dest='store_directory',
+        default=None,
+        help='Also write merged rows to a columnar store of gzip CSV partitions by report type and extract date')
+    parser.add_argument(
+        '--store_only',
+        dest='store_only',
+        action='store_true',
+        help='Only write merged rows to --store_directory, the master can be rebuilt with columnar_store.py')
+    parser.add_argument(
+        '--durations',
+        dest='durations',
+        choices=DURATION_FORMATS,
+        default="text",
+        help='Write duration columns as exported text, whole seconds or Excel time cells, keep one choice per master')
+    parser.add_argument(
+        '--upsert',
+        dest='upsert',
+        action='store_true',
+        help='Replace the rows of a re-delivered day instead of appending duplicates, keeps a key index next to the master')
+    parser.add_argument(
+        '--partition',
+        dest='partition',
+        choices=PARTITIONS,
+        default=None,
+        help='Write rows to one workbook per month or year next to --master_output_file, listed in <master>_partitions.xlsx')
+    parser.add_argument(
+        '--metrics_file',
+        dest='metrics_file',
+        default=None,
+        help='Write durations, rows, bytes and peak memory per stage to this JSON file, or Prometheus text for .prom')
+    parser.add_argument(
+        '--rollups',
+        dest='rollups',
+        action='store_true',
+        help='Maintain day, week and month totals per agent and topic in <master>_rollups_<YYYY-MM>.xlsx')
+    parser.add_argument(
+        '--query_index',
+        dest='query_index',
+        action='store_true',
+        help='Keep the date-sorted index answering "file_combine.py query" up to date with every merge')
+    parser.add_argument(
+        '--archive_format',
+        dest='archive_format',
+        choices=("files", "zip"),
+        default="files",
+        help='Move consumed input files to the archive directories, or write them to one zip per run')
+    parser.add_argument(
+        '--watch',
+        dest='watch',
+        action='store_true',
+        help='Keep running and merge new files as they arrive in the input directories')
+    parser.add_argument(
+        '--poll_interval',
+        dest='poll_interval',
+        type=float,
+        default=5.0,
+        help='With --watch, seconds between two listings of the input directories')
+    parser.add_argument(
+        '--debounce',
+        dest='debounce',
+        type=float,
+        default=30.0,
+        help='With --watch, seconds without new or growing files before a batch is merged')
+    parser.add_argument(
+        '--max_delay',
+        dest='max_delay',
+        type=float,
+        default=300.0,
+        help='With --watch, longest wait for a burst of arrivals to settle before merging anyway')
     known_args, _ = parser.parse_known_args(argv)
 
-    logging.basicConfig(filename='file_combine.log', filemode='w', level=logging.INFO,
-                        format='%(asctime)s - %(levelname)s - %(message)s',
-                        datefmt='%d-%b-%y %H:%M:%S')
+    if known_args.watch:
+        # A watcher runs for weeks, keep its log from growing without bound
+        from logging.handlers import RotatingFileHandler
+
+        logging.basicConfig(handlers=[RotatingFileHandler('file_combine.log', maxBytes=10 * 1024 * 1024, backupCount=5)],
+                            level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s',
+                            datefmt='%d-%b-%y %H:%M:%S')
+    else:
+        logging.basicConfig(filename='file_combine.log', filemode='w', level=logging.INFO,
+                            format='%(asctime)s - %(levelname)s - %(message)s',
+                            datefmt='%d-%b-%y %H:%M:%S')
 
     # Check for valid arguments
     if os.path.isdir(known_args.agent_input_directory) == False:
@@ -438,14 +1110,118 @@ def run(argv=None):
         if "xlsx" not in xlsxPath.suffix:
             logging.error(f"Invalid file format for argument --master_output_file, please ensure this argument references a valid xlsx(Excel) file")
             sys.exit()
+        if known_args.store_only and known_args.store_directory is None:
+            logging.error(f"Argument --store_only requires --store_directory")
+            sys.exit()
+
+    _directories = [{"type":"Agent","input":known_args.agent_input_directory, "output":known_args.master_output_file, "archive":known_args.agent_archive_directory,
+                     "streaming":known_args.streaming, "appendOnly":known_args.append_only,
+                     "workers":known_args.workers, "storeOnly":known_args.store_only,
+                     "durations":known_args.durations,
+                     "upsert":known_args.upsert, "partition":known_args.partition,
+                     "archiveFormat":known_args.archive_format},
+                    {"type":"Volume","input":known_args.volume_input_directory, "output":known_args.master_output_file, "archive":known_args.volume_archive_directory,
+                     "streaming":known_args.streaming, "appendOnly":known_args.append_only,
+                     "workers":known_args.workers, "storeOnly":known_args.store_only,
+                     "durations":known_args.durations,
+                     "upsert":known_args.upsert, "partition":known_args.partition,
+                     "archiveFormat":known_args.archive_format}]
+
+    # Undo what a crashed run left half done before anything reads the master or the inputs
+    master_commit.recoverMaster(xlsxPath)
+    for archive_directory in (known_args.agent_archive_directory, known_args.volume_archive_directory):
+        master_commit.recoverArchive(archive_directory)
+
+    ledger = IngestionLedger(xlsxPath.with_suffix(".ledger.db")) if known_args.ledger else None
+    index = MasterIndex(xlsxPath.with_suffix(".index.db")) if known_args.upsert and not known_args.partition else None
+    rollups = RollupStore(xlsxPath) if known_args.rollups else None
+    queryIndex = openQueryIndex(xlsxPath) if known_args.query_index else None
+    try:
+        store = ColumnarStore(known_args.store_directory) if known_args.store_directory else None
+        merge = lambda: runBatch(_directories, known_args.metrics_file, ledger=ledger, store=store, index=index,
+                                 rollups=rollups, queryIndex=queryIndex)
+        if known_args.watch:
+            watcher = FolderWatcher([known_args.agent_input_directory, known_args.volume_input_directory],
+                                    intervalSeconds=known_args.poll_interval, quietSeconds=known_args.debounce,
+                                    maxDelaySeconds=known_args.max_delay)
+            watcher.run(merge)
+        else:
+            merge()
+    finally:
+        if ledger is not None:
+            ledger.close()
+        if index is not None:
+            index.close()
+        if rollups is not None:
+            rollups.close()
+        if queryIndex is not None:
+            queryIndex.close()
 
-    _directories = [{"type":"Agent","input":known_args.agent_input_directory, "output":known_args.master_output_file, "archive":known_args.agent_archive_directory},
-                    {"type":"Volume","input":known_args.volume_input_directory, "output":known_args.master_output_file, "archive":known_args.volume_archive_directory}]
 
-    for directory in _directories:
-        performFileMerge(directory)
+def runQuery(argv=None):
+    parser = argparse.ArgumentParser(prog="file_combine.py query",
+                                     description="Export the rows of the master for a date range as CSV")
+    parser.add_argument(
+        '--master_output_file',
+        dest='master_output_file',
+        required=True,
+        help='Master.xlsx to query, its partitions are included')
+    parser.add_argument(
+        '--type',
+        dest='report_type',
+        choices=tuple(_resultSheets),
+        required=True,
+        help='Report type to query')
+    parser.add_argument(
+        '--name', '--agent', '--topic',
+        dest='names',
+        action='append',
+        default=None,
+        help='Agent or topic to return, repeat for several, all by default')
+    parser.add_argument(
+        '--from',
+        dest='date_from',
+        default=None,
+        help='First extract date (YYYY-MM-DD) to return')
+    parser.add_argument(
+        '--to',
+        dest='date_to',
+        default=None,
+        help='Last extract date (YYYY-MM-DD) to return')
+    parser.add_argument(
+        '--csv',
+        dest='csv_file',
+        default=None,
+        help='Write the rows to this CSV file instead of the standard output')
+    known_args, _ = parser.parse_known_args(argv)
+
+    # The standard output may carry the CSV, messages go to the standard error
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s - %(message)s')
+    if os.path.isfile(known_args.master_output_file) == False and not \
+            pathlib.Path(known_args.master_output_file).with_suffix(".partitions.json").exists():
+        logging.error(f"Invalid file for argument --master_output_file")
+        sys.exit(1)
+    queryIndex = openQueryIndex(known_args.master_output_file)
+    try:
+        queryIndex.refresh()
+        rows = queryIndex.query(known_args.report_type, known_args.date_from, known_args.date_to, known_args.names)
+        headers = queryIndex.headers(known_args.report_type)
+        if known_args.csv_file is None:
+            writeCsv(sys.stdout, headers, rows)
+        else:
+            with open(known_args.csv_file, "w", newline="", encoding="utf-8") as fh:
+                count = writeCsv(fh, headers, rows)
+            print(f"{count} {known_args.report_type} rows written to {known_args.csv_file}")
+    except ValueError as e:
+        logging.error(f"Invalid date - {e}")
+        sys.exit(1)
+    finally:
+        queryIndex.close()
 
 
 if __name__ == '__main__':
-  run()
-  print("Done")
\ No newline at end of file
+  if sys.argv[1:2] == ["query"]:
+    runQuery(sys.argv[2:])
+  else:
+    run()
+    print("Done")
\ No newline at end of file
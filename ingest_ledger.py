@@ -0,0 +1,106 @@
+import sqlite3, hashlib, pathlib, logging
+from datetime import datetime
+
+
+class IngestionLedger(object):
+    '''
+    Persistent record of every input file and row merged into the master, kept in a SQLite file next to it.
+
+    Files are identified by a SHA-256 of their content, rows by (report type, extract date, agent/topic). Both are
+    primary keys so lookups stay cheap however much history the ledger holds. Recording happens after the master
+    was saved, a crash before archiving therefore no longer merges the same files again on the next run.
+    '''
+    def __init__(self, inLedgerFile):
+        self.ledgerFile = pathlib.Path(inLedgerFile)
+        self.skippedFiles = {}
+        self.connection = sqlite3.connect(str(self.ledgerFile))
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS files (hash TEXT PRIMARY KEY, report_type TEXT, file_name TEXT,
+                                              extract_date TEXT, rows INTEGER, merged_on TEXT);
+            CREATE TABLE IF NOT EXISTS rows (report_type TEXT, extract_date TEXT, name TEXT,
+                                             PRIMARY KEY (report_type, extract_date, name)) WITHOUT ROWID;
+        ''')
+
+    @staticmethod
+    def fileHash(filePath):
+        digest = hashlib.sha256()
+        with open(filePath, "rb") as fh:
+            for block in iter(lambda: fh.read(1024 * 1024), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    @staticmethod
+    def contentHash(data):
+        return hashlib.sha256(data).hexdigest()
+
+    def hasFile(self, contentHash):
+        return self.connection.execute("SELECT 1 FROM files WHERE hash = ?", (contentHash,)).fetchone() is not None
+
+    def hasRow(self, reportType, extractDate, name):
+        return self.connection.execute("SELECT 1 FROM rows WHERE report_type = ? AND extract_date = ? AND name = ?",
+                                       (reportType, extractDate, name)).fetchone() is not None
+
+    def skipFile(self, filePath, reportType):
+        '''
+        :returns The content hash of the file, or None when the file was merged before and is to be skipped
+        '''
+        return self.skipContent(self.fileHash(filePath), filePath.name, reportType)
+
+    def skipContent(self, contentHash, fileName, reportType):
+        '''
+        :returns The content hash, or None when content with that hash was merged before and is to be skipped
+        '''
+        if self.hasFile(contentHash):
+            logging.info(f"{fileName} - Already merged, skipped by ledger {self.ledgerFile.name}")
+            self.skippedFiles[reportType] = self.skippedFiles.get(reportType, 0) + 1
+            return None
+        return contentHash
+
+    def filterReports(self, reports):
+        '''
+        :arg reports - Reports about to be merged
+
+        Drop rows whose (report type, extract date, agent/topic) is already in the ledger or repeated in this run.
+
+        :returns A count of the rows removed
+        '''
+        skipped = 0
+        seen = set()
+        for report in reports:
+            extractDate = report.extractDate()
+            keep = []
+            for index, name in enumerate(report.content.keys()):
+                key = (report.reportTypeOverride, extractDate, str(name))
+                if key in seen or self.hasRow(*key):
+                    skipped += 1
+                    continue
+                seen.add(key)
+                keep.append(index)
+            if len(keep) < len(report.content):
+                report.content = report.content.select(keep)
+        if skipped > 0:
+            logging.info(f"{skipped} rows already merged, skipped by ledger {self.ledgerFile.name}")
+        return skipped
+
+    def record(self, reports):
+        '''
+        :arg reports - Reports whose rows were saved to the master
+
+        Rows that failed a conversion (ReportBatch.errors) were not written and are not recorded, a corrected export
+        of them is merged when it arrives.
+        '''
+        mergedOn = datetime.now().isoformat(timespec="seconds")
+        with self.connection:
+            for report in reports:
+                extractDate = report.extractDate()
+                errors = getattr(report.content, "errors", {})
+                names = [name for index, name in enumerate(report.content.keys()) if index not in errors]
+                if report.contentHash is not None:
+                    self.connection.execute("INSERT OR IGNORE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                                            (report.contentHash, report.reportTypeOverride, report.fileName,
+                                             extractDate, len(names), mergedOn))
+                self.connection.executemany("INSERT OR IGNORE INTO rows VALUES (?, ?, ?)",
+                                            [(report.reportTypeOverride, extractDate, str(name)) for name in names])
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,392 @@
+import os, re, json, math, base64, struct, zlib, zipfile, posixpath, pathlib, logging
+import xml.etree.ElementTree as ET
+from datetime import timedelta
+from master_commit import replaceFile, writeBytes
+
+# Append layout of Master.xlsx
+#
+# The "Daily Agent Reports"/"Daily Volume Reports" sheet parts are stored uncompressed with a block of spaces
+# reserved after the closing </worksheet> tag, and the AgentResults/VolumeResults table parts are padded to a fixed
+# length. New rows are written over the short sheet tail from </sheetData> onwards, the tail moves into the reserved
+# block, and only the CRCs, the table ref and the zip comment holding the layout state are rewritten. The CRC of the
+# remaining spaces is derived with crc32_combine, so an append costs the same no matter how much history the
+# master holds.
+# Any other writer (openpyxl, Excel) drops the zip comment, after which the layout is simply prepared again.
+# The bytes an append overwrites are saved to <master>.journal before the append writes them, rollbackJournal
+# puts them back when an append was interrupted.
+
+_SHEETS = {"Agent": ("Daily Agent Reports", "AgentResults"),
+           "Volume": ("Daily Volume Reports", "VolumeResults")}
+_STATE_KEY = "merge_excel_files.append"
+_DEFAULT_GAP = 1024 * 1024
+_TABLE_PAD = 64
+_NS = {"m": "http://schemas.openxmlformats.org/spreadsheetml/2006/main"}
+_REL_ID = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id"
+_EOCD = struct.Struct("<4s4H2LH")
+_CENTRAL = struct.Struct("<4s6H3L5H2L")
+_LOCAL = struct.Struct("<4s5H3L2H")
+_CRC_POLY = 0xedb88320
+_X2N = []
+_SPACE_CRCS = []
+_DURATION_FORMATS = {46: "[h]:mm:ss"}
+# Control characters XML 1.0 does not allow, the pattern of openpyxl.cell.cell.ILLEGAL_CHARACTERS_RE without importing
+# openpyxl for an append
+_ILLEGAL_CHARACTERS = re.compile(r"[\000-\010]|[\013-\014]|[\016-\037]")
+JOURNAL_SUFFIX = ".journal"
+
+
+def _multModP(a, b):
+    # Multiply two polynomials modulo the CRC-32 polynomial (reflected), as zlib does
+    product = 0
+    mask = 1 << 31
+    while True:
+        if a & mask:
+            product ^= b
+            if a & (mask - 1) == 0:
+                return product
+        mask >>= 1
+        b = (b >> 1) ^ _CRC_POLY if b & 1 else b >> 1
+
+
+def _x2nModP(n, k):
+    if not _X2N:
+        power = 1 << 30
+        _X2N.append(power)
+        for _ in range(31):
+            power = _multModP(power, power)
+            _X2N.append(power)
+    product = 1 << 31
+    while n:
+        if n & 1:
+            product = _multModP(_X2N[k & 31], product)
+        n >>= 1
+        k += 1
+    return product
+
+
+def _crcCombine(crc1, crc2, length2):
+    '''
+    :returns The CRC-32 of two concatenated blocks from their CRCs and the length of the second block
+    '''
+    return _multModP(_x2nModP(length2, 3), crc1) ^ crc2
+
+
+def _crcSpaces(length):
+    '''
+    :returns The CRC-32 of a run of spaces, built from cached runs of 2^k spaces so the run is never materialised
+    '''
+    if not _SPACE_CRCS:
+        _SPACE_CRCS.append(zlib.crc32(b" " * 65536))
+    crc = 0
+    for bit in range(length.bit_length() - 1, 15, -1):
+        if length >> bit & 1:
+            while len(_SPACE_CRCS) <= bit - 16:
+                last = _SPACE_CRCS[-1]
+                _SPACE_CRCS.append(_crcCombine(last, last, 1 << (len(_SPACE_CRCS) + 15)))
+            crc = _crcCombine(crc, _SPACE_CRCS[bit - 16], 1 << bit)
+    return zlib.crc32(b" " * (length & 0xffff), crc)
+
+
+def _resolvePart(source, target):
+    if target.startswith("/"):
+        return target[1:]
+    return posixpath.normpath(posixpath.join(posixpath.dirname(source), target))
+
+
+def _findParts(zf):
+    '''
+    :arg zf - Open zipfile of the master workbook
+
+    :returns {reportType: (sheetPart, tablePart)} for every daily sheet present with its results table
+    '''
+    names = set(zf.namelist())
+    workbook = ET.fromstring(zf.read("xl/workbook.xml"))
+    targets = {rel.get("Id"): rel.get("Target") for rel in ET.fromstring(zf.read("xl/_rels/workbook.xml.rels"))}
+    parts = {}
+    for sheet in workbook.iterfind("m:sheets/m:sheet", _NS):
+        for reportType, (sheetName, tableName) in _SHEETS.items():
+            if sheet.get("name") != sheetName: continue
+            sheetPart = _resolvePart("xl/workbook.xml", targets[sheet.get(_REL_ID)])
+            relsPart = posixpath.join(posixpath.dirname(sheetPart), "_rels", posixpath.basename(sheetPart) + ".rels")
+            if relsPart not in names: continue
+            for rel in ET.fromstring(zf.read(relsPart)):
+                if not rel.get("Type", "").endswith("/table"): continue
+                tablePart = _resolvePart(sheetPart, rel.get("Target"))
+                if ET.fromstring(zf.read(tablePart)).get("displayName") == tableName:
+                    parts[reportType] = (sheetPart, tablePart)
+    return parts
+
+
+def _durationStyle(zf):
+    '''
+    :returns The index of the cell format showing elapsed [h]:mm:ss time, as openpyxl writes timedelta cells, or None
+    when the workbook has none yet
+    '''
+    if "xl/styles.xml" not in zf.namelist(): return None
+    styles = ET.fromstring(zf.read("xl/styles.xml"))
+    formats = dict(_DURATION_FORMATS)
+    formats.update({int(numFmt.get("numFmtId")): numFmt.get("formatCode")
+                    for numFmt in styles.iterfind("m:numFmts/m:numFmt", _NS)})
+    for index, xf in enumerate(styles.iterfind("m:cellXfs/m:xf", _NS)):
+        if formats.get(int(xf.get("numFmtId", 0)), "").lower() in ("[h]:mm:ss", "[hh]:mm:ss"):
+            return index
+    return None
+
+
+def _columnLetter(index):
+    letters = ""
+    while index > 0:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def _rowXml(rowIndex, line, durationStyle=None):
+    cells = []
+    for columnIndex, value in enumerate(line, start=1):
+        if value is None: continue
+        ref = f"{_columnLetter(columnIndex)}{rowIndex}"
+        if isinstance(value, timedelta):
+            cells.append(f'<c r="{ref}" s="{durationStyle}" t="n"><v>{value.total_seconds() / 86400}</v></c>')
+        elif isinstance(value, bool):
+            cells.append(f'<c r="{ref}" t="b"><v>{int(value)}</v></c>')
+        elif isinstance(value, float) and not math.isfinite(value):
+            # NaN and infinity have no SpreadsheetML number form, the cell is left blank
+            continue
+        elif isinstance(value, (int, float)):
+            cells.append(f'<c r="{ref}" t="n"><v>{value}</v></c>')
+        else:
+            text = _ILLEGAL_CHARACTERS.sub("", str(value))
+            text = text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+            space = ' xml:space="preserve"' if text != text.strip() else ""
+            cells.append(f'<c r="{ref}" t="inlineStr"><is><t{space}>{text}</t></is></c>')
+    return f'<row r="{rowIndex}">{"".join(cells)}</row>'.encode("utf-8")
+
+
+def _setTableRef(data, lastRow):
+    return re.sub(rb'ref="([A-Z]+)1:([A-Z]+)\d+"', lambda m: b'ref="%s1:%s%d"' % (m[1], m[2], lastRow), data)
+
+
+def _readDirectory(fh):
+    '''
+    :arg fh - Master workbook opened in binary mode
+
+    :returns eocdOffset, comment, {name: (centralOffset, localOffset, method, size)}
+    '''
+    fh.seek(0, os.SEEK_END)
+    fileSize = fh.tell()
+    tailSize = min(fileSize, _EOCD.size + 65535)
+    fh.seek(fileSize - tailSize)
+    tail = fh.read(tailSize)
+    eocdOffset = tail.rfind(b"PK\x05\x06")
+    if eocdOffset < 0:
+        raise zipfile.BadZipFile("End of central directory not found")
+    _, _, _, _, count, directorySize, directoryOffset, commentLength = _EOCD.unpack_from(tail, eocdOffset)
+    comment = tail[eocdOffset + _EOCD.size:eocdOffset + _EOCD.size + commentLength]
+    fh.seek(directoryOffset)
+    directory = fh.read(directorySize)
+    entries = {}
+    position = 0
+    for _ in range(count):
+        fields = _CENTRAL.unpack_from(directory, position)
+        nameLength, extraLength, commentLength = fields[10], fields[11], fields[12]
+        name = directory[position + _CENTRAL.size:position + _CENTRAL.size + nameLength].decode("utf-8")
+        entries[name] = (directoryOffset + position, fields[16], fields[4], fields[9])
+        position += _CENTRAL.size + nameLength + extraLength + commentLength
+    return fileSize - tailSize + eocdOffset, comment, entries
+
+
+def _dataOffset(fh, localOffset):
+    fh.seek(localOffset)
+    fields = _LOCAL.unpack(fh.read(_LOCAL.size))
+    return localOffset + _LOCAL.size + fields[9] + fields[10]
+
+
+def _crcWrites(entry, crc):
+    centralOffset, localOffset, _, _ = entry
+    return [(localOffset + 14, struct.pack("<L", crc)), (centralOffset + 16, struct.pack("<L", crc))]
+
+
+def _journalPath(filePath):
+    return filePath.with_name(filePath.name + JOURNAL_SUFFIX)
+
+
+def _applyWrites(fh, filePath, writes, size):
+    '''
+    :arg writes - (offset, bytes) written in order
+    :arg size - Size of the package once written
+
+    Journal the bytes about to be overwritten, write, flush and drop the journal.
+    '''
+    stat = os.fstat(fh.fileno())
+    undo = []
+    for offset, data in writes:
+        fh.seek(offset)
+        undo.append([offset, base64.b64encode(fh.read(len(data))).decode("ascii")])
+    writeBytes(_journalPath(filePath), json.dumps({"size": stat.st_size, "mtime": stat.st_mtime_ns,
+                                                   "writes": undo}).encode("utf-8"))
+    for offset, data in writes:
+        fh.seek(offset)
+        fh.write(data)
+    fh.truncate(size)
+    fh.flush()
+    os.fsync(fh.fileno())
+    _journalPath(filePath).unlink()
+
+
+def rollbackJournal(output_file):
+    '''
+    :arg output_file - Location of Master.xlsx
+
+    Restore the master as it was before an interrupted append, including its modification time so a MasterIndex
+    still recognises it.
+
+    :returns True when a journal was rolled back
+    '''
+    filePath = pathlib.Path(output_file)
+    journalPath = _journalPath(filePath)
+    if not journalPath.exists(): return False
+    journal = json.loads(journalPath.read_text())
+    with open(filePath, "r+b") as fh:
+        for offset, data in reversed(journal["writes"]):
+            fh.seek(offset)
+            fh.write(base64.b64decode(data))
+        fh.truncate(journal["size"])
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.utime(filePath, ns=(journal["mtime"], journal["mtime"]))
+    journalPath.unlink()
+    logging.warning(f"{filePath.name} - Rolled back an interrupted append")
+    return True
+
+
+def _loadState(comment):
+    try:
+        return json.loads(comment.decode("utf-8")).get(_STATE_KEY)
+    except (UnicodeDecodeError, ValueError, AttributeError):
+        return None
+
+
+def prepareMaster(output_file, gaps=None):
+    '''
+    :arg output_file - Location of Master.xlsx
+    :arg gaps - Optional {reportType: bytes} overriding the space reserved for new rows
+
+    Rewrite the master into the append layout. This costs a full copy of the package and is only needed the first
+    time, after another writer saved the master, or when the reserved space of a sheet runs out (the reserve then
+    grows with the sheet so the copies stay amortised).
+
+    :returns True when at least one daily sheet was prepared
+    '''
+    filePath = pathlib.Path(output_file)
+    gaps = gaps or {}
+    tempPath = filePath.with_name(filePath.name + ".tmp")
+    state = {}
+    with zipfile.ZipFile(filePath) as zf:
+        parts = _findParts(zf)
+        durationStyle = _durationStyle(zf)
+        sheetParts = {sheetPart: reportType for reportType, (sheetPart, _) in parts.items()}
+        tableParts = {tablePart for _, tablePart in parts.values()}
+        with zipfile.ZipFile(tempPath, "w") as out:
+            for info in zf.infolist():
+                data = zf.read(info)
+                target = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+                target.external_attr = info.external_attr
+                target.compress_type = info.compress_type
+                if info.filename in sheetParts:
+                    reportType = sheetParts[info.filename]
+                    data = re.sub(rb"<dimension [^>]*/>", b"", data, count=1)
+                    data = re.sub(rb"<sheetData\s*/>", b"<sheetData></sheetData>", data, count=1).rstrip(b" ")
+                    end = data.rindex(b"</sheetData>")
+                    lastRow = re.search(rb'<row r="(\d+)"', data[data.rfind(b"<row ", 0, end):end])
+                    gap = gaps.get(reportType, max(_DEFAULT_GAP, len(data) // 4))
+                    state[reportType] = {"sheet": info.filename, "table": parts[reportType][1],
+                                         "row": int(lastRow[1]) if lastRow else 0, "fill": end,
+                                         "tail": len(data) - end, "gap": gap, "crc": zlib.crc32(data[:end]),
+                                         "size": len(data) + gap, "durationStyle": durationStyle}
+                    data += b" " * gap
+                    target.compress_type = zipfile.ZIP_STORED
+                elif info.filename in tableParts:
+                    data = data.rstrip(b" ") + b" " * _TABLE_PAD
+                    target.compress_type = zipfile.ZIP_STORED
+                out.writestr(target, data)
+            out.comment = json.dumps({_STATE_KEY: state}).encode("utf-8")
+    replaceFile(tempPath, filePath)
+    logging.info(f"{filePath.name} - Prepared append layout for {', '.join(state) or 'no sheets'}")
+    return len(state) > 0
+
+
+def appendRows(output_file, reportType, lines):
+    '''
+    :arg output_file - Location of Master.xlsx
+    :arg reportType - "Agent" or "Volume", selects the daily sheet and results table
+    :arg lines - Rows to append as returned by AgentReport/VolumeReport.getLineEntry
+
+    Append rows to a master in append layout, writing only the new rows, the table ref and the zip bookkeeping.
+
+    :returns True when the rows were written, False when the master has no append layout for the report type
+    and has to be merged with a full load and save instead
+    '''
+    filePath = pathlib.Path(output_file)
+    try:
+        fh = open(filePath, "r+b")
+    except FileNotFoundError:
+        return False
+    with fh:
+        try:
+            eocdOffset, comment, entries = _readDirectory(fh)
+        except zipfile.BadZipFile:
+            logging.warning(f"{filePath.name} - Not a valid zip package", exc_info=True)
+            return False
+        layout = _loadState(comment)
+        state = layout.get(reportType) if layout else None
+        if state is None:
+            return False
+        sheetEntry = entries.get(state["sheet"])
+        tableEntry = entries.get(state["table"])
+        if sheetEntry is None or tableEntry is None or sheetEntry[2] != zipfile.ZIP_STORED \
+                or sheetEntry[3] != state["size"] or tableEntry[2] != zipfile.ZIP_STORED:
+            logging.warning(f"{filePath.name} - Append layout state does not match the package")
+            return False
+
+        if state.get("durationStyle") is None and len(lines) > 0 \
+                and any(isinstance(value, timedelta) for value in lines[0]):
+            logging.info(f"{filePath.name} - No duration cell format yet for {reportType}")
+            return False
+        rowsXml = b"".join(_rowXml(state["row"] + index + 1, line, state.get("durationStyle"))
+                           for index, line in enumerate(lines))
+        if len(rowsXml) > state["gap"]:
+            fh.close()
+            logging.info(f"{filePath.name} - Reserved space exhausted for {reportType}, growing append layout")
+            prepareMaster(filePath, gaps={reportType: max(_DEFAULT_GAP, 2 * len(rowsXml), state["size"] // 4)})
+            return appendRows(filePath, reportType, lines)
+
+        sheetOffset = _dataOffset(fh, sheetEntry[1])
+        fh.seek(sheetOffset + state["fill"])
+        tail = fh.read(state["tail"])
+        if not tail.startswith(b"</sheetData>"):
+            logging.warning(f"{filePath.name} - Append layout state does not match the package")
+            return False
+        writes = [(sheetOffset + state["fill"], rowsXml + tail)]
+        prefixCrc = zlib.crc32(rowsXml, state["crc"])
+        gap = state["gap"] - len(rowsXml)
+        writes += _crcWrites(sheetEntry, _crcCombine(zlib.crc32(tail, prefixCrc), _crcSpaces(gap), gap))
+        state["row"] += len(lines)
+        state["fill"] += len(rowsXml)
+        state["gap"] -= len(rowsXml)
+        state["crc"] = prefixCrc
+
+        tableOffset = _dataOffset(fh, tableEntry[1])
+        fh.seek(tableOffset)
+        table = fh.read(tableEntry[3])
+        updated = _setTableRef(table.rstrip(b" "), state["row"])
+        updated += b" " * (len(table) - len(updated))
+        writes.append((tableOffset, updated))
+        writes += _crcWrites(tableEntry, zlib.crc32(updated))
+
+        comment = json.dumps({_STATE_KEY: layout}).encode("utf-8")
+        fh.seek(eocdOffset)
+        eocd = _EOCD.unpack(fh.read(_EOCD.size))
+        writes.append((eocdOffset, _EOCD.pack(*eocd[:-1], len(comment)) + comment))
+        _applyWrites(fh, filePath, writes, eocdOffset + _EOCD.size + len(comment))
+    return True
@@ -0,0 +1,209 @@
+import os, errno, json, shutil, filecmp, zipfile, pathlib, logging
+from datetime import datetime
+
+# Commit stage of a merge
+#
+# Every workbook is saved next to its destination as <name>.tmp, flushed to disk and renamed over the destination,
+# so a crash leaves either the previous or the new master, never half of one. In-place appends keep an undo journal
+# instead, see master_append. Consumed input files are archived as one batch described by a journal in the archive
+# directory, an interrupted batch is completed by recoverArchive on the next start.
+
+_ARCHIVE_JOURNAL = ".archive_batch.json"
+
+
+def fsyncDirectory(directory):
+    # Makes a rename durable on POSIX, Windows has no directory handles to flush
+    if os.name != "posix": return
+    descriptor = os.open(str(directory), os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+def replaceFile(tempPath, filePath):
+    '''
+    Flush tempPath to disk and rename it over filePath in a single step.
+    '''
+    with open(tempPath, "rb+") as fh:
+        os.fsync(fh.fileno())
+    os.replace(tempPath, filePath)
+    fsyncDirectory(pathlib.Path(filePath).parent)
+
+
+def tempPath(filePath):
+    filePath = pathlib.Path(filePath)
+    return filePath.with_name(filePath.name + ".tmp")
+
+
+def saveWorkbook(xlsx, output_file):
+    '''
+    :arg xlsx - openpyxl Workbook
+    :arg output_file - Destination, replaced only once the workbook is completely written
+    '''
+    filePath = pathlib.Path(output_file)
+    temp = tempPath(filePath)
+    try:
+        xlsx.save(temp)
+        replaceFile(temp, filePath)
+    except BaseException:
+        temp.unlink(missing_ok=True)
+        raise
+
+
+def writeBytes(output_file, data):
+    '''
+    Write data to output_file through a temp file and rename, see saveWorkbook.
+    '''
+    filePath = pathlib.Path(output_file)
+    temp = tempPath(filePath)
+    try:
+        temp.write_bytes(data)
+        replaceFile(temp, filePath)
+    except BaseException:
+        temp.unlink(missing_ok=True)
+        raise
+
+
+def recoverMaster(output_file):
+    '''
+    :arg output_file - Location of Master.xlsx
+
+    Undo in-place appends interrupted by a crash and drop the temp files of interrupted saves, for the master and
+    the partition and rollup workbooks next to it.
+
+    :returns A count of the files recovered
+    '''
+    import master_append
+
+    filePath = pathlib.Path(output_file)
+    recovered = 0
+    if not filePath.parent.is_dir(): return recovered
+    for journal in filePath.parent.glob(f"{filePath.stem}*{filePath.suffix}{master_append.JOURNAL_SUFFIX}"):
+        master_append.rollbackJournal(journal.with_name(journal.name[:-len(master_append.JOURNAL_SUFFIX)]))
+        recovered += 1
+    for temp in filePath.parent.glob(f"{filePath.stem}*{filePath.suffix}.tmp"):
+        logging.warning(f"{temp.name} - Removing the output of an interrupted save, {temp.stem} is unchanged")
+        temp.unlink()
+        recovered += 1
+    return recovered
+
+
+def _writeJournal(archive_directory, batch):
+    writeBytes(pathlib.Path(archive_directory, _ARCHIVE_JOURNAL), json.dumps(batch).encode("utf-8"))
+
+
+def _uniqueTarget(target):
+    # An archived file of the same name but different content is kept, the new one gets a numbered name
+    for number in range(1, 10000):
+        candidate = target.with_name(f"{target.stem} ({number}){target.suffix}")
+        if not candidate.exists():
+            return candidate
+    raise FileExistsError(target)
+
+
+def _moveFile(source, target):
+    try:
+        os.replace(source, target)
+    except OSError as e:
+        if e.errno != errno.EXDEV: raise
+        # Archive on another file system, copy under a temp name first so the target is never partial
+        temp = tempPath(target)
+        shutil.copy2(source, temp)
+        replaceFile(temp, target)
+        os.unlink(source)
+
+
+def _runBatch(archive_directory, batch):
+    archivePath = pathlib.Path(archive_directory)
+    if batch.get("zip"):
+        for source, _ in batch["files"]:
+            try:
+                os.unlink(source)
+            except FileNotFoundError:
+                pass
+    else:
+        for source, target in batch["files"]:
+            if not os.path.exists(source): continue
+            if target is None:
+                os.unlink(source)
+            else:
+                _moveFile(source, target)
+    fsyncDirectory(archivePath)
+    pathlib.Path(archivePath, _ARCHIVE_JOURNAL).unlink(missing_ok=True)
+
+
+def archiveFiles(files, archive_directory, compress=False):
+    '''
+    :arg files - Paths of the consumed input files
+    :arg archive_directory - Receives the files, renamed into it when on the same file system
+    :arg compress - Write the files to a single Archive_<timestamp>.zip instead and remove them
+
+    A file already archived with identical content is removed, one with different content is archived under a
+    numbered name. The batch is written to a journal first, so recoverArchive can complete it after a crash.
+
+    :returns A count of the files archived
+    '''
+    archivePath = pathlib.Path(archive_directory)
+    files = [pathlib.Path(file) for file in files]
+    if len(files) == 0: return 0
+    if compress:
+        zipPath = archivePath / f"Archive_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.zip"
+        batch = {"zip": str(zipPath), "files": [[str(file), None] for file in files]}
+        temp = tempPath(zipPath)
+        try:
+            with zipfile.ZipFile(temp, "w", zipfile.ZIP_DEFLATED) as zf:
+                names = set()
+                for file in files:
+                    name = file.name if file.name not in names else f"{file.parent.name}/{file.name}"
+                    names.add(name)
+                    zf.write(file, name)
+            _writeJournal(archivePath, batch)
+            replaceFile(temp, zipPath)
+        except BaseException:
+            temp.unlink(missing_ok=True)
+            raise
+        logging.info(f"{len(files)} files archived to {zipPath}")
+    else:
+        moves = []
+        for file in files:
+            target = archivePath / file.name
+            if target.exists():
+                if filecmp.cmp(file, target, shallow=False):
+                    logging.warning(f"{file.name} already archived in {archive_directory}, removed")
+                    target = None
+                else:
+                    target = _uniqueTarget(target)
+                    logging.warning(f"{file.name} already exist in archive {archive_directory}, "
+                                    f"archived as {target.name}")
+            moves.append([str(file), str(target) if target is not None else None])
+        batch = {"zip": None, "files": moves}
+        _writeJournal(archivePath, batch)
+        logging.info(f"{len(files)} files archived to {archive_directory}")
+    _runBatch(archivePath, batch)
+    return len(files)
+
+
+def recoverArchive(archive_directory):
+    '''
+    Complete an archive batch interrupted by a crash, a zip that was never renamed into place leaves its input
+    files where they are.
+
+    :returns True when a batch was found
+    '''
+    journal = pathlib.Path(archive_directory, _ARCHIVE_JOURNAL)
+    if not journal.exists(): return False
+    try:
+        batch = json.loads(journal.read_text())
+    except ValueError:
+        logging.error(f"{journal} - Unreadable archive journal, removed")
+        journal.unlink()
+        return True
+    if batch.get("zip") and not os.path.exists(batch["zip"]):
+        tempPath(batch["zip"]).unlink(missing_ok=True)
+        journal.unlink()
+        logging.warning(f"{archive_directory} - Interrupted archive {batch['zip']} dropped, inputs kept")
+        return True
+    logging.warning(f"{archive_directory} - Completing an interrupted archive of {len(batch['files'])} files")
+    _runBatch(archive_directory, batch)
+    return True
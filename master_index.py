@@ -0,0 +1,106 @@
+import sqlite3, pathlib, logging
+from datetime import datetime
+
+
+def _keyDate(value):
+    # Dates are written as MM/DD/YYYY text, a cell retyped in Excel comes back as a datetime
+    if isinstance(value, datetime):
+        return value.strftime("%m/%d/%Y")
+    return str(value)
+
+
+class MasterIndex(object):
+    '''
+    Row number of every (report type, extract date, agent/topic) in the master, kept in a SQLite file next to it.
+
+    The index carries the size and modification time of the master it describes. As long as only file_combine writes
+    the master they match and no sheet is ever scanned, after any other writer (Excel, a restore) the index is
+    rebuilt from the workbook loaded for the merge.
+    '''
+    def __init__(self, inIndexFile):
+        self.indexFile = pathlib.Path(inIndexFile)
+        self.connection = sqlite3.connect(str(self.indexFile))
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS keys (report_type TEXT, extract_date TEXT, name TEXT, row INTEGER,
+                                             PRIMARY KEY (report_type, extract_date, name)) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS sheets (report_type TEXT PRIMARY KEY, last_row INTEGER);
+            CREATE TABLE IF NOT EXISTS master (id INTEGER PRIMARY KEY CHECK (id = 0), size INTEGER, mtime INTEGER);
+        ''')
+
+    @staticmethod
+    def fingerprint(filePath):
+        try:
+            stat = pathlib.Path(filePath).stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    def isCurrent(self, filePath):
+        '''
+        :returns True when the index describes the master as it is on disk
+        '''
+        row = self.connection.execute("SELECT size, mtime FROM master WHERE id = 0").fetchone()
+        return row is not None and tuple(row) == self.fingerprint(filePath)
+
+    def rebuild(self, reportType, sheet):
+        '''
+        :arg sheet - Daily sheet of the report type, the agent/topic is in column A and the date in column B
+
+        Replace the keys of the report type with those of the sheet, a later row wins over an earlier duplicate.
+        '''
+        self.connection.execute("DELETE FROM keys WHERE report_type = ?", (reportType,))
+        lastRow = 1
+        keys = {}
+        for rowIndex, row in enumerate(sheet.iter_rows(min_row=2, max_col=2, values_only=True), start=2):
+            lastRow = rowIndex
+            if row[0] is None or len(row) < 2 or row[1] is None: continue
+            keys[(_keyDate(row[1]), str(row[0]))] = rowIndex
+        self.connection.executemany("INSERT INTO keys VALUES (?, ?, ?, ?)",
+                                    [(reportType, extractDate, name, rowIndex)
+                                     for (extractDate, name), rowIndex in keys.items()])
+        self.setLastRow(reportType, lastRow)
+        logging.info(f"{self.indexFile.name} - Rebuilt {len(keys)} {reportType} keys up to row {lastRow}")
+
+    def clear(self, reportType):
+        self.connection.execute("DELETE FROM keys WHERE report_type = ?", (reportType,))
+        self.setLastRow(reportType, 1)
+
+    def rows(self, reportType, extractDates):
+        '''
+        :returns {(extractDate, name): row} of the report type for the given extract dates
+        '''
+        rows = {}
+        for extractDate in extractDates:
+            for name, row in self.connection.execute("SELECT name, row FROM keys WHERE report_type = ? AND "
+                                                     "extract_date = ?", (reportType, str(extractDate))):
+                rows[(str(extractDate), name)] = row
+        return rows
+
+    def lastRow(self, reportType):
+        row = self.connection.execute("SELECT last_row FROM sheets WHERE report_type = ?", (reportType,)).fetchone()
+        return row[0] if row else 1
+
+    def setLastRow(self, reportType, lastRow):
+        self.connection.execute("INSERT OR REPLACE INTO sheets VALUES (?, ?)", (reportType, lastRow))
+
+    def update(self, reportType, rows):
+        '''
+        :arg rows - {(extractDate, name): row} of rows written to the master
+        '''
+        self.connection.executemany("INSERT OR REPLACE INTO keys VALUES (?, ?, ?, ?)",
+                                    [(reportType, extractDate, name, row) for (extractDate, name), row in rows.items()])
+
+    def commit(self, filePath):
+        '''
+        Store the fingerprint of the saved master together with the keys written to it.
+        '''
+        fingerprint = self.fingerprint(filePath)
+        if fingerprint is not None:
+            self.connection.execute("INSERT OR REPLACE INTO master VALUES (0, ?, ?)", fingerprint)
+        self.connection.commit()
+
+    def rollback(self):
+        self.connection.rollback()
+
+    def close(self):
+        self.connection.close()
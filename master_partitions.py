@@ -0,0 +1,126 @@
+import re, json, zipfile, pathlib, logging, warnings
+import xml.etree.ElementTree as ET
+from datetime import datetime
+from master_commit import saveWorkbook, writeBytes
+
+PARTITIONS = ("month", "year")
+
+
+def partitionKey(extractDate, partition):
+    '''
+    :arg extractDate - MM/DD/YYYY extract date of a report
+    :arg partition - "month" or "year"
+
+    :returns "YYYY-MM" or "YYYY"
+    '''
+    day = datetime.strptime(str(extractDate), "%m/%d/%Y")
+    return day.strftime("%Y-%m") if partition == "month" else day.strftime("%Y")
+
+
+def partitionPath(output_file, key):
+    '''
+    :returns The workbook of a partition, next to the master: Master.xlsx -> Master_2026-01.xlsx
+    '''
+    outputPath = pathlib.Path(output_file)
+    return outputPath.with_name(f"{outputPath.stem}_{key}{outputPath.suffix}")
+
+
+def partitionFiles(output_file):
+    '''
+    :returns The partition workbooks listed in the manifest of the master, oldest partition first
+    '''
+    outputPath = pathlib.Path(output_file)
+    manifestFile = outputPath.with_suffix(".partitions.json")
+    if not manifestFile.exists(): return []
+    partitions = json.loads(manifestFile.read_text()).get("partitions", {})
+    return [outputPath.with_name(entry["file"]) for _, entry in sorted(partitions.items())]
+
+
+def tableRows(filePath, tables):
+    '''
+    :arg filePath - Saved partition workbook
+    :arg tables - {reportType: display name of its results table}
+
+    :returns {reportType: data rows of the table}, read from the table refs without loading the workbook
+    '''
+    rows = {}
+    with zipfile.ZipFile(filePath) as zf:
+        for name in zf.namelist():
+            if not name.startswith("xl/tables/"): continue
+            table = ET.fromstring(zf.read(name))
+            for reportType, tableName in tables.items():
+                if table.get("displayName") != tableName: continue
+                first, last = [int(re.sub(r"[A-Z$]", "", cell)) for cell in table.get("ref").split(":")]
+                rows[reportType] = last - first
+    return rows
+
+
+class PartitionManifest(object):
+    '''
+    List of the partition workbooks of a master, kept as <master>.partitions.json and mirrored to a small
+    <master>_partitions.xlsx for people browsing the reports:
+
+        {"partition": "month", "partitions": {"2026-01": {"file", "first", "last", "rows", "updated"}}}
+
+    first/last are the ISO extract dates merged into the partition, rows the rows per report type in the partition
+    workbook as saved, so days re-delivered with --upsert are not counted twice.
+    '''
+    def __init__(self, output_file, partition):
+        outputPath = pathlib.Path(output_file)
+        self.manifestFile = outputPath.with_suffix(".partitions.json")
+        self.indexWorkbook = outputPath.with_name(f"{outputPath.stem}_partitions{outputPath.suffix}")
+        self.partition = partition
+        self.partitions = {}
+        if self.manifestFile.exists():
+            manifest = json.loads(self.manifestFile.read_text())
+            if manifest.get("partition") != partition:
+                logging.warning(f"{self.manifestFile.name} - Partitioned by {manifest.get('partition')}, "
+                                f"now partitioning by {partition}")
+            self.partitions = manifest.get("partitions", {})
+
+    def update(self, key, filePath, extractDates, rows):
+        '''
+        :arg key - Partition key
+        :arg filePath - Workbook of the partition
+        :arg extractDates - Extract dates merged into the partition by this run
+        :arg rows - {reportType: rows} in the saved workbook, see tableRows
+        '''
+        dates = sorted(datetime.strptime(str(extractDate), "%m/%d/%Y").date().isoformat()
+                       for extractDate in extractDates)
+        entry = self.partitions.setdefault(key, {"file": pathlib.Path(filePath).name, "first": dates[0],
+                                                 "last": dates[-1], "rows": {}})
+        entry["first"] = min(entry["first"], dates[0])
+        entry["last"] = max(entry["last"], dates[-1])
+        entry["rows"].update(rows)
+        entry["updated"] = datetime.now().isoformat(timespec="seconds")
+
+    def save(self):
+        writeBytes(self.manifestFile, json.dumps({"partition": self.partition,
+                                                  "partitions": dict(sorted(self.partitions.items()))},
+                                                 indent=2).encode("utf-8"))
+        self.writeIndexWorkbook()
+
+    def writeIndexWorkbook(self):
+        import openpyxl
+        from openpyxl.worksheet.filters import AutoFilter
+        from openpyxl.worksheet.table import Table, TableColumn, TableStyleInfo
+
+        reportTypes = sorted({reportType for entry in self.partitions.values() for reportType in entry["rows"]})
+        headers = ["Partition", "File", "First Date", "Last Date"] + [f"{reportType} Rows"
+                                                                      for reportType in reportTypes] + ["Updated"]
+        xlsx = openpyxl.Workbook(write_only=True)
+        sheet = xlsx.create_sheet("Partitions")
+        sheet.append(headers)
+        for key, entry in sorted(self.partitions.items()):
+            sheet.append([key, entry["file"], entry["first"], entry["last"]] +
+                         [entry["rows"].get(reportType, 0) for reportType in reportTypes] + [entry.get("updated")])
+        ref = f"A1:{openpyxl.utils.get_column_letter(len(headers))}{len(self.partitions) + 1}"
+        table = Table(displayName="Partitions", ref=ref, autoFilter=AutoFilter(ref=ref),
+                      tableColumns=[TableColumn(id=index, name=header) for index, header in enumerate(headers, 1)])
+        table.tableStyleInfo = TableStyleInfo(name="TableStyleMedium2", showFirstColumn=False,
+                                              showLastColumn=False, showRowStripes=True, showColumnStripes=False)
+        with warnings.catch_warnings():
+            # Columns are given above, openpyxl warns about write-only tables regardless
+            warnings.simplefilter("ignore")
+            sheet.add_table(table)
+        saveWorkbook(xlsx, self.indexWorkbook)
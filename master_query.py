@@ -0,0 +1,199 @@
+import csv, json, sqlite3, pathlib, logging
+from datetime import datetime, date, time, timedelta
+from master_index import MasterIndex
+from master_partitions import partitionFiles
+
+
+def _day(value):
+    # Extract dates are written as MM/DD/YYYY text, a cell retyped in Excel comes back as a datetime
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    try:
+        return datetime.strptime(str(value), "%m/%d/%Y").date().isoformat()
+    except ValueError:
+        return ""
+
+
+def _isoDay(value):
+    '''
+    :arg value - date, or YYYY-MM-DD text as taken by the CLI
+    '''
+    if isinstance(value, datetime):
+        value = value.date()
+    return value.isoformat() if isinstance(value, date) else date.fromisoformat(str(value)).isoformat()
+
+
+def _jsonValue(value):
+    # Cells json can not hold, written the way they read in the master
+    if isinstance(value, timedelta):
+        seconds = int(value.total_seconds())
+        return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+    if isinstance(value, (datetime, date)):
+        return value.strftime("%m/%d/%Y")
+    if isinstance(value, time):
+        return value.strftime("%H:%M:%S")
+    return str(value)
+
+
+class QueryIndex(object):
+    '''
+    The rows of the master sorted by report type, extract date and agent/topic, kept in a SQLite file next to the
+    master so range queries read a few index pages instead of the whole workbook.
+
+    Rows are kept per source workbook, the master or one of its partitions, together with the size and modification
+    time of the workbook they were read from. Merges run with a QueryIndex add their rows as they write them, a
+    source written by anything else (Excel, a merge without the index) is read again once by refresh() before the
+    next query.
+    '''
+    def __init__(self, output_file, sheets):
+        '''
+        :arg output_file - Location of Master.xlsx, the index is <master>.query.db
+        :arg sheets - {reportType: daily sheet name} of the master
+        '''
+        self.outputFile = pathlib.Path(output_file)
+        self.indexFile = self.outputFile.with_suffix(".query.db")
+        self.sheets = dict(sheets)
+        self.connection = sqlite3.connect(str(self.indexFile))
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS rows (id INTEGER PRIMARY KEY, report_type TEXT, day TEXT, name TEXT,
+                                             source TEXT, line TEXT);
+            CREATE INDEX IF NOT EXISTS rows_by_day ON rows (report_type, day, name);
+            CREATE INDEX IF NOT EXISTS rows_by_source ON rows (source);
+            CREATE TABLE IF NOT EXISTS headers (report_type TEXT PRIMARY KEY, headers TEXT);
+            CREATE TABLE IF NOT EXISTS sources (source TEXT PRIMARY KEY, size INTEGER, mtime INTEGER);
+        ''')
+
+    def isCurrent(self, filePath):
+        '''
+        :returns True when the rows of the workbook are those on disk, a workbook not yet written has no rows
+        '''
+        row = self.connection.execute("SELECT size, mtime FROM sources WHERE source = ?",
+                                      (pathlib.Path(filePath).name,)).fetchone()
+        return (tuple(row) if row is not None else None) == MasterIndex.fingerprint(filePath)
+
+    def update(self, filePath, reportType, headers, lines, replace=False):
+        '''
+        :arg filePath - Workbook the lines were written to
+        :arg headers - Header row of the daily sheet
+        :arg lines - Rows as returned by getLineEntry, the second column is the extract date
+        :arg replace - Lines replace the rows of the same (extract date, agent/topic), as written with an upsert
+        '''
+        source = pathlib.Path(filePath).name
+        rows = [(reportType, _day(line[1]), str(line[0]), source, json.dumps(line, default=_jsonValue))
+                for line in lines]
+        if replace:
+            self.connection.executemany("DELETE FROM rows WHERE report_type = ? AND day = ? AND name = ? AND "
+                                        "source = ?", {row[:4] for row in rows})
+        self.connection.executemany("INSERT INTO rows (report_type, day, name, source, line) VALUES (?, ?, ?, ?, ?)",
+                                    rows)
+        self.connection.execute("INSERT OR REPLACE INTO headers VALUES (?, ?)", (reportType, json.dumps(headers)))
+
+    def commit(self, filePath):
+        '''
+        Store the fingerprint of the saved workbook together with the rows written to it.
+        '''
+        fingerprint = MasterIndex.fingerprint(filePath)
+        if fingerprint is not None:
+            self.connection.execute("INSERT OR REPLACE INTO sources VALUES (?, ?, ?)",
+                                    (pathlib.Path(filePath).name,) + fingerprint)
+        self.connection.commit()
+
+    def drop(self, source):
+        self.connection.execute("DELETE FROM rows WHERE source = ?", (source,))
+        self.connection.execute("DELETE FROM sources WHERE source = ?", (source,))
+
+    def rebuild(self, filePath):
+        '''
+        Replace the rows of the workbook with those of its daily sheets, read once in read-only mode.
+
+        :returns A count of the rows read
+        '''
+        import openpyxl
+
+        filePath = pathlib.Path(filePath)
+        self.drop(filePath.name)
+        xlsx = openpyxl.load_workbook(filePath, read_only=True)
+        count = 0
+        try:
+            for reportType, sheetName in self.sheets.items():
+                if sheetName not in xlsx.sheetnames: continue
+                rows = xlsx[sheetName].iter_rows(values_only=True)
+                headers = next(rows, None)
+                if headers is None: continue
+                lines = [list(row) for row in rows if len(row) > 1 and row[0] is not None]
+                self.update(filePath, reportType, [header for header in headers if header is not None], lines)
+                count += len(lines)
+        finally:
+            xlsx.close()
+        self.commit(filePath)
+        logging.info(f"{self.indexFile.name} - Read {count} rows from {filePath.name}")
+        return count
+
+    def refresh(self):
+        '''
+        Bring the index up to date with the master and the partitions listed in its manifest. Only workbooks that
+        changed since they were indexed are read, those no longer there are dropped.
+
+        :returns A count of the workbooks read again
+        '''
+        sources = [filePath for filePath in [self.outputFile] + partitionFiles(self.outputFile) if filePath.exists()]
+        names = {filePath.name for filePath in sources}
+        for (source,) in self.connection.execute("SELECT source FROM sources").fetchall():
+            if source not in names:
+                self.drop(source)
+        rebuilt = 0
+        for filePath in sources:
+            if self.isCurrent(filePath): continue
+            logging.info(f"{filePath.name} - Changed since it was indexed, reading it again")
+            self.rebuild(filePath)
+            rebuilt += 1
+        self.connection.commit()
+        return rebuilt
+
+    def headers(self, reportType):
+        row = self.connection.execute("SELECT headers FROM headers WHERE report_type = ?", (reportType,)).fetchone()
+        return json.loads(row[0]) if row is not None else []
+
+    def query(self, reportType, dateFrom=None, dateTo=None, names=None):
+        '''
+        :arg reportType - "Agent" or "Volume"
+        :arg dateFrom, dateTo - First and last extract date (date or YYYY-MM-DD), both included, None for no limit
+        :arg names - Agents or topics to return, None for all
+
+        :returns Iterator of the matching rows in extract date order, as written to the daily sheet. Invalid dates
+        raise ValueError here, before any row is read.
+        '''
+        conditions, parameters = ["report_type = ?"], [reportType]
+        if dateFrom is not None:
+            conditions.append("day >= ?")
+            parameters.append(_isoDay(dateFrom))
+        if dateTo is not None:
+            conditions.append("day <= ?")
+            parameters.append(_isoDay(dateTo))
+        if names:
+            names = list(names)
+            conditions.append(f"name IN ({', '.join('?' * len(names))})")
+            parameters.extend(names)
+        cursor = self.connection.execute(f"SELECT line FROM rows WHERE {' AND '.join(conditions)} ORDER BY day, id",
+                                         parameters)
+        return (json.loads(line) for (line,) in cursor)
+
+    def close(self):
+        self.connection.close()
+
+
+def writeCsv(fh, headers, rows):
+    '''
+    :arg fh - Text file opened with newline=""
+    :arg rows - Rows as returned by QueryIndex.query
+
+    :returns A count of the rows written
+    '''
+    writer = csv.writer(fh)
+    if headers:
+        writer.writerow(headers)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+    return count
@@ -0,0 +1,232 @@
+import sqlite3, json, pathlib, logging, warnings
+from datetime import datetime, date, timedelta
+from report_batch import parseDuration
+from master_commit import saveWorkbook
+
+_GRANULARITIES = ("Day", "Week", "Month")
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _seconds(value):
+    # Durations reach the rollups as exported text, whole seconds or timedelta depending on --durations
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    if isinstance(value, (int, float)):
+        return float(value)
+    seconds = parseDuration(value) if value is not None else None
+    return float(seconds) if seconds is not None else 0.0
+
+
+def _ratio(numerator, denominator):
+    return round(numerator / denominator, 2) if denominator else None
+
+
+def _duration(seconds):
+    return timedelta(seconds=round(seconds))
+
+
+# Per report type the components kept for every (day, agent/topic) fact, indexes are those of the lines written to
+# the daily sheets, and the columns of the rollup sheets computed from the summed (or max) components.
+_ROLLUPS = {
+    "Agent": {
+        "sheet": "Agent Rollups", "table": "AgentRollups", "name": "Agent",
+        "components": (("incoming", lambda line: _number(line[5]), "sum"),
+                       ("answered", lambda line: _number(line[6]), "sum"),
+                       ("abandoned", lambda line: _number(line[8]), "sum"),
+                       ("outgoing", lambda line: _number(line[9]), "sum"),
+                       ("talk", lambda line: _seconds(line[7]), "sum"),
+                       ("loggedIn", lambda line: _seconds(line[2]), "sum"),
+                       ("signedOn", lambda line: _seconds(line[3]), "sum"),
+                       ("break", lambda line: _seconds(line[4]), "sum")),
+        "columns": (("Incoming Calls", lambda t: int(t["incoming"])),
+                    ("Answered Incoming", lambda t: int(t["answered"])),
+                    ("Abandoned Incoming Calls", lambda t: int(t["abandoned"])),
+                    ("Outgoing Calls (External)", lambda t: int(t["outgoing"])),
+                    ("Answer Rate (%)", lambda t: _ratio(100 * t["answered"], t["incoming"])),
+                    ("Talk Time Incoming", lambda t: _duration(t["talk"])),
+                    ("Average Talk Time", lambda t: _duration(t["talk"] / t["answered"]) if t["answered"] else None),
+                    ("Logged In Time", lambda t: _duration(t["loggedIn"])),
+                    ("Signed On Time", lambda t: _duration(t["signedOn"])),
+                    ("Break Time", lambda t: _duration(t["break"])))},
+    "Volume": {
+        "sheet": "Volume Rollups", "table": "VolumeRollups", "name": "Topic",
+        "components": (("incoming", lambda line: _number(line[2]), "sum"),
+                       ("lost", lambda line: _number(line[3]), "sum"),
+                       ("noAnswer", lambda line: _number(line[4]), "sum"),
+                       ("rerouted", lambda line: _number(line[10]), "sum"),
+                       ("answered", lambda line: max(_number(line[2]) - _number(line[3]), 0), "sum"),
+                       ("talkWeighted", lambda line: _seconds(line[5]) * max(_number(line[2]) - _number(line[3]), 0),
+                        "sum"),
+                       ("speedWeighted", lambda line: _seconds(line[7]) * max(_number(line[2]) - _number(line[3]), 0),
+                        "sum"),
+                       ("rateWeighted", lambda line: _number(line[9]) * _number(line[2]), "sum"),
+                       ("longestTalk", lambda line: _seconds(line[6]), "max"),
+                       ("longestAnswer", lambda line: _seconds(line[8]), "max")),
+        "columns": (("Total Incoming Calls", lambda t: int(t["incoming"])),
+                    ("Lost Calls", lambda t: int(t["lost"])),
+                    ("No Answer (Timeout)", lambda t: int(t["noAnswer"])),
+                    ("Total Rerouted Calls", lambda t: int(t["rerouted"])),
+                    ("Answer Rate (%)", lambda t: _ratio(t["rateWeighted"], t["incoming"])),
+                    ("Average Talk Time (ATT)",
+                     lambda t: _duration(t["talkWeighted"] / t["answered"]) if t["answered"] else None),
+                    ("Longest Talk Time", lambda t: _duration(t["longestTalk"])),
+                    ("Average Speed To Answer (ASA)",
+                     lambda t: _duration(t["speedWeighted"] / t["answered"]) if t["answered"] else None),
+                    ("Longest Answer Time", lambda t: _duration(t["longestAnswer"])))},
+}
+
+
+def bucket(day, granularity):
+    '''
+    :arg day - date of a fact
+    :arg granularity - "Day", "Week" (ISO week, starting Monday) or "Month"
+
+    :returns period, first day, day after the last day
+    '''
+    if granularity == "Day":
+        return day.isoformat(), day, day + timedelta(days=1)
+    if granularity == "Week":
+        start = day - timedelta(days=day.weekday())
+        year, week, _ = day.isocalendar()
+        return f"{year}-W{week:02d}", start, start + timedelta(days=7)
+    start = day.replace(day=1)
+    return start.strftime("%Y-%m"), start, (start + timedelta(days=32)).replace(day=1)
+
+
+class RollupStore(object):
+    '''
+    Day, week and month totals per agent and per topic, maintained incrementally in a SQLite file next to the master
+    and written to one workbook per month, <master>_rollups_<YYYY-MM>.xlsx.
+
+    Every merged line is kept as a fact per (report type, day, agent/topic), a re-delivered day replaces its facts.
+    Only the buckets containing a day of the run are aggregated again, from the facts of those buckets alone, and
+    only the month workbooks holding those buckets are written again. A week belongs to the month it starts in.
+    '''
+    def __init__(self, output_file):
+        outputPath = pathlib.Path(output_file)
+        self.rollupFile = outputPath.with_suffix(".rollups.db")
+        self.outputPath = outputPath
+        self.connection = sqlite3.connect(str(self.rollupFile))
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS facts (report_type TEXT, day TEXT, name TEXT, components TEXT,
+                                              PRIMARY KEY (report_type, day, name)) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS rollups (report_type TEXT, granularity TEXT, period TEXT, start TEXT,
+                                                name TEXT, days INTEGER, components TEXT,
+                                                PRIMARY KEY (report_type, granularity, period, name)) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS pending (month TEXT PRIMARY KEY);
+        ''')
+
+    def rollupWorkbook(self, month):
+        '''
+        :arg month - "YYYY-MM"
+
+        :returns The workbook of the month, next to the master: Master.xlsx -> Master_rollups_2026-01.xlsx
+        '''
+        return self.outputPath.with_name(f"{self.outputPath.stem}_rollups_{month}{self.outputPath.suffix}")
+
+    def update(self, reportType, lines):
+        '''
+        :arg reportType - "Agent" or "Volume"
+        :arg lines - Lines merged into the master, the second column is the MM/DD/YYYY extract date
+
+        :returns A count of the buckets aggregated again
+        '''
+        spec = _ROLLUPS.get(reportType)
+        if spec is None or len(lines) == 0: return 0
+        facts = {}
+        for line in lines:
+            try:
+                day = datetime.strptime(str(line[1]), "%m/%d/%Y").date()
+            except ValueError:
+                continue
+            facts[(day.isoformat(), str(line[0]))] = [component(line) for _, component, _ in spec["components"]]
+        touched = {(granularity,) + bucket(date.fromisoformat(day), granularity)
+                   for day, _ in facts for granularity in _GRANULARITIES}
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO facts VALUES (?, ?, ?, ?)",
+                                        [(reportType, day, name, json.dumps(components))
+                                         for (day, name), components in facts.items()])
+            for granularity, period, start, end in touched:
+                self.aggregate(reportType, spec, granularity, period, start, end)
+            # Months to write, kept until save() wrote them so a failed or skipped save is caught up later
+            self.connection.executemany("INSERT OR IGNORE INTO pending VALUES (?)",
+                                        {(start.strftime("%Y-%m"),) for _, _, start, _ in touched})
+        logging.info(f"{self.rollupFile.name} - {len(touched)} {reportType} rollup buckets updated")
+        return len(touched)
+
+    def aggregate(self, reportType, spec, granularity, period, start, end):
+        totals = {}
+        for name, components in self.connection.execute(
+                "SELECT name, components FROM facts WHERE report_type = ? AND day >= ? AND day < ?",
+                (reportType, start.isoformat(), end.isoformat())):
+            components = json.loads(components)
+            days, current = totals.get(name, (0, None))
+            if current is not None:
+                components = [max(a, b) if how == "max" else a + b
+                              for (_, _, how), a, b in zip(spec["components"], current, components)]
+            totals[name] = (days + 1, components)
+        self.connection.execute("DELETE FROM rollups WHERE report_type = ? AND granularity = ? AND period = ?",
+                                (reportType, granularity, period))
+        self.connection.executemany("INSERT INTO rollups VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                    [(reportType, granularity, period, start.isoformat(), name, days,
+                                      json.dumps(components)) for name, (days, components) in totals.items()])
+
+    def save(self):
+        '''
+        Write the month workbooks holding buckets aggregated since the last save.
+
+        :returns A count of the workbooks written
+        '''
+        months = [month for (month,) in self.connection.execute("SELECT month FROM pending ORDER BY month")]
+        for month in months:
+            self.saveMonth(month)
+            with self.connection:
+                self.connection.execute("DELETE FROM pending WHERE month = ?", (month,))
+        return len(months)
+
+    def saveMonth(self, month):
+        '''
+        Write the buckets starting in the month to its workbook, one sheet and table per report type.
+        '''
+        import openpyxl
+        from openpyxl.utils import get_column_letter
+        from openpyxl.worksheet.filters import AutoFilter
+        from openpyxl.worksheet.table import Table, TableColumn, TableStyleInfo
+
+        monthStart = datetime.strptime(month, "%Y-%m").date()
+        monthEnd = (monthStart + timedelta(days=32)).replace(day=1)
+        xlsx = openpyxl.Workbook(write_only=True)
+        order = {granularity: index for index, granularity in enumerate(_GRANULARITIES)}
+        for reportType, spec in _ROLLUPS.items():
+            rows = self.connection.execute("SELECT granularity, period, start, name, days, components FROM rollups "
+                                           "WHERE report_type = ? AND start >= ? AND start < ?",
+                                           (reportType, monthStart.isoformat(), monthEnd.isoformat())).fetchall()
+            if len(rows) == 0: continue
+            headers = ["Granularity", "Period", "Start", spec["name"], "Days"] + [header for header, _ in spec["columns"]]
+            sheet = xlsx.create_sheet(spec["sheet"])
+            sheet.append(headers)
+            names = [name for name, _, _ in spec["components"]]
+            for granularity, period, start, name, days, components in sorted(rows, key=lambda row: (order[row[0]],
+                                                                                                    row[1], row[3])):
+                totals = dict(zip(names, json.loads(components)))
+                sheet.append([granularity, period, start, name, days] + [column(totals) for _, column in spec["columns"]])
+            ref = f"A1:{get_column_letter(len(headers))}{len(rows) + 1}"
+            table = Table(displayName=spec["table"], ref=ref, autoFilter=AutoFilter(ref=ref),
+                          tableColumns=[TableColumn(id=index, name=header) for index, header in enumerate(headers, 1)])
+            table.tableStyleInfo = TableStyleInfo(name="TableStyleMedium2", showFirstColumn=False,
+                                                  showLastColumn=False, showRowStripes=True, showColumnStripes=False)
+            with warnings.catch_warnings():
+                # Columns are given above, openpyxl warns about write-only tables regardless
+                warnings.simplefilter("ignore")
+                sheet.add_table(table)
+        if len(xlsx.worksheets) == 0: return
+        saveWorkbook(xlsx, self.rollupWorkbook(month))
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,175 @@
+import itertools
+from array import array
+from datetime import timedelta
+
+_TYPECODES = {"int": "q", "float": "d", "name": "l", "text": "l", "duration": "l"}
+_INTERNED = ("name", "text", "duration")
+_CHUNK_ROWS = 65536
+DURATION_FORMATS = ("text", "seconds", "excel")
+
+
+def parseDuration(value):
+    '''
+    :arg value - Duration as exported, "HH:MM:SS" with hours allowed past 24, or "MM:SS"
+
+    :returns The duration in whole seconds, or None when the value is not a duration
+    '''
+    parts = str(value).strip().split(":")
+    if len(parts) not in (2, 3): return None
+    try:
+        numbers = [int(part) for part in parts]
+    except ValueError:
+        return None
+    if any(number < 0 for number in numbers) or any(number > 59 for number in numbers[1:]): return None
+    seconds = 0
+    for number in numbers:
+        seconds = seconds * 60 + number
+    return seconds
+
+
+def parsePercent(value):
+    '''
+    :returns "91%", "91" or 91 as 91.0, raises ValueError when the value is no number
+    '''
+    if isinstance(value, str):
+        value = value.replace("%", "")
+    return float(value)
+
+
+class ReportBatch(object):
+    '''
+    Columnar content of a Report.
+
+    Every field declared in the entry class columns is kept in a typed array: "int"/"float" fields are converted once
+    per column when rows are added, "name" (agent/topic), "text" and "duration" fields are stored as codes into a
+    single interned value dictionary, so a duration is parsed once per distinct value rather than once per row. Rows
+    failing a conversion are kept out of lines() and their exception is reported instead, as getLineEntry raising
+    would have done.
+
+    The batch still behaves as a list of AgentReport/VolumeReport objects for len(), indexing and iteration.
+    '''
+    def __init__(self, inEntryClass):
+        self.entryClass = inEntryClass
+        self.columns = inEntryClass.columns
+        self.values = []
+        self.valueCodes = {}
+        self.data = [array(_TYPECODES[kind]) for _, kind in self.columns]
+        self.errors = {}
+
+    def __len__(self):
+        return len(self.data[0])
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        return self.entryClass(*[self.values[column[index]] if kind in _INTERNED else column[index]
+                                 for (_, kind), column in zip(self.columns, self.data)])
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state["valueCodes"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.valueCodes = {value: code for code, value in enumerate(self.values)}
+
+    def _code(self, value):
+        code = self.valueCodes.get(value)
+        if code is None:
+            code = self.valueCodes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def extendValues(self, rows):
+        '''
+        :arg rows - Iterable of field value tuples in the order of the entry class constructor
+
+        Rows are converted in chunks of whole columns, so only one chunk of raw values is held at a time.
+        '''
+        rows = iter(rows)
+        while True:
+            chunk = list(itertools.islice(rows, _CHUNK_ROWS))
+            if len(chunk) == 0: return
+            self._extendColumns(chunk)
+
+    def _extendColumns(self, rows):
+        start = len(self)
+        for (_, kind), target, column in zip(self.columns, self.data, zip(*rows)):
+            if kind in _INTERNED:
+                target.extend(array(target.typecode, map(self._code, column)))
+                continue
+            # Float fields are percentages, exported as "91%"
+            convert = int if kind == "int" else parsePercent
+            try:
+                target.extend(array(target.typecode, map(convert, column)))
+            except Exception:
+                for offset, value in enumerate(column):
+                    try:
+                        target.append(convert(value))
+                    except Exception as e:
+                        target.append(0)
+                        self.errors.setdefault(start + offset, e)
+
+    def append(self, entry):
+        self.extend([entry])
+
+    def extend(self, entries):
+        self.extendValues(tuple(getattr(entry, name) for name, _ in self.columns) for entry in entries)
+
+    def keys(self):
+        '''
+        :returns The agent/topic of every row
+        '''
+        return [self.values[code] for code in self.data[0]]
+
+    def select(self, indexes):
+        '''
+        :arg indexes - Row indexes to keep, in order
+
+        :returns A new batch holding only the selected rows, sharing the value dictionary
+        '''
+        batch = ReportBatch(self.entryClass)
+        batch.values = self.values
+        batch.valueCodes = self.valueCodes
+        batch.data = [array(column.typecode, map(column.__getitem__, indexes)) for column in self.data]
+        batch.errors = {newIndex: self.errors[index] for newIndex, index in enumerate(indexes) if index in self.errors}
+        return batch
+
+    def durationValues(self, durations):
+        '''
+        :arg durations - "seconds" or "excel"
+
+        :returns The value dictionary with every duration converted to whole seconds or, for "excel", a timedelta
+        that openpyxl writes as an Excel time. Values that are not a duration are kept as they are.
+        '''
+        converted = []
+        for value in self.values:
+            seconds = parseDuration(value)
+            if seconds is None:
+                converted.append(value)
+            else:
+                converted.append(seconds if durations == "seconds" else timedelta(seconds=seconds))
+        return converted
+
+    def lines(self, extractDate, durations="text"):
+        '''
+        :arg extractDate - Date written to the second column of every line
+        :arg durations - "text" keeps durations as exported, "seconds" or "excel" types them, see durationValues
+
+        :returns lines, errors - The rows as getLineEntry of the entry class returns them, built column by column,
+        and the conversion errors of the rows left out
+        '''
+        durationValues = self.values if durations == "text" else self.durationValues(durations)
+        columns = [map((durationValues if kind == "duration" else self.values).__getitem__, column)
+                   if kind in _INTERNED else column
+                   for (_, kind), column in zip(self.columns, self.data)]
+        columns.insert(1, itertools.repeat(str(extractDate)))
+        lines = [list(row) for row in zip(*columns)]
+        if self.errors:
+            lines = [line for index, line in enumerate(lines) if index not in self.errors]
+        return lines, list(self.errors.values())
@@ -0,0 +1,164 @@
+import re, zipfile, posixpath, logging
+import xml.etree.ElementTree as ET
+from io import BytesIO
+from report_schema import SCHEMAS, metadataAttribute
+
+_NS = {"m": "http://schemas.openxmlformats.org/spreadsheetml/2006/main"}
+_MAIN = "{" + _NS["m"] + "}"
+_REL_ID = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id"
+_COLUMN = re.compile(r"[A-Z]+")
+
+
+class ExportInfo(object):
+    '''
+    What inspectExport found out about an export without loading it.
+
+    sheets - Sheet names of the workbook
+    reportType - "Agent" or "Volume" when the header row matches a schema, otherwise None
+    metadata - {Report attribute: value} of the metadata rows above the table, e.g. {"period": "01/05/2026 ..."}
+    error - Why the file can not be an export, None when it may be one
+    '''
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.sheets = []
+        self.reportType = None
+        self.metadata = {}
+        self.error = None
+
+
+def _resolvePart(source, target):
+    if target.startswith("/"):
+        return target[1:]
+    return posixpath.normpath(posixpath.join(posixpath.dirname(source), target))
+
+
+def _columnIndex(reference):
+    index = 0
+    for letter in _COLUMN.match(reference).group():
+        index = index * 26 + ord(letter) - 64
+    return index - 1
+
+
+def _firstRows(zf, sheetPart, limit):
+    '''
+    :returns The first rows of the sheet as lists of cell values, shared strings still as ("s", index)
+    '''
+    rows = []
+    with zf.open(sheetPart) as stream:
+        for _, element in ET.iterparse(stream):
+            if element.tag != _MAIN + "row": continue
+            cells = []
+            for cell in element.iterfind("m:c", _NS):
+                if cell.get("r"):
+                    cells.extend([None] * (_columnIndex(cell.get("r")) - len(cells)))
+                cellType = cell.get("t")
+                value = cell.find("m:v", _NS)
+                if cellType == "s" and value is not None:
+                    cells.append(("s", int(value.text)))
+                elif cellType == "inlineStr":
+                    cells.append("".join(text.text or "" for text in cell.iter(_MAIN + "t")))
+                else:
+                    cells.append(value.text if value is not None else None)
+            rows.append(cells)
+            element.clear()
+            if len(rows) >= limit: break
+    return rows
+
+
+def _sharedStrings(zf, indexes):
+    '''
+    :arg indexes - Shared string indexes referenced by the rows read
+
+    :returns {index: string} of the referenced strings. The part is read in order up to the largest index, which is
+    early when the strings of the first rows come first, as Excel and openpyxl write them, and the whole part when not.
+    '''
+    strings = {}
+    if not indexes or "xl/sharedStrings.xml" not in zf.namelist(): return strings
+    last = max(indexes)
+    with zf.open("xl/sharedStrings.xml") as stream:
+        index = 0
+        for _, element in ET.iterparse(stream):
+            if element.tag != _MAIN + "si": continue
+            if index in indexes:
+                strings[index] = "".join(text.text or "" for text in element.iter(_MAIN + "t"))
+            element.clear()
+            if index >= last: break
+            index += 1
+    return strings
+
+
+def inspectExport(filePath, content=None, sheetName="Table"):
+    '''
+    :arg filePath - pathlib.Path of the export, only its name is used when the content is given
+    :arg content - Bytes of the export
+
+    Read the zip directory, the sheet list of xl/workbook.xml and the rows above the table of the sheetName sheet,
+    decompressing only as much of the sheet as those rows take. This costs a fraction of a full load and tells
+    junk and misrouted files apart before they are parsed.
+
+    :returns ExportInfo
+    '''
+    info = ExportInfo(filePath.name)
+    limit = max(schema.metadataRows for schema in SCHEMAS.values()) + 1
+    try:
+        with zipfile.ZipFile(BytesIO(content) if content is not None else filePath) as zf:
+            names = set(zf.namelist())
+            if "xl/workbook.xml" not in names:
+                info.error = "Not an Excel workbook"
+                return info
+            workbook = ET.fromstring(zf.read("xl/workbook.xml"))
+            sheets = {sheet.get("name"): sheet.get(_REL_ID) for sheet in workbook.iterfind("m:sheets/m:sheet", _NS)}
+            info.sheets = list(sheets)
+            if sheetName not in sheets:
+                info.error = f"No '{sheetName}' sheet"
+                return info
+            targets = {rel.get("Id"): rel.get("Target")
+                       for rel in ET.fromstring(zf.read("xl/_rels/workbook.xml.rels"))}
+            sheetPart = _resolvePart("xl/workbook.xml", targets[sheets[sheetName]])
+            rows = _firstRows(zf, sheetPart, limit)
+            strings = _sharedStrings(zf, {cell[1] for row in rows for cell in row if isinstance(cell, tuple)})
+    except (zipfile.BadZipFile, KeyError, ET.ParseError, IndexError, ValueError) as e:
+        info.error = f"Unreadable workbook - {e}"
+        return info
+    except OSError as e:
+        info.error = str(e)
+        return info
+
+    for row in rows:
+        row = [strings.get(cell[1]) if isinstance(cell, tuple) else cell for cell in row]
+        if len(row) == 0: continue
+        headerType = next((reportType for reportType, schema in SCHEMAS.items() if schema.isHeader(row)), None)
+        if headerType is not None:
+            info.reportType = headerType
+            break
+        attribute = metadataAttribute(row)
+        if attribute is not None:
+            info.metadata[attribute] = str(row[1])
+    return info
+
+
+def prefilter(filePath, reportType, content=None):
+    '''
+    :arg reportType - Report type expected from the input directory or mail
+
+    Only an export whose header row matches another schema is rerouted. A headerless export is read by position,
+    as the report type of its directory, whatever its "Type" cell says.
+
+    :returns The report type to load the file as, or None to skip it without a full load
+    '''
+    info = inspectExport(filePath, content)
+    if info.error is not None:
+        logging.error(f"{filePath.name} - {info.error}, skipped")
+        return None
+    if info.reportType is None:
+        typeCell = info.metadata.get("reportType", "")
+        named = [name for name in SCHEMAS if name.lower() in typeCell.lower()]
+        if named and reportType not in named:
+            logging.warning(f"{filePath.name} - No header row, Type '{typeCell}' found with the {reportType} reports, "
+                            f"merged as {reportType}")
+        return reportType
+    if info.reportType != reportType:
+        logging.warning(f"{filePath.name} - {info.reportType} export found with the {reportType} reports, "
+                        f"merged as {info.reportType}")
+        return info.reportType
+    return reportType
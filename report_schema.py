@@ -0,0 +1,161 @@
+import logging, itertools
+from operator import itemgetter
+
+# Metadata rows above the table, the first cell names the Report attribute receiving the second cell. Keywords are
+# tried in this order and the first one contained in the cell wins, a "Daily cycle" row sets daily, not cycle.
+_METADATA_ATTRIBUTES = (("type", "reportType"), ("created", "dateCreated"), ("period", "period"),
+                        ("weekly", "weekly"), ("daily", "daily"), ("resolution", "resolution"), ("cycle", "cycle"))
+
+
+def metadataAttribute(row):
+    '''
+    :arg row - Row above the table of an export, e.g. ("Period", "01/05/2026 00:00:00 - ...")
+
+    :returns The Report attribute named by the first cell, or None for any other row
+    '''
+    if len(row) < 2: return None
+    cell = str(row[0]).lower()
+    return next((attribute for keyword, attribute in _METADATA_ATTRIBUTES if keyword in cell), None)
+
+
+def headerNames(cell):
+    '''
+    :returns The label and the export code of a header cell: "Lost Calls [totNLost / Tel]" -> "lost calls", "totnlost"
+    '''
+    text = str(cell).strip().lower()
+    label, _, code = text.partition("[")
+    return label.strip(), code.split("/")[0].strip()
+
+
+class Field(object):
+    '''
+    :arg name - Attribute of the AgentReport/VolumeReport
+    :arg kind - "name", "text", "duration", "int" or "float", see ReportBatch
+    :arg headers - Header labels or export codes of the column, matched case-insensitively
+    :arg default - Value of the field when the export has no such column
+    '''
+    def __init__(self, name, kind, headers, default=None):
+        self.name = name
+        self.kind = kind
+        self.headers = {header.lower() for header in headers}
+        self.default = default
+
+    def matches(self, cell):
+        label, code = headerNames(cell)
+        return label in self.headers or (code != "" and code in self.headers)
+
+
+class ReportSchema(object):
+    '''
+    Columns of an export "Table" sheet: the fields of the report in constructor order, matched by header name.
+
+    compile() maps the header row of a file to column indexes once, every data row is then read with a single
+    itemgetter and handed to the ReportBatch as text, which converts the numbers a whole column at a time.
+    Reordered exports, extra columns and columns missing from older exports (filled with their default) need no
+    code change. An export without a recognisable header row is read by position in field order.
+    '''
+    def __init__(self, fields, footer=None, metadataRows=9):
+        self.fields = tuple(fields)
+        self.footer = footer
+        self.metadataRows = metadataRows
+        self.columns = tuple((field.name, field.kind) for field in self.fields)
+
+    def isHeader(self, row):
+        # Half of the fields have to be found, a metadata row mentioning "Agent" is no header
+        matched = sum(any(field.matches(cell) for cell in row if cell is not None) for field in self.fields)
+        return matched * 2 >= len(self.fields)
+
+    def compile(self, header=None, fileName=None):
+        '''
+        :arg header - Header row of the export, None to read the columns by position
+
+        :returns Function turning a row tuple into the field values in constructor order
+        '''
+        if header is None:
+            indexes = {field.name: index for index, field in enumerate(self.fields)}
+            width = len(self.fields)
+        else:
+            indexes = {}
+            for field in self.fields:
+                index = next((index for index, cell in enumerate(header) if cell is not None and field.matches(cell)),
+                             None)
+                if index is not None:
+                    indexes[field.name] = index
+            width = len(header)
+        # Missing fields read their default from the end of the row, short rows are padded with column defaults
+        missing = [field for field in self.fields if field.name not in indexes]
+        if missing:
+            logging.warning(f"{fileName} - No column for {', '.join(field.name for field in missing)}, using defaults")
+        missingDefaults = tuple(field.default for field in missing)
+        columnDefaults = [None] * width
+        for field in self.fields:
+            if field.name in indexes:
+                columnDefaults[indexes[field.name]] = field.default
+        columnDefaults = tuple(columnDefaults)
+        positions = [indexes[field.name] if field.name in indexes else missing.index(field) - len(missing)
+                     for field in self.fields]
+        getter = itemgetter(*positions)
+        if missing:
+            return lambda row: tuple(map(str, getter(tuple(row) + columnDefaults[len(row):] + missingDefaults)))
+
+        def extract(row):
+            try:
+                return tuple(map(str, getter(row)))
+            except IndexError:
+                # A ragged row of a read-only sheet
+                return tuple(map(str, getter(tuple(row) + columnDefaults[len(row):])))
+        return extract
+
+    def iterValues(self, report, rows):
+        '''
+        :arg report - Report object receiving the metadata of the file
+        :arg rows - Iterable of row value tuples from the "Table" sheet
+
+        :returns Iterator of the field values of every data row, in the order of the AgentReport/VolumeReport
+        constructor. The metadata and header rows are read first, the data rows are consumed one at a time.
+
+        Data starts on the row after the header, wherever the header is found within the first metadataRows rows.
+        Exports place it on the last of those rows, a shorter preamble no longer turns its first data rows into
+        metadata. Without a header the first metadataRows rows are metadata and the columns are read by position.
+        '''
+        rows = iter(rows)
+        extract = None
+        for row in itertools.islice(rows, self.metadataRows):
+            if len(row) == 0: continue
+            if self.isHeader(row):
+                extract = self.compile(row, report.fileName)
+                break
+            attribute = metadataAttribute(row)
+            if attribute is not None:
+                setattr(report, attribute, str(row[1]))
+        if extract is None:
+            extract = self.compile()
+        if self.footer is not None:
+            rows = itertools.takewhile(lambda row: self.footer not in str(row[0]).lower(), rows)
+        return map(extract, rows)
+
+
+SCHEMAS = {
+    "Agent": ReportSchema((
+        Field("agent", "name", ("Agent",)),
+        Field("loggedInTime", "duration", ("Logged In Time", "totTLogin")),
+        Field("signedOnTime", "duration", ("Signed On Time", "totTSignon")),
+        Field("breakTime", "duration", ("Break Time", "totTPause")),
+        Field("incomingCalls", "int", ("Incoming Calls", "totNNew<-")),
+        Field("answeredIncoming", "int", ("Answered Incoming", "totNConv<-")),
+        Field("talkTimeIncoming", "duration", ("Talk Time Incoming", "totTConv<-")),
+        Field("abandonedIncomingCalls", "int", ("Abandoned Incoming Calls", "totNAban<-")),
+        Field("outgoingCallsExternal", "int", ("Outgoing Calls (External)", "totNNew->Ext"))),
+        footer="log."),
+    "Volume": ReportSchema((
+        Field("topic", "name", ("Topic",)),
+        Field("totalIncomingCalls", "int", ("Total Incoming Calls", "totNNew")),
+        Field("lostCalls", "int", ("Lost Calls", "totNLost")),
+        Field("noAnswer", "int", ("No Answer (Timeout)", "totNExp")),
+        Field("averageTalkTime", "duration", ("Average Talk Time (ATT)", "avgTConvAg")),
+        Field("longestTalkTime", "duration", ("Longest Talk Time", "maxTConvAg")),
+        Field("averageSpeedToAnswer", "duration", ("Average Speed To Answer (ASA)", "avgTConvWait")),
+        Field("longestAnswerTime", "duration", ("Longest Answer Time", "maxTConvWait")),
+        Field("answerRate", "float", ("Answer Rate (%)", "%AcceptLevel"), default=0.0),
+        Field("totalReroutedCalls", "int", ("Total Rerouted Calls", "totNRr"), default=0))),
+}
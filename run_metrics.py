@@ -0,0 +1,165 @@
+import sys, time, json, pathlib
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Stage metrics of a file_combine run. Instrumented code calls stage() around whole files or merge phases, never
+# per row; while metrics are disabled that returns a shared no-op context so the cost is a single function call.
+
+_metrics = None
+
+
+def peakMemory():
+    '''
+    :returns The peak resident memory of this process in bytes, or None when it cannot be determined
+    '''
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                        ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                        ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        handle = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(handle, ctypes.byref(counters), counters.cb):
+            return counters.PeakWorkingSetSize
+    return None
+
+
+class _NullStage(object):
+    def add(self, **counts):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage(object):
+    def __init__(self, metrics, name, item):
+        self.metrics = metrics
+        self.name = name
+        self.item = item
+        self.counts = {}
+
+    def add(self, **counts):
+        for key, value in counts.items():
+            self.counts[key] = self.counts.get(key, 0) + value
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.metrics.record(self.name, time.perf_counter() - self.start, self.item, self.counts)
+        return False
+
+
+class RunMetrics(object):
+    '''
+    Durations, call counts, rows, bytes and peak memory per stage of a run, written as JSON or Prometheus text.
+    '''
+    def __init__(self):
+        self.started = time.time()
+        self.stages = {}
+
+    def stage(self, name, item=None):
+        return _Stage(self, name, item)
+
+    def record(self, name, seconds, item=None, counts=None):
+        stage = self.stages.setdefault(name, {"calls": 0, "seconds": 0.0, "max_seconds": 0.0})
+        stage["calls"] += 1
+        stage["seconds"] += seconds
+        stage["max_seconds"] = max(stage["max_seconds"], seconds)
+        for key, value in (counts or {}).items():
+            stage[key] = stage.get(key, 0) + value
+        peak = peakMemory()
+        if peak is not None:
+            stage["peak_memory_bytes"] = max(stage.get("peak_memory_bytes", 0), peak)
+        if item is not None:
+            stage.setdefault("items", []).append(dict(counts or {}, item=str(item), seconds=seconds))
+
+    def merge(self, stages):
+        '''
+        :arg stages - Stages recorded by another process, e.g. a parsing worker
+        '''
+        for name, other in stages.items():
+            stage = self.stages.setdefault(name, {"calls": 0, "seconds": 0.0, "max_seconds": 0.0})
+            for key, value in other.items():
+                if key == "items":
+                    stage.setdefault("items", []).extend(value)
+                elif key in ("max_seconds", "peak_memory_bytes"):
+                    stage[key] = max(stage.get(key, 0), value)
+                else:
+                    stage[key] = stage.get(key, 0) + value
+
+    def toDict(self):
+        return {"started": self.started, "seconds": time.time() - self.started, "peak_memory_bytes": peakMemory(),
+                "stages": self.stages}
+
+    def toPrometheus(self):
+        lines = []
+        metrics = {"seconds": "Time spent in the stage", "calls": "Times the stage ran",
+                   "max_seconds": "Longest single run of the stage", "rows": "Rows handled by the stage",
+                   "files": "Files handled by the stage", "bytes": "Bytes read or written by the stage",
+                   "peak_memory_bytes": "Peak process memory at the end of the stage"}
+        for key, description in metrics.items():
+            values = [(name, stage[key]) for name, stage in sorted(self.stages.items()) if key in stage]
+            if len(values) == 0: continue
+            lines.append(f"# HELP file_combine_stage_{key} {description}")
+            lines.append(f"# TYPE file_combine_stage_{key} gauge")
+            lines.extend(f'file_combine_stage_{key}{{stage="{name}"}} {value}' for name, value in values)
+        summary = self.toDict()
+        for key, description in (("seconds", "Duration of the run"), ("peak_memory_bytes", "Peak process memory"),
+                                 ("started", "Start of the run as a unix timestamp")):
+            if summary[key] is None: continue
+            lines.append(f"# HELP file_combine_run_{key} {description}")
+            lines.append(f"# TYPE file_combine_run_{key} gauge")
+            lines.append(f"file_combine_run_{key} {summary[key]}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, metrics_file):
+        '''
+        :arg metrics_file - Prometheus text format for a .prom file, JSON otherwise
+        '''
+        metricsPath = pathlib.Path(metrics_file)
+        if metricsPath.suffix == ".prom":
+            metricsPath.write_text(self.toPrometheus())
+        else:
+            metricsPath.write_text(json.dumps(self.toDict(), indent=2))
+
+
+def enable():
+    global _metrics
+    _metrics = RunMetrics()
+    return _metrics
+
+
+def disable():
+    global _metrics
+    _metrics = None
+
+
+def current():
+    return _metrics
+
+
+def stage(name, item=None):
+    if _metrics is None:
+        return _NULL_STAGE
+    return _metrics.stage(name, item)
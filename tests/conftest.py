@@ -0,0 +1,7 @@
+import sys, pathlib
+
+# The modules are scripts at the repository root, the synthetic exports live with the benchmarks
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+for path in (ROOT, ROOT / "benchmarks"):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
@@ -0,0 +1,58 @@
+import openpyxl
+
+import file_combine
+import synthetic_exports
+from columnar_store import ColumnarStore, rebuildMaster
+
+
+def directories(base, **settings):
+    for name in ("agent", "volume", "agent_archive", "volume_archive"):
+        (base / name).mkdir(exist_ok=True)
+    return [dict({"type": reportType, "input": base / reportType.lower(), "output": base / "Master.xlsx",
+                  "archive": base / f"{reportType.lower()}_archive"}, **settings)
+            for reportType in ("Agent", "Volume")]
+
+
+def sheetRows(filePath, sheetName):
+    xlsx = openpyxl.load_workbook(filePath, read_only=True)
+    try:
+        return [list(row) for row in xlsx[sheetName].iter_rows(min_row=2, values_only=True) if row[0] is not None]
+    finally:
+        xlsx.close()
+
+
+def test_store_untouched_when_master_cannot_be_loaded(tmp_path):
+    files = directories(tmp_path)
+    (tmp_path / "Master.xlsx").write_text("corrupt")
+    synthetic_exports.generateExports(tmp_path / "agent", "Agent", 1, 5)
+    store = ColumnarStore(tmp_path / "store")
+    for _ in range(2):
+        file_combine.performCombinedMerge(files, store=store)
+    assert store.reportTypes() == []
+    assert len(list((tmp_path / "agent").iterdir())) == 1
+
+    (tmp_path / "Master.xlsx").unlink()
+    file_combine.performCombinedMerge(files, store=store)
+    assert len(list(store.readLines("Agent"))) == 5
+
+
+def test_rebuild_after_upsert_matches_master(tmp_path):
+    from master_index import MasterIndex
+
+    files = directories(tmp_path, upsert=True)
+    store = ColumnarStore(tmp_path / "store")
+    index = MasterIndex(tmp_path / "Master.index.db")
+    try:
+        for seed in (0, 1):
+            # The same days delivered again with corrected values
+            synthetic_exports.generateExports(tmp_path / "agent", "Agent", 2, 5, seed=seed)
+            synthetic_exports.generateExports(tmp_path / "volume", "Volume", 1, 3, seed=seed)
+            file_combine.performCombinedMerge(files, store=store, index=index)
+    finally:
+        index.close()
+
+    rebuildMaster(tmp_path / "store", tmp_path / "Rebuilt.xlsx")
+    for sheetName in ("Daily Agent Reports", "Daily Volume Reports"):
+        master = sheetRows(tmp_path / "Master.xlsx", sheetName)
+        assert len(master) == (10 if sheetName == "Daily Agent Reports" else 3)
+        assert sorted(map(str, sheetRows(tmp_path / "Rebuilt.xlsx", sheetName))) == sorted(map(str, master))
@@ -0,0 +1,216 @@
+import json, zipfile
+from datetime import datetime, timedelta
+from io import BytesIO
+
+import pytest
+
+from email_reader import FolderIndex, HighWaterMark, Message, messageWindow
+from master_commit import writeBytes
+
+
+def test_message_window_resumes_after_high_water_mark():
+    highWaterMark = datetime(2026, 1, 5, 17, 30)
+    startDate, endDate, after = messageWindow(highWaterMark=highWaterMark)
+    assert startDate == after == highWaterMark
+    assert datetime.now() - endDate < timedelta(minutes=1)
+
+
+def test_message_window_without_dates_or_mark_is_daily_lookup():
+    assert messageWindow() is None
+
+
+def test_message_window_backfill():
+    assert messageWindow("2026-01-01", "2026-01-02", datetime(2026, 1, 5)) == \
+        (datetime(2026, 1, 1), datetime(2026, 1, 3), None)
+    with pytest.raises(ValueError):
+        messageWindow(dateTo="2026-01-02")
+
+
+
+def test_high_water_mark_survives_an_interrupted_write(tmp_path, monkeypatch):
+    import master_commit
+
+    stateFile = tmp_path / "fetch_state.json"
+    HighWaterMark(stateFile).set("Reports", datetime(2026, 1, 5, 6))
+    assert [path.name for path in tmp_path.iterdir()] == ["fetch_state.json"]
+
+    def crash(temp, filePath):
+        raise OSError("Simulated crash")
+
+    monkeypatch.setattr(master_commit, "replaceFile", crash)
+    HighWaterMark(stateFile).set("Reports", datetime(2026, 1, 6, 6))
+    assert HighWaterMark(stateFile).get("Reports") == datetime(2026, 1, 5, 6)
+    assert [path.name for path in tmp_path.iterdir()] == ["fetch_state.json"]
+
+class FakeCollection(list):
+    # Outlook collections are indexed from 1
+    @property
+    def Count(self):
+        return len(self)
+
+    def __getitem__(self, index):
+        return list.__getitem__(self, index - 1)
+
+
+class FakeItems(list):
+    def __init__(self, messages, filters):
+        list.__init__(self, messages)
+        self.filters = filters
+
+    def Restrict(self, restriction):
+        self.filters.append(restriction)
+        if restriction.startswith("@SQL="):
+            subjects = [part.split("'%")[1].split("%'")[0].lower() for part in restriction.split(" OR ")]
+            return FakeItems([message for message in self
+                              if any(subject in message.Subject.lower() for subject in subjects)], self.filters)
+        startDate, endDate = [datetime.strptime(value, "%m/%d/%Y %I:%M %p") for value in restriction.split("'")[1::2]]
+        return FakeItems([message for message in self if startDate <= message.SentOn < endDate], self.filters)
+
+    def Sort(self, key, descending):
+        list.sort(self, key=lambda message: message.SentOn, reverse=descending)
+
+
+class FakeMessage(object):
+    def __init__(self, subject, sent, attachments=()):
+        self.Subject = subject
+        self.SentOn = sent
+        self.Attachments = FakeCollection(attachments)
+
+
+class FakePropertyAccessor(object):
+    def __init__(self, data):
+        self.data = data
+
+    def GetProperty(self, tag):
+        if self.data is None:
+            raise OSError("Property not available")
+        return self.data
+
+
+class FakeAttachment(object):
+    def __init__(self, fileName, data, inMemory=True):
+        self.FileName = fileName
+        self.data = data
+        self.PropertyAccessor = FakePropertyAccessor(data if inMemory else None)
+
+    def SaveAsFile(self, filePath):
+        with open(filePath, "wb") as fh:
+            fh.write(self.data)
+
+
+class FakeFolder(object):
+    def __init__(self, name, entryID, children=(), messages=(), filters=None):
+        self.Name = name
+        self.EntryID = entryID
+        self.StoreID = "store"
+        self.Folders = FakeCollection(children)
+        self.Items = FakeItems(messages, filters if filters is not None else [])
+
+
+class FakeNamespace(object):
+    def __init__(self, rootFolders):
+        self.Folders = rootFolders
+        self.opened = []
+        self.moved = set()
+
+    def GetFolderFromID(self, entryID, storeID):
+        self.opened.append(entryID)
+        for folder in self.walk(self.Folders):
+            if folder.EntryID == entryID and entryID not in self.moved:
+                return folder
+        raise OSError("The operation failed, an object could not be found")
+
+    def walk(self, folders):
+        for folder in folders:
+            yield folder
+            yield from self.walk(folder.Folders)
+
+
+def zipBytes(members):
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zf:
+        for name, content in members.items():
+            zf.writestr(name, content)
+    return buffer.getvalue()
+
+
+def mailbox(messages=()):
+    reports = FakeFolder("Call Center Reports", "reports", messages=messages)
+    root = FakeCollection([FakeFolder("me@example.com", "mailbox", [FakeFolder("Inbox", "inbox", [reports]),
+                                                                     FakeFolder("Sent Items", "sent")])])
+    return FakeNamespace(root), reports
+
+
+def test_restrict_filters(tmp_path):
+    namespace, _ = mailbox()
+    message = Message(namespace.Folders, "Call Center Reports", tmp_path, tmp_path, namespace)
+    message.volumeSubject = "Traffic Data Daily's"
+    assert message.restrictFilters(datetime(2026, 1, 5, 17, 30), datetime(2026, 1, 6)) == (
+        "[SentOn] >= '01/05/2026 05:30 PM' AND [SentOn] < '01/06/2026 12:00 AM'",
+        "@SQL=\"urn:schemas:httpmail:subject\" LIKE '%AgentDaily%' OR "
+        "\"urn:schemas:httpmail:subject\" LIKE '%Traffic Data Daily''s%'")
+
+
+def test_messages_between_restricts_and_orders(tmp_path):
+    day = datetime(2026, 1, 5)
+    namespace, reports = mailbox([FakeMessage("Traffic Data Daily", day + timedelta(hours=9)),
+                                  FakeMessage("AgentDaily", day + timedelta(hours=6)),
+                                  FakeMessage("Lunch", day + timedelta(hours=7)),
+                                  FakeMessage("AgentDaily", day - timedelta(hours=1)),
+                                  FakeMessage("AgentDaily", day + timedelta(days=1))])
+    message = Message(namespace.Folders, "Call Center Reports", tmp_path, tmp_path, namespace)
+    selected = message.messagesBetween(day, day + timedelta(days=1), after=day + timedelta(hours=5))
+    assert [(item.Subject, item.SentOn.hour) for item in selected] == [("AgentDaily", 6), ("Traffic Data Daily", 9)]
+    assert len(reports.Items.filters) == 2
+
+
+def test_folder_index_opens_cached_entry_id(tmp_path):
+    cacheFile = tmp_path / "folders.json"
+    namespace, reports = mailbox()
+    assert Message(namespace.Folders, "Call Center Reports", tmp_path, tmp_path, namespace, cacheFile).messages \
+        is reports.Items
+    assert namespace.opened == []
+    assert json.loads(cacheFile.read_text())["folders"]["me@example.com/Inbox/Call Center Reports"] == \
+        ["reports", "store"]
+
+    index = FolderIndex(namespace, cacheFile)
+    assert index.open(namespace.Folders, "Inbox/Call Center Reports") is reports
+    assert namespace.opened == ["reports"] and index.liveFolders == {}
+
+    # A moved folder is found again by walking the tree once
+    namespace.moved.add("reports")
+    assert FolderIndex(namespace, cacheFile).open(namespace.Folders, "Call Center Reports") is reports
+    assert namespace.opened == ["reports", "reports"]
+
+
+def test_extract_attachment_writes_members_in_place(tmp_path, monkeypatch):
+    import email_reader
+
+    written = []
+    monkeypatch.setattr(email_reader, "writeBytes",
+                        lambda filePath, data: (written.append(filePath.name), writeBytes(filePath, data)))
+    namespace, _ = mailbox()
+    message = Message(namespace.Folders, "Call Center Reports", tmp_path, tmp_path, namespace)
+    data = zipBytes({"AgentDaily.xlsx": b"agent", "nested/TrafficDaily.xlsx": b"volume", "readme.txt": b"text"})
+    assert message.extractAttachment("reports.zip", data, tmp_path) == (2, 11)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["AgentDaily.xlsx", "TrafficDaily.xlsx"]
+    assert (tmp_path / "TrafficDaily.xlsx").read_bytes() == b"volume"
+    assert written == ["AgentDaily.xlsx", "TrafficDaily.xlsx"]
+
+
+def test_move_message_extracts_report_attachments(tmp_path):
+    (tmp_path / "agent").mkdir()
+    (tmp_path / "volume").mkdir()
+    sent = datetime(2026, 1, 5, 6)
+    namespace, _ = mailbox([
+        FakeMessage("AgentDaily", sent, [FakeAttachment("agent.zip", zipBytes({"AgentDaily.xlsx": b"agent"}))]),
+        FakeMessage("Traffic Data Daily", sent, [FakeAttachment("volume.zip", zipBytes({"Traffic.xlsx": b"volume"}),
+                                                                inMemory=False),
+                                                 FakeAttachment("logo.png", b"png")])])
+    message = Message(namespace.Folders, "Call Center Reports", tmp_path / "agent", tmp_path / "volume", namespace)
+    message.window = (datetime(2026, 1, 5), datetime(2026, 1, 6), None)
+    totals = message.moveMessage(workers=2)
+    assert (totals["attachments"], totals["files"], totals["failed"]) == (2, 2, 0)
+    assert [path.name for path in (tmp_path / "agent").iterdir()] == ["AgentDaily.xlsx"]
+    assert [path.name for path in (tmp_path / "volume").iterdir()] == ["Traffic.xlsx"]
+    assert message.lastSentOn == sent
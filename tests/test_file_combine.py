@@ -0,0 +1,98 @@
+import random, logging
+from datetime import date
+
+import openpyxl
+
+import file_combine
+import synthetic_exports
+
+
+def writeHeaderless(path, reportType, day, rows, seed=0):
+    # An older export without a header row, read by position
+    rng = random.Random(seed)
+    xlsx = openpyxl.Workbook(write_only=True)
+    sheet = xlsx.create_sheet("Table")
+    for row in synthetic_exports.metadataRows(reportType, day)[:-1] + [[None]]:
+        sheet.append(row)
+    for index in range(rows):
+        sheet.append(synthetic_exports.agentRow(rng, index) if reportType == "Agent"
+                     else synthetic_exports.volumeRow(rng, index))
+    if reportType == "Agent":
+        sheet.append(["Log. = Logged in, Sign. = Signed on"])
+    xlsx.save(path)
+
+
+def exports(base):
+    for reportType in ("Agent", "Volume"):
+        directory = base / reportType.lower()
+        directory.mkdir()
+        synthetic_exports.generateExports(directory, reportType, 3, 25)
+        writeHeaderless(directory / f"{reportType}_headerless.xlsx", reportType, date(2026, 2, 1), 7)
+    return base
+
+
+def metadata(report):
+    return (report.fileName, report.reportType, report.dateCreated, report.period, report.weekly, report.daily,
+            report.resolution, report.cycle)
+
+
+def test_streaming_parse_matches_full_load(tmp_path):
+    base = exports(tmp_path)
+    for reportType in ("Agent", "Volume"):
+        fileCount, full = file_combine.getAllFileData(base / reportType.lower(), reportType, streaming=False)
+        _, streamed = file_combine.getAllFileData(base / reportType.lower(), reportType, streaming=True)
+        assert fileCount == len(full) == len(streamed) == 4
+        assert [metadata(report) for report in streamed] == [metadata(report) for report in full]
+        assert all(report.period is not None for report in full)
+        for durations in ("text", "seconds", "excel"):
+            lines = file_combine.getReportLines(full, durations)
+            assert file_combine.getReportLines(streamed, durations) == lines
+        fullLines, failed = file_combine.getReportLines(full)[reportType]
+        assert len(fullLines) == 3 * 25 + 7 and failed == 0
+        # The Agent legend footer is no row
+        assert not any(str(line[0]).startswith("Log.") for line in fullLines)
+
+
+def test_report_type_without_rows_gets_its_headers(tmp_path):
+    for name in ("agent", "volume", "agent_archive", "volume_archive"):
+        (tmp_path / name).mkdir()
+    synthetic_exports.generateExports(tmp_path / "agent", "Agent", 1, 3)
+    synthetic_exports.generateExports(tmp_path / "volume", "Volume", 1, 0)
+    file_combine.performCombinedMerge([{"type": reportType, "input": tmp_path / reportType.lower(),
+                                        "output": tmp_path / "Master.xlsx",
+                                        "archive": tmp_path / f"{reportType.lower()}_archive"}
+                                       for reportType in ("Agent", "Volume")])
+    xlsx = openpyxl.load_workbook(tmp_path / "Master.xlsx")
+    try:
+        for sheetName, entryClass in (("Daily Agent Reports", file_combine.AgentReport),
+                                      ("Daily Volume Reports", file_combine.VolumeReport)):
+            assert [cell.value for cell in xlsx[sheetName][1]] == entryClass.getHeaders()
+    finally:
+        xlsx.close()
+
+
+def test_worker_pool_keeps_order_and_forwards_logs(tmp_path, caplog):
+    directory = tmp_path / "volume"
+    directory.mkdir()
+    synthetic_exports.generateExports(directory, "Volume", 4, 20)
+    # An older export without the Answer Rate and Rerouted columns, its warning is logged by the worker
+    xlsx = openpyxl.Workbook(write_only=True)
+    sheet = xlsx.create_sheet("Table")
+    for row in synthetic_exports.metadataRows("Volume", date(2026, 1, 10)):
+        sheet.append(row[:8])
+    for index in range(5):
+        sheet.append(synthetic_exports.volumeRow(random.Random(index), index)[:8])
+    xlsx.save(directory / "Traffic Data Daily_20260110.xlsx")
+
+    with caplog.at_level(logging.INFO):
+        serialCount, serial = file_combine.getAllFileData(directory, "Volume", workers=1)
+        serialLog = [record.getMessage() for record in caplog.records]
+        caplog.clear()
+        pooledCount, pooled = file_combine.getAllFileData(directory, "Volume", workers=2)
+        pooledLog = [record.getMessage() for record in caplog.records]
+
+    assert serialCount == pooledCount == 5
+    assert [report.fileName for report in pooled] == [report.fileName for report in serial]
+    assert file_combine.getReportLines(pooled) == file_combine.getReportLines(serial)
+    assert any("No column for answerRate, totalReroutedCalls" in message for message in pooledLog)
+    assert pooledLog == serialLog
@@ -0,0 +1,29 @@
+import file_combine
+from ingest_ledger import IngestionLedger
+
+
+def agentReport(rows, contentHash):
+    report = file_combine.Report("agent.xlsx", "Agent")
+    report.period = "01/05/2026"
+    report.contentHash = contentHash
+    report.content.extendValues(rows)
+    return report
+
+
+def agentRow(agent, incomingCalls="4"):
+    return (agent, "08:00:00", "07:30:00", "00:30:00", incomingCalls, "4", "01:00:00", "0", "2")
+
+
+def test_rows_failing_conversion_are_not_recorded(tmp_path):
+    ledger = IngestionLedger(tmp_path / "Master.ledger.db")
+    report = agentReport([agentRow("Ann"), agentRow("Bob", incomingCalls="n/a")], "first")
+    assert list(report.content.errors) == [1]
+    ledger.record([report])
+    assert ledger.hasRow("Agent", "01/05/2026", "Ann")
+    assert not ledger.hasRow("Agent", "01/05/2026", "Bob")
+    assert ledger.connection.execute("SELECT rows FROM files WHERE hash = 'first'").fetchone() == (1,)
+
+    corrected = agentReport([agentRow("Ann"), agentRow("Bob")], "corrected")
+    assert ledger.filterReports([corrected]) == 1
+    assert corrected.content.keys() == ["Bob"]
+    ledger.close()
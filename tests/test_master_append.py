@@ -0,0 +1,132 @@
+import io, json, zipfile
+from datetime import date
+
+import openpyxl
+import pytest
+
+import file_combine
+import master_append
+import synthetic_exports
+
+
+def directories(base, **settings):
+    for name in ("agent", "volume", "agent_archive", "volume_archive"):
+        (base / name).mkdir(exist_ok=True)
+    return [dict({"type": reportType, "input": base / reportType.lower(), "output": base / "Master.xlsx",
+                  "archive": base / f"{reportType.lower()}_archive"}, **settings)
+            for reportType in ("Agent", "Volume")]
+
+
+def sheetRows(filePath, sheetName):
+    xlsx = openpyxl.load_workbook(filePath, read_only=True)
+    try:
+        return [list(row) for row in xlsx[sheetName].iter_rows(values_only=True)]
+    finally:
+        xlsx.close()
+
+
+def tableRef(filePath, sheetName):
+    xlsx = openpyxl.load_workbook(filePath)
+    try:
+        return [table.ref for table in xlsx[sheetName].tables.values()]
+    finally:
+        xlsx.close()
+
+
+def layoutState(filePath):
+    with zipfile.ZipFile(filePath) as zf:
+        return json.loads(zf.comment)[master_append._STATE_KEY]
+
+
+def mergeDays(base, days, **settings):
+    files = directories(base, **settings)
+    for offset in days:
+        day = date(2026, 1, 1 + offset)
+        synthetic_exports.generateExports(base / "agent", "Agent", 1, 4, firstDay=day)
+        synthetic_exports.generateExports(base / "volume", "Volume", 1, 3, firstDay=day)
+        file_combine.performCombinedMerge(files)
+    return base / "Master.xlsx"
+
+
+def test_appends_over_several_runs_match_a_full_rewrite(tmp_path):
+    (tmp_path / "append").mkdir()
+    (tmp_path / "full").mkdir()
+    appended = mergeDays(tmp_path / "append", range(4), appendOnly=True)
+    rewritten = mergeDays(tmp_path / "full", range(4))
+
+    assert set(layoutState(appended)) == {"Agent", "Volume"}
+    with zipfile.ZipFile(appended) as zf:
+        assert zf.testzip() is None
+    for sheetName, rows in (("Daily Agent Reports", 17), ("Daily Volume Reports", 13)):
+        assert len(sheetRows(appended, sheetName)) == rows
+        assert sheetRows(appended, sheetName) == sheetRows(rewritten, sheetName)
+        assert tableRef(appended, sheetName) == tableRef(rewritten, sheetName)
+
+
+def test_append_grows_the_layout_when_the_gap_runs_out(tmp_path):
+    master = mergeDays(tmp_path, range(1), appendOnly=True)
+    master_append.prepareMaster(master, gaps={"Agent": 200})
+    lines = [[f"Agent {index}", "01/09/2026", "08:00:00", "07:30:00", "00:30:00", 4, 4, "01:00:00", 0, 2]
+             for index in range(10)]
+
+    assert master_append.appendRows(master, "Agent", lines)
+    state = layoutState(master)["Agent"]
+    assert state["row"] == 15
+    assert state["gap"] > master_append._DEFAULT_GAP - 10 * 1024
+    with zipfile.ZipFile(master) as zf:
+        assert zf.testzip() is None
+    assert sheetRows(master, "Daily Agent Reports")[-10:] == lines
+    assert tableRef(master, "Daily Agent Reports") == ["A1:J15"]
+
+
+class CrashingFile(io.FileIO):
+    '''
+    Master opened by appendRows, failing on the write after the new rows, before the CRCs and central directory
+    '''
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.writes = 0
+
+    def write(self, data):
+        self.writes += 1
+        if self.writes > 1:
+            raise OSError("Simulated crash")
+        return super().write(data)
+
+
+def test_rollback_after_a_crash_between_data_and_directory_writes(tmp_path, monkeypatch):
+    master = mergeDays(tmp_path, range(1), appendOnly=True)
+    before = master.read_bytes()
+    mtime = master.stat().st_mtime_ns
+    lines = [["Late Agent", "01/02/2026", "08:00:00", "07:30:00", "00:30:00", 4, 4, "01:00:00", 0, 2]]
+
+    monkeypatch.setattr(master_append, "open", lambda path, mode: CrashingFile(path, mode), raising=False)
+    with pytest.raises(OSError):
+        master_append.appendRows(master, "Agent", lines)
+    monkeypatch.undo()
+    assert master.read_bytes() != before
+    assert master.with_name(master.name + master_append.JOURNAL_SUFFIX).exists()
+
+    assert master_append.rollbackJournal(master)
+    assert master.read_bytes() == before
+    assert master.stat().st_mtime_ns == mtime
+    assert master_append.appendRows(master, "Agent", lines)
+    with zipfile.ZipFile(master) as zf:
+        assert zf.testzip() is None
+    assert sheetRows(master, "Daily Agent Reports")[-1] == lines[0]
+
+
+def test_non_finite_numbers_are_left_blank():
+    xml = master_append._rowXml(2, ["Sales", 0.5, float("nan"), float("inf"), 3])
+    assert xml == (b'<row r="2"><c r="A2" t="inlineStr"><is><t>Sales</t></is></c><c r="B2" t="n"><v>0.5</v></c>'
+                   b'<c r="E2" t="n"><v>3</v></c></row>')
+
+
+def test_control_characters_are_stripped_from_appended_text(tmp_path):
+    assert master_append._rowXml(3, ["A\x00g\x0bent\x1f\t<1>"]) == \
+        b'<row r="3"><c r="A3" t="inlineStr"><is><t>Agent\t&lt;1&gt;</t></is></c></row>'
+
+    master = mergeDays(tmp_path, range(1), appendOnly=True)
+    lines = [["Agent\x07 Bell", "01/02/2026", "08:00:00", "07:30:00", "00:30:00", 4, 4, "01:00:00", 0, 2]]
+    assert master_append.appendRows(master, "Agent", lines)
+    assert sheetRows(master, "Daily Agent Reports")[-1][0] == "Agent Bell"
@@ -0,0 +1,58 @@
+import json
+from datetime import date
+
+import openpyxl
+
+import file_combine
+import synthetic_exports
+from master_partitions import partitionFiles, partitionKey, partitionPath
+
+
+def directories(base, **settings):
+    for name in ("agent", "volume", "agent_archive", "volume_archive"):
+        (base / name).mkdir(exist_ok=True)
+    return [dict({"type": reportType, "input": base / reportType.lower(), "output": base / "Master.xlsx",
+                  "archive": base / f"{reportType.lower()}_archive"}, **settings)
+            for reportType in ("Agent", "Volume")]
+
+
+def tables(filePath):
+    xlsx = openpyxl.load_workbook(filePath)
+    try:
+        return {sheet.title: dict(sheet.tables.items()) for sheet in xlsx.worksheets if sheet.tables}
+    finally:
+        xlsx.close()
+
+
+def test_partition_key_and_path(tmp_path):
+    assert partitionKey("01/31/2026", "month") == "2026-01"
+    assert partitionKey("01/31/2026", "year") == "2026"
+    assert partitionPath(tmp_path / "Master.xlsx", "2026-02") == tmp_path / "Master_2026-02.xlsx"
+
+
+def test_rows_of_two_months_go_to_two_partitions(tmp_path):
+    files = directories(tmp_path, partition="month", upsert=True)
+    for seed in (0, 1):
+        # The second run re-delivers the same days, upsert replaces their rows
+        for reportType, rows in (("Agent", 4), ("Volume", 3)):
+            synthetic_exports.generateExports(tmp_path / reportType.lower(), reportType, 2, rows,
+                                              firstDay=date(2026, 1, 31), seed=seed)
+        file_combine.performCombinedMerge(files)
+
+    january, february = tmp_path / "Master_2026-01.xlsx", tmp_path / "Master_2026-02.xlsx"
+    assert partitionFiles(tmp_path / "Master.xlsx") == [january, february]
+    assert not (tmp_path / "Master.xlsx").exists()
+    for filePath in (january, february):
+        assert tables(filePath) == {"Daily Agent Reports": {"AgentResults": "A1:J5"},
+                                    "Daily Volume Reports": {"VolumeResults": "A1:K4"}}
+
+    manifest = json.loads((tmp_path / "Master.partitions.json").read_text())
+    assert manifest["partition"] == "month"
+    assert {key: (entry["file"], entry["first"], entry["last"], entry["rows"])
+            for key, entry in manifest["partitions"].items()} == {
+        "2026-01": ("Master_2026-01.xlsx", "2026-01-31", "2026-01-31", {"Agent": 4, "Volume": 3}),
+        "2026-02": ("Master_2026-02.xlsx", "2026-02-01", "2026-02-01", {"Agent": 4, "Volume": 3})}
+
+    headers, rows = file_combine.queryReports(tmp_path / "Master.xlsx", "Volume", "2026-01-31", "2026-02-01")
+    assert headers == file_combine.VolumeReport.getHeaders()
+    assert [row[1] for row in rows] == ["01/31/2026"] * 3 + ["02/01/2026"] * 3
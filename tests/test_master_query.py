@@ -0,0 +1,54 @@
+import csv, io
+from datetime import date
+
+import openpyxl
+
+import file_combine
+import synthetic_exports
+from master_query import writeCsv
+
+
+def directories(base):
+    for name in ("agent", "volume", "agent_archive", "volume_archive"):
+        (base / name).mkdir(exist_ok=True)
+    return [{"type": reportType, "input": base / reportType.lower(), "output": base / "Master.xlsx",
+             "archive": base / f"{reportType.lower()}_archive"} for reportType in ("Agent", "Volume")]
+
+
+def test_query_reflects_a_rewritten_master(tmp_path):
+    master = tmp_path / "Master.xlsx"
+    files = directories(tmp_path)
+    synthetic_exports.generateExports(tmp_path / "agent", "Agent", 3, 4)
+    file_combine.performCombinedMerge(files)
+
+    queryIndex = file_combine.openQueryIndex(master)
+    try:
+        assert queryIndex.refresh() == 1
+        assert queryIndex.refresh() == 0
+        rows = list(queryIndex.query("Agent", "2026-01-02", date(2026, 1, 3), names=["Agent 0001", "Agent 0003"]))
+        assert [(row[0], row[1]) for row in rows] == [("Agent 0001", "01/02/2026"), ("Agent 0003", "01/02/2026"),
+                                                      ("Agent 0001", "01/03/2026"), ("Agent 0003", "01/03/2026")]
+        assert list(queryIndex.query("Volume")) == []
+    finally:
+        queryIndex.close()
+
+    # Another writer (Excel) edits the master, the index notices from the fingerprint
+    xlsx = openpyxl.load_workbook(master)
+    sheet = xlsx["Daily Agent Reports"]
+    sheet.cell(row=2, column=1, value="Renamed Agent")
+    sheet.append(["Added Agent", "01/04/2026", "08:00:00", "07:00:00", "00:30:00", 5, 5, "01:00:00", 0, 1])
+    xlsx.save(master)
+    xlsx.close()
+
+    headers, rows = file_combine.queryReports(master, "Agent", dateFrom="2026-01-01")
+    assert headers == file_combine.AgentReport.getHeaders()
+    assert len(rows) == 13
+    assert sum(row[0] == "Renamed Agent" for row in rows) == 1
+    assert rows[-1][:2] == ["Added Agent", "01/04/2026"]
+    assert file_combine.queryReports(master, "Agent", "2026-01-04", "2026-01-04")[1] == [rows[-1]]
+
+    buffer = io.StringIO(newline="")
+    assert writeCsv(buffer, headers, rows) == 13
+    written = list(csv.reader(io.StringIO(buffer.getvalue())))
+    assert written[0] == headers and len(written) == 14
+    assert written[-1][:3] == ["Added Agent", "01/04/2026", "08:00:00"]
@@ -0,0 +1,59 @@
+from datetime import date, timedelta
+
+import openpyxl
+
+from master_rollups import RollupStore
+
+
+def agentLine(name, day, incoming):
+    return [name, day.strftime("%m/%d/%Y"), "08:00:00", "07:00:00", "00:30:00", incoming, incoming - 1, "01:00:00", 1, 2]
+
+
+def rollupRows(filePath):
+    xlsx = openpyxl.load_workbook(filePath, read_only=True)
+    try:
+        return [row for row in xlsx["Agent Rollups"].iter_rows(min_row=2, values_only=True)]
+    finally:
+        xlsx.close()
+
+
+def test_save_writes_only_touched_months(tmp_path):
+    rollups = RollupStore(tmp_path / "Master.xlsx")
+    try:
+        # Thursday January 1 belongs to the week starting Monday December 29
+        rollups.update("Agent", [agentLine("Agent 1", date(2026, 1, 1) + timedelta(days=day), 10) for day in range(31)])
+        assert rollups.save() == 2
+        assert (tmp_path / "Master_rollups_2025-12.xlsx").exists()
+        january = tmp_path / "Master_rollups_2026-01.xlsx"
+        written = january.stat().st_mtime_ns
+
+        # Monday February 2 starts a week of its own, January is not written again
+        rollups.update("Agent", [agentLine("Agent 1", date(2026, 2, 2), 5)])
+        assert rollups.save() == 1
+        assert january.stat().st_mtime_ns == written
+        assert rollups.save() == 0
+
+        # Sunday February 1 belongs to the week starting Monday January 26
+        rollups.update("Agent", [agentLine("Agent 1", date(2026, 2, 1), 7)])
+        assert rollups.save() == 2
+    finally:
+        rollups.close()
+
+    january = {(row[0], row[1]): row for row in rollupRows(tmp_path / "Master_rollups_2026-01.xlsx")}
+    assert january[("Month", "2026-01")][5] == 310
+    assert january[("Week", "2026-W05")][4:6] == (7, 67)
+    february = {(row[0], row[1]): row for row in rollupRows(tmp_path / "Master_rollups_2026-02.xlsx")}
+    assert february[("Month", "2026-02")][4:6] == (2, 12)
+    assert ("Week", "2026-W05") not in february
+
+
+def test_pending_months_survive_a_missed_save(tmp_path):
+    rollups = RollupStore(tmp_path / "Master.xlsx")
+    rollups.update("Agent", [agentLine("Agent 1", date(2026, 3, 3), 4)])
+    rollups.close()
+    rollups = RollupStore(tmp_path / "Master.xlsx")
+    try:
+        assert rollups.save() == 1
+    finally:
+        rollups.close()
+    assert (tmp_path / "Master_rollups_2026-03.xlsx").exists()
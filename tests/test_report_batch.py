@@ -0,0 +1,52 @@
+from datetime import timedelta
+
+import pytest
+
+import file_combine
+from report_batch import DURATION_FORMATS, ReportBatch, parseDuration, parsePercent
+
+
+@pytest.mark.parametrize("value, seconds", [
+    ("1:02:03", 3723), ("26:00:00", 93600), (" 00:00:09 ", 9),
+    ("02:03", 123), ("0:00", 0),
+    ("", None), ("None", None), (None, None),
+    ("1:60:00", None), ("1:00:60", None), ("-1:00:00", None), ("1:2:3:4", None), ("12", None), ("a:bc", None),
+])
+def test_parse_duration(value, seconds):
+    assert parseDuration(value) == seconds
+
+
+def test_parse_percent():
+    assert parsePercent("91%") == parsePercent("91") == parsePercent(91) == 91.0
+    with pytest.raises(ValueError):
+        parsePercent("n/a")
+
+
+def volumeRow(topic, calls="10", duration="00:02:00", answerRate="90%"):
+    return (topic, calls, "1", "0", duration, "00:09:00", "00:00:20", "03:00", answerRate, "2")
+
+
+def test_durations_are_typed_per_format():
+    batch = ReportBatch(file_combine.VolumeReport)
+    batch.extendValues([volumeRow("Sales"), volumeRow("Support", duration="")])
+    lines = {durations: batch.lines("01/05/2026", durations)[0] for durations in DURATION_FORMATS}
+    assert lines["text"][0][5] == "00:02:00" and lines["text"][0][8] == "03:00"
+    assert lines["seconds"][0][5] == 120 and lines["seconds"][0][8] == 180
+    assert lines["excel"][0][5] == timedelta(minutes=2) and lines["excel"][0][8] == timedelta(minutes=3)
+    # A blank duration is no duration and is written as it was exported
+    assert [line[1][5] for line in lines.values()] == ["", "", ""]
+
+
+def test_failing_row_is_left_out_and_reported():
+    batch = ReportBatch(file_combine.VolumeReport)
+    batch.extendValues([volumeRow("Sales"), volumeRow("Support", calls="ten"), volumeRow("Billing", answerRate="-"),
+                        volumeRow("Returns")])
+    assert len(batch) == 4
+    assert sorted(batch.errors) == [1, 2]
+    assert all(isinstance(error, ValueError) for error in batch.errors.values())
+    lines, errors = batch.lines("01/05/2026")
+    assert [line[0] for line in lines] == ["Sales", "Returns"]
+    assert lines[0][:3] == ["Sales", "01/05/2026", 10] and lines[0][9] == 90.0
+    assert errors == list(batch.errors.values())
+    # Selecting rows keeps the errors with their rows
+    assert sorted(batch.select([2, 3]).errors) == [0]
@@ -0,0 +1,54 @@
+import logging, zipfile
+from datetime import date
+
+import openpyxl
+
+import report_prefilter
+import synthetic_exports
+from report_prefilter import inspectExport, prefilter
+
+
+def writeExport(path, reportType, header=True, typeCell=None):
+    xlsx = openpyxl.Workbook(write_only=True)
+    sheet = xlsx.create_sheet("Table")
+    rows = synthetic_exports.metadataRows(reportType, date(2026, 1, 5))
+    if typeCell is not None:
+        rows[0] = ["Type", typeCell]
+    for row in rows if header else rows[:-1]:
+        sheet.append(row)
+    sheet.append(["Row 1", 1, 2, 3])
+    xlsx.save(path)
+    return path
+
+
+def test_export_of_the_other_type_is_rerouted_by_its_header(tmp_path):
+    path = writeExport(tmp_path / "AgentDaily.xlsx", "Agent")
+    assert inspectExport(path).reportType == "Agent"
+    assert prefilter(path, "Volume") == "Agent"
+
+
+def test_headerless_export_keeps_the_directory_type(tmp_path, caplog):
+    path = writeExport(tmp_path / "AgentDaily.xlsx", "Agent", header=False)
+    info = inspectExport(path)
+    assert info.reportType is None and info.metadata["reportType"] == "Agent Report"
+    with caplog.at_level(logging.WARNING):
+        assert prefilter(path, "Volume") == "Volume"
+    assert "No header row, Type 'Agent Report'" in caplog.text
+
+    # A Type cell merely containing a type name reroutes nothing either
+    caplog.clear()
+    path = writeExport(tmp_path / "Traffic.xlsx", "Volume", header=False, typeCell="Volume by Agent")
+    with caplog.at_level(logging.WARNING):
+        assert prefilter(path, "Volume") == "Volume"
+    assert caplog.text == ""
+
+
+def test_shared_strings_in_any_order(tmp_path):
+    strings = "".join(f"<si><t>{text}</t></si>" for text in ("unused", "Period", "unused", "Type"))
+    path = tmp_path / "strings.zip"
+    with zipfile.ZipFile(path, "w") as zf:
+        zf.writestr("xl/sharedStrings.xml", '<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                                            f'{strings}</sst>')
+    with zipfile.ZipFile(path) as zf:
+        assert report_prefilter._sharedStrings(zf, {3, 1}) == {1: "Period", 3: "Type"}
+        assert report_prefilter._sharedStrings(zf, set()) == {}
@@ -0,0 +1,45 @@
+from datetime import date
+
+import file_combine
+import synthetic_exports
+from report_schema import SCHEMAS, metadataAttribute
+
+
+def volumeRows(count):
+    return [[f"Topic {index}", 10, 1, 0, "00:02:00", "00:09:00", "00:00:20", "00:03:00", "90%", 2]
+            for index in range(count)]
+
+
+def readValues(rows):
+    report = file_combine.Report("Traffic.xlsx", "Volume")
+    return report, list(SCHEMAS["Volume"].iterValues(report, rows))
+
+
+def test_metadata_keywords_keep_their_precedence():
+    assert metadataAttribute(("Daily cycle", "Yes")) == "daily"
+    assert metadataAttribute(("Cycle type", "1")) == "reportType"
+    assert metadataAttribute(("Report period", "01/05/2026")) == "period"
+    assert metadataAttribute(("Agent", "Incoming Calls")) is None
+    assert metadataAttribute(("Daily",)) is None
+
+
+def test_data_starts_after_the_header_of_a_full_preamble():
+    # The fixed 9-row preamble the exports are written with: data from the tenth row, as before the schemas
+    report, values = readValues(synthetic_exports.metadataRows("Volume", date(2026, 1, 5)) + volumeRows(3))
+    assert [value[0] for value in values] == ["Topic 0", "Topic 1", "Topic 2"]
+    assert (report.reportType, report.daily, report.cycle) == ("Volume Report", "Yes", "1")
+    assert report.period.startswith("01/05/2026")
+
+
+def test_data_starts_after_a_header_found_early():
+    preamble = synthetic_exports.metadataRows("Volume", date(2026, 1, 5))
+    report, values = readValues([preamble[0], preamble[2], preamble[-1]] + volumeRows(8))
+    assert [value[0] for value in values] == [f"Topic {index}" for index in range(8)]
+    assert report.period.startswith("01/05/2026") and report.daily is None
+
+
+def test_headerless_export_skips_the_preamble_and_reads_by_position():
+    preamble = synthetic_exports.metadataRows("Volume", date(2026, 1, 5))[:-1] + [["No header"]]
+    _, values = readValues(preamble + volumeRows(2))
+    assert values == [("Topic 0", "10", "1", "0", "00:02:00", "00:09:00", "00:00:20", "00:03:00", "90%", "2"),
+                      ("Topic 1", "10", "1", "0", "00:02:00", "00:09:00", "00:00:20", "00:03:00", "90%", "2")]
@@ -0,0 +1,59 @@
+from datetime import date
+
+import file_combine
+import synthetic_exports
+from watch_folders import FolderWatcher
+
+
+def directories(base):
+    for name in ("agent", "volume", "agent_archive", "volume_archive"):
+        (base / name).mkdir()
+    return [{"type": reportType, "input": base / reportType.lower(), "output": base / "Master.xlsx",
+             "archive": base / f"{reportType.lower()}_archive"} for reportType in ("Agent", "Volume")]
+
+
+def test_file_arriving_during_merge_is_merged_by_next_batch(tmp_path, monkeypatch):
+    files = directories(tmp_path)
+    synthetic_exports.generateExports(tmp_path / "agent", "Agent", 1, 5)
+    watcher = FolderWatcher([tmp_path / "agent", tmp_path / "volume"], quietSeconds=1, maxDelaySeconds=10)
+    load = file_combine.getAllFileData
+
+    def loadThenArrive(*args, **kwargs):
+        # A new export lands once the merge has listed and loaded the directory
+        reports = load(*args, **kwargs)
+        if not (tmp_path / "agent" / "AgentDaily_20260102.xlsx").exists():
+            synthetic_exports.generateExports(tmp_path / "agent", "Agent", 1, 5, firstDay=date(2026, 1, 2))
+        return reports
+
+    monkeypatch.setattr(file_combine, "getAllFileData", loadThenArrive)
+    watcher.mergeBatch(lambda: file_combine.performCombinedMerge(files))
+    monkeypatch.setattr(file_combine, "getAllFileData", load)
+
+    # Not archived unmerged, and due once it settled
+    assert [path.name for path in (tmp_path / "agent").iterdir()] == ["AgentDaily_20260102.xlsx"]
+    assert [watcher.poll(now) for now in (100.0, 100.5, 101.6)] == [False, False, True]
+
+    watcher.mergeBatch(lambda: file_combine.performCombinedMerge(files))
+    assert list((tmp_path / "agent").iterdir()) == []
+    assert sorted(path.name for path in (tmp_path / "agent_archive").iterdir()) == ["AgentDaily_20260101.xlsx",
+                                                                                     "AgentDaily_20260102.xlsx"]
+    assert [watcher.poll(now) for now in (200.0, 202.0)] == [False, False]
+
+
+def test_file_left_by_merge_does_not_retrigger(tmp_path):
+    (tmp_path / "broken.xlsx").write_text("not a workbook")
+    watcher = FolderWatcher([tmp_path], quietSeconds=1)
+    watcher.mergeBatch(lambda: None)
+    assert [watcher.poll(now) for now in (10.0, 12.0, 14.0)] == [False, False, False]
+
+
+def test_constant_arrivals_merge_after_max_delay(tmp_path):
+    watcher = FolderWatcher([tmp_path], quietSeconds=30, maxDelaySeconds=300)
+    due = []
+    for index, now in enumerate(range(0, 400, 50)):
+        # A new export on every poll, the burst never settles
+        (tmp_path / f"export_{index}.xlsx").write_bytes(b"x" * index)
+        due.append(watcher.poll(float(now)))
+    assert due == [False] * 6 + [True, True]
+    watcher.mergeBatch(lambda: None)
+    assert watcher.poll(400.0) is False
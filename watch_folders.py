@@ -0,0 +1,112 @@
+import os, gc, time, signal, threading, logging
+
+
+class FolderWatcher(object):
+    '''
+    Polls the input directories for report workbooks and calls merge once a burst of arrivals has settled.
+
+    The input directories are file shares (see getReportFromOutlook.bat) where inotify and ReadDirectoryChangesW are
+    unreliable, so each poll is a single os.scandir per directory compared with the previous one. A change starts a
+    batch, the batch is merged after quietSeconds without any change, or once it is maxDelaySeconds old even while
+    files keep arriving, so a long burst does not leave the master stale. Files the merge leaves behind (failed
+    loads) only start a new batch when they change again, files arriving while a merge runs are merged by the next
+    batch.
+
+    Only the listings of the last poll and of the last merge are kept between batches, so memory stays flat however
+    long the watcher runs.
+    '''
+    def __init__(self, directories, intervalSeconds=5.0, quietSeconds=30.0, maxDelaySeconds=300.0):
+        self.directories = list(directories)
+        self.intervalSeconds = intervalSeconds
+        self.quietSeconds = quietSeconds
+        self.maxDelaySeconds = maxDelaySeconds
+        self.stopped = threading.Event()
+        self.previous = self.snapshot()
+        self.merged = {}
+        self.firstChange = None
+        self.lastChange = None
+        self.batches = 0
+
+    def snapshot(self):
+        '''
+        :returns {path: (size, mtime_ns)} of the .xlsx files in the input directories, master files excluded
+        '''
+        files = {}
+        for directory in self.directories:
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if not entry.name.endswith(".xlsx") or "master" in entry.name.lower(): continue
+                        if entry.name.startswith("~$"): continue
+                        try:
+                            stat = entry.stat()
+                        except OSError:
+                            continue
+                        if entry.is_file():
+                            files[entry.path] = (stat.st_size, stat.st_mtime_ns)
+            except OSError as e:
+                logging.error(f"{directory} - {e}")
+        return files
+
+    def poll(self, now=None):
+        '''
+        :returns True when the files in the input directories are due to be merged
+        '''
+        now = time.monotonic() if now is None else now
+        current = self.snapshot()
+        settled = current == self.previous
+        if not settled:
+            self.lastChange = now
+            if self.firstChange is None:
+                self.firstChange = now
+        self.previous = current
+        if self.firstChange is None: return False
+        if all(self.merged.get(path) == stat for path, stat in current.items()):
+            # Only files were removed, or those left by the last merge came back unchanged
+            self.firstChange = None
+            return False
+        if now - self.firstChange >= self.maxDelaySeconds:
+            if not settled:
+                logging.info(f"Files still arriving after {self.maxDelaySeconds}s, merging anyway")
+            return True
+        return settled and now - self.lastChange >= self.quietSeconds
+
+    def mergeBatch(self, merge):
+        self.batches += 1
+        # Only files there before the merge started count as merged, one arriving meanwhile is compared against
+        # this listing by the next poll and starts a batch of its own
+        listed = self.snapshot()
+        logging.info(f"Batch {self.batches} - {len(listed)} files waiting in the input directories")
+        try:
+            merge()
+        except Exception as e:
+            logging.error(f"Batch {self.batches} failed", exc_info=True)
+        finally:
+            # openpyxl workbooks are reference cycles, release them before the watcher goes back to sleep
+            gc.collect()
+        self.merged = self.previous = listed
+        self.firstChange = self.lastChange = None
+
+    def run(self, merge, mergeOnStart=True):
+        '''
+        :arg merge - Callable merging everything found in the input directories
+        :arg mergeOnStart - Merge files already waiting when the watcher starts
+
+        Runs until stop() is called, SIGTERM or Ctrl+C.
+        '''
+        for signalNumber in (signal.SIGINT, signal.SIGTERM):
+            try:
+                signal.signal(signalNumber, lambda *_: self.stop())
+            except ValueError:
+                # Not the main thread, the caller stops the watcher
+                break
+        logging.info(f"Watching {', '.join(map(str, self.directories))} every {self.intervalSeconds}s")
+        if mergeOnStart and len(self.previous) > 0:
+            self.mergeBatch(merge)
+        while not self.stopped.wait(self.intervalSeconds):
+            if self.poll():
+                self.mergeBatch(merge)
+        logging.info(f"Stopped watching after {self.batches} batches")
+
+    def stop(self):
+        self.stopped.set()